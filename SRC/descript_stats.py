@@ -30,6 +30,7 @@ import sys
 import psycopg2
 import time
 from postgres_functions import create_pg_connexion
+from hilucs_dictionary import decoded_columns, decode_label, LABEL_COMMENT
 
 def get_count_area(config_parameters, schema, table):
     """Function to get values of total number and total area 
@@ -67,12 +68,14 @@ def get_count_area(config_parameters, schema, table):
     return total, total_area
 
 
-def descript_stats_proportion(config_parameters, schema, table, total, total_area, where=""):
+def descript_stats_proportion(config_parameters, schema, table, total, total_area, where="", decode=False):
     """Function to compute proportion (in count and area) of records that correspond to the where condition  
     
     Args:
         connexion_param_dict (dict): A dictionnary containing informations for connection to the database. The dictionnary should have the following elements:
         'pg_host' with the server host, 'pg_port' with the server connexion port, 'pg_user' with the name of the user, 'pg_password' with the password of user, 'pg_dbname' with the name of the database.
+        decode (bool): If True, the table is encoded (see function 'encode_table') and the where condition is written with the codes 
+        and proportions as in the table before encoding, e.g. "WHERE walousmaj = '5_1'".
 
     Returns:
         A psycopg2 connexion object.
@@ -80,13 +83,16 @@ def descript_stats_proportion(config_parameters, schema, table, total, total_are
     ## Queries
     con = create_pg_connexion(config_parameters) # Create connexion
     cursor = con.cursor() # Create cursor
+    relation = "{0}.{1}".format(schema,table)
+    if decode:
+        relation = "(SELECT {0} FROM {1}) AS t".format(", ".join(decoded_columns(con, schema, table)), relation)
     # Count
-    query = "SELECT count(*) FROM {0}.{1} {2}"
-    cursor.execute(query.format(schema,table,where))
+    query = "SELECT count(*) FROM {0} {1}"
+    cursor.execute(query.format(relation,where))
     count = int(cursor.fetchone()[0]) # fetch the first row
     # Sum area
-    query = "SELECT sum(ST_area(geom))/1000000 FROM {0}.{1} {2}"   # Area in squared kilometers
-    cursor.execute(query.format(schema,table,where))
+    query = "SELECT sum(ST_area(geom))/1000000 FROM {0} {1}"   # Area in squared kilometers
+    cursor.execute(query.format(relation,where))
     area = float(cursor.fetchone()[0]) # fetch the first row
     # Close connection with database
     cursor.close()
@@ -96,4 +102,44 @@ def descript_stats_proportion(config_parameters, schema, table, total, total_are
     prop_count = (count*1.0/total*1.0)
     prop_area = (area*1.0/total_area*1.0)
     print("Count of records: %s (%s)"%(count,"{:.3%}".format(prop_count)))
-    print("Sum of area: %s sq. meter (%s)"%("{:.3f}".format(area),"{:.3%}".format(prop_area)))
\ No newline at end of file
+    print("Sum of area: %s sq. meter (%s)"%("{:.3f}".format(area),"{:.3%}".format(prop_area)))
+
+
+def descript_stats_by_class(config_parameters, schema, table, column, total, total_area):
+    """Function to compute proportion (in count and area) of records of each class of a column, in one query grouping the table 
+    by the column. If the column is encoded (see function 'encode_table'), the table is grouped by the smallint identifiers 
+    and only the identifiers of the classes are decoded.
+    
+    Args:
+        config_parameters (dict): A dictionnary containing informations for connection to the database. The dictionnary should have the following elements:
+        'pg_host' with the server host, 'pg_port' with the server connexion port, 'pg_user' with the name of the user, 'pg_password' with the password of user, 'pg_dbname' with the name of the database.
+        schema (str): Name of the schema where the table is located.
+        table (str): Name of the table.
+        column (str): Name of the column with the classes, e.g. 'walousmaj_l1'.
+        total (int): Total number of records of the table, used to compute the proportions (see function 'get_count_area').
+        total_area (float): Total area of the table (sq. kilometers), used to compute the proportions (see function 'get_count_area').
+
+    Returns:
+        A list of tuples with the class, the count and the area (sq. kilometers).
+    """
+    ## Queries
+    con = create_pg_connexion(config_parameters) # Create connexion
+    cursor = con.cursor() # Create cursor
+    # Dictionary of the column if encoded
+    query = "SELECT col_description(attrelid, attnum) FROM pg_attribute WHERE attrelid = '{0}.{1}'::regclass AND attname = %s"
+    cursor.execute(query.format(schema,table), (column,))
+    comment = (cursor.fetchone() or [None])[0] or ''
+    dictionary = comment[len(LABEL_COMMENT%''):] if comment.startswith(LABEL_COMMENT%'') else None
+    # Count and sum area by class
+    query = "SELECT {0}, n, area FROM (SELECT {1} AS class, count(*) AS n, COALESCE(sum(ST_area(geom)),0)/1000000 AS area FROM {2}.{3} GROUP BY 1) AS t ORDER BY 1"
+    cursor.execute(query.format(decode_label('class',dictionary),column,schema,table))
+    results = cursor.fetchall()
+    # Close connection with database
+    cursor.close()
+    # Close connexion to postgres database
+    con.close()
+    # Print information
+    for label, count, area in results:
+        print("%s - Count of records: %s (%s) - Sum of area: %s sq. kilometer (%s)"%(label,count,"{:.3%}".format(count*1.0/total),
+                                                                                    "{:.3f}".format(area),"{:.3%}".format(area*1.0/total_area)))
+    return results
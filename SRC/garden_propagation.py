@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+"""
+WALOUS_UTS - Copyright (C) <2020> <Service Public de Wallonie (SWP), Belgique,
+					          		Institut Scientifique de Service Public (ISSeP), Belgique,
+									Université catholique de Louvain (UCLouvain), Belgique,
+									Université Libre de Bruxelles (ULB), Belgique>
+						 							
+	
+List of the contributors to the development of WALOUS_UTS: see LICENSE file.
+Description and complete License: see LICENSE file.
+	
+This program (WALOUS_UTS) is free software:
+you can redistribute it and/or modify it under the terms of the
+GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option)
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program (see COPYING file).  If not,
+see <http://www.gnu.org/licenses/>.
+"""
+
+
+import io
+import sys
+import time
+import numpy as np
+import psycopg2
+from processing_time import print_processing_time
+from postgres_geom import build_adjacency
+
+
+def load_garden_graph(con, result_table_schema, result_table_name, adjacency_table, colum_label="walousmaj", chunksize=1000000):
+    '''Function to load in memory the adjacency of the parcels, as a compressed sparse row (CSR) structure, and the attributes of the parcels 
+    used by the postclassification rules of residential gardens. The parcels are numbered in the order of their 'capakey'.
+    
+    Args: 
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or 
+        using the custom function "create_PG_connexion" with database connexion parameters.
+        result_table_schema (str): Name of the schema where the table is located.
+        result_table_name (str): Name of the table with the classification results.
+        adjacency_table (str): Name of the table with the adjacency of the parcels ('schema.table'), see function 'build_adjacency'.
+        colum_label (str): The name of the attribute containing the classification results. Default value is "walousmaj".
+        chunksize (int): Number of edges fetched at once. The edges are copied in arrays allocated for the number of rows of the adjacency 
+        table, so that only one chunk is held as Python objects. Default value is 1000000.
+        
+    Returns:
+        dict: The keys of the parcels ('key'), the CSR structure ('indptr' and 'indices': the neighbours of the parcel i are 
+        indices[indptr[i]:indptr[i+1]]) and the arrays of attributes ('label', 'area', 'rnpp', 'card_hilucs', 'hilucs_1_1_1', 'nat_lu_1_1').
+    '''
+    cursor = con.cursor()
+    # Attributes of the parcels
+    query = "SELECT capakey, {label}, ST_Area(geom), rnpp_200m_mode, COALESCE(Cardinality(all_hilucs),-1), "
+    query += "EXISTS (SELECT 1 FROM unnest(all_hilucs) AS c WHERE c LIKE '1_1_1_%'), (nat_lu_maj = '1_1') IS TRUE "
+    query += "FROM {schema}.{table} ORDER BY capakey;"
+    query = query.format(label=colum_label, schema=result_table_schema, table=result_table_name)
+    print(query + "\n")
+    cursor.execute(query)
+    rows = cursor.fetchall()
+    graph = {'key': [x[0] for x in rows]}
+    graph['label'] = np.array([x[1] for x in rows], dtype=object)
+    graph['area'] = np.array([np.nan if x[2] is None else x[2] for x in rows], dtype=np.float64)
+    graph['rnpp'] = np.array([np.nan if x[3] is None else x[3] for x in rows], dtype=np.float64)
+    graph['card_hilucs'] = np.array([x[4] for x in rows], dtype=np.int64)
+    graph['hilucs_1_1_1'] = np.array([x[5] for x in rows], dtype=bool)
+    graph['nat_lu_1_1'] = np.array([x[6] for x in rows], dtype=bool)
+    del rows
+    # Edges as pairs of numbers of parcels, numbered in the same order. The number of rows of the adjacency table is an upper bound of 
+    # the number of edges (the edges of parcels missing in the table are dropped by the join)
+    cursor.execute("SELECT count(*) FROM %s;"%adjacency_table)
+    nedges = cursor.fetchone()[0]
+    cursor.close()
+    sources = np.empty(nedges, dtype=np.int64)
+    indices = np.empty(nedges, dtype=np.int64)
+    query = "WITH k AS (SELECT capakey, row_number() OVER (ORDER BY capakey) - 1 AS i FROM {schema}.{table}) "
+    query += "SELECT a.i, b.i FROM {adjacency} AS adj JOIN k AS a ON a.capakey = adj.base_id JOIN k AS b ON b.capakey = adj.neighbour_id "
+    query += "ORDER BY a.i"
+    query = query.format(schema=result_table_schema, table=result_table_name, adjacency=adjacency_table)
+    print(query + "\n")
+    # Server-side cursor, the edges are fetched by chunks
+    cursor = con.cursor(name='garden_graph_edges')
+    cursor.itersize = chunksize
+    cursor.execute(query)
+    n = 0
+    chunk = cursor.fetchmany(chunksize)
+    while chunk:
+        edges = np.array(chunk, dtype=np.int64).reshape(-1, 2)
+        sources[n:n + len(edges)] = edges[:,0]
+        indices[n:n + len(edges)] = edges[:,1]
+        n += len(edges)
+        chunk = cursor.fetchmany(chunksize)
+    cursor.close()
+    indices.resize(n, refcheck=False)
+    graph['indices'] = indices
+    graph['indptr'] = np.zeros(len(graph['key']) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources[:n], minlength=len(graph['key'])), out=graph['indptr'][1:])
+    del sources
+    print("%s parcels and %s edges loaded\n"%(len(graph['key']), n))
+    return graph
+
+
+def csr_neighbours(indptr, indices, nodes):
+    '''Function to get the neighbours of a set of nodes of a graph stored as a CSR structure, without loop on the nodes.
+    
+    Args: 
+        indptr (numpy array): Position of the first neighbour of each node in 'indices' (and number of edges as last value).
+        indices (numpy array): Neighbours of all nodes.
+        nodes (numpy array): Numbers of the nodes.
+        
+    Returns:
+        numpy array: Numbers of the neighbours (with duplicates).
+    '''
+    starts = indptr[nodes]
+    lengths = indptr[nodes + 1] - starts
+    total = lengths.sum()
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return indices[offsets + np.arange(total)]
+
+
+def garden_rule_eligibility(graph, rule):
+    '''Function to get the parcels meeting the conditions of a postclassification rule of residential gardens, except the 
+    condition of touching a residential parcel (see functions 'postclassif_residentialgardens_1' and 'postclassif_residentialgardens_2').
+    
+    Args: 
+        graph (dict): The graph returned by the function 'load_garden_graph'.
+        rule (int): The step of the postclassification of residential gardens (1 or 2).
+        
+    Returns:
+        numpy array: Boolean array.
+    '''
+    label = graph['label']
+    with np.errstate(invalid='ignore'):
+        if rule == 1:
+            return ((label == '1_1') | (label == '1_1_1')) & (graph['area'] < 2500) & (graph['rnpp'] >= 2) & ~graph['hilucs_1_1_1']
+        return (graph['card_hilucs'] == 1) & graph['nat_lu_1_1'] & (label == '1_1') & (graph['rnpp'] >= 2)
+
+
+def propagate_rule(graph, rule, postclas_rule, max_hops=None):
+    '''Function to apply a postclassification rule of residential gardens by frontier expansion: at each hop, the eligible parcels touching 
+    a parcel which became residential ('5_1') at the previous hop (or which was residential at the start) are reclassified as '5_1'. 
+    One hop gives the same result as the SQL function of the rule.
+    
+    Args: 
+        graph (dict): The graph returned by the function 'load_garden_graph'. The arrays 'label' and 'rule' are updated.
+        rule (int): The step of the postclassification of residential gardens (1 or 2).
+        postclas_rule (int): The number of the rule in the postclassification process.
+        max_hops (int): Maximum number of hops. Default value is None and the rule is applied until no parcel changes (fixpoint).
+        
+    Returns:
+        int: Number of parcels reclassified.
+    '''
+    eligible = garden_rule_eligibility(graph, rule)
+    frontier = np.flatnonzero(graph['label'] == '5_1')
+    nchanged = 0
+    hop = 0
+    while len(frontier) and (max_hops is None or hop < max_hops):
+        neighbours = np.unique(csr_neighbours(graph['indptr'], graph['indices'], frontier))
+        frontier = neighbours[eligible[neighbours]]
+        graph['label'][frontier] = '5_1'
+        graph['rule'][frontier] = postclas_rule
+        eligible[frontier] = False
+        nchanged += len(frontier)
+        hop += 1
+    return nchanged
+
+
+def propagate_gardens(con, result_table_schema, result_table_name, adjacency_table=None, max_hops=None, 
+                      postclassif_rules=(1, 2), colum_label="walousmaj", **kwargs):
+    '''Function to apply the postclassification of residential gardens (see functions 'postclassif_residentialgardens_1' and 
+    'postclassif_residentialgardens_2') in memory on the adjacency graph of the parcels, until a fixpoint is reached: a chain of 
+    garden parcels is then reclassified entirely instead of one parcel by pass. Both rules are applied in turn until no parcel changes. 
+    With 'max_hops' equal to 1, the result is the same as the two SQL functions. The changed labels and rule numbers are written back 
+    in one update. The column 'postclas_rule' should exist (see function 'add_column_postclass_rulenumber').
+    
+    Args: 
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or 
+        using the custom function "create_PG_connexion" with database connexion parameters.
+        result_table_schema (str): Name of the schema where the table is located.
+        result_table_name (str): Name of the table with the classification results.
+        adjacency_table (str): Name of the table with the adjacency of the parcels ('schema.table'). Default value is None and the table 
+        is created (or reused if up to date) with the function 'build_adjacency'.
+        max_hops (int): Maximum number of hops of each rule. If provided, each rule is applied only once. Default value is None (fixpoint).
+        postclassif_rules (tuple of int): The numbers of the two rules in the postclassification process. Default value is (1, 2).
+        colum_label (str): The name of the attribute containing the classification results. Default value is "walousmaj".
+        **kwargs: Options passed to the function 'build_adjacency' ('njobs', 'npartitions', 'connexion_param_dict').
+        
+    Returns:
+        This function has no return value. 
+    '''
+    try:
+        # Time at starting
+        begintime = time.time() 
+        if not adjacency_table:
+            adjacency_table = '%s.%s'%(result_table_schema, build_adjacency(con, result_table_schema, result_table_name, **kwargs))
+        graph = load_garden_graph(con, result_table_schema, result_table_name, adjacency_table, colum_label)
+        graph['rule'] = np.zeros(len(graph['key']), dtype=np.int64)
+        # Apply both rules in turn until no parcel changes
+        while True:
+            nchanged = 0
+            for rule, postclas_rule in zip((1, 2), postclassif_rules):
+                n = propagate_rule(graph, rule, postclas_rule, max_hops)
+                print("Rule %s: %s parcels reclassified"%(postclas_rule, n))
+                nchanged += n
+            if nchanged == 0 or max_hops is not None:
+                break
+        # Write the changed parcels back in one update
+        changed = np.flatnonzero(graph['rule'])
+        cursor = con.cursor()
+        query = "CREATE TEMPORARY TABLE tmp_garden_propagation (capakey varchar, label varchar, postclas_rule integer) ON COMMIT DROP;"
+        print(query + "\n")
+        cursor.execute(query)
+        data = io.StringIO("".join(["%s\t5_1\t%s\n"%(graph['key'][i], graph['rule'][i]) for i in changed]))
+        cursor.copy_expert("COPY tmp_garden_propagation FROM STDIN", data)
+        query = "UPDATE {schema}.{table} AS t SET {label} = tmp.label, postclas_rule = tmp.postclas_rule "
+        query += "FROM tmp_garden_propagation AS tmp WHERE t.capakey = tmp.capakey;"
+        query = query.format(schema=result_table_schema, table=result_table_name, label=colum_label)
+        print(query + "\n")
+        cursor.execute(query)
+        con.commit()
+        # Close connection with database
+        cursor.close()
+        ## Print processing time
+        print(print_processing_time(begintime, "Propagation of residential gardens (%s parcels) achieved in "%len(changed)))
+    except (Exception, psycopg2.DatabaseError) as error:
+        sys.exit(error)
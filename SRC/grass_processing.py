@@ -25,9 +25,14 @@ along with this program (see COPYING file).  If not,
 see <http://www.gnu.org/licenses/>.
 """
 
+import io
 import os
+import sys
+import time
+import psycopg2
 import grass.script as gscript
 import grass.script.setup as gsetup
+from processing_time import print_processing_time
 
 def rzonalclasses_sql_insert(table_name, header, value_dict, overwrite=True):
     """Function to import the csv resulting from the execution of r.zonal.classes as a table in a GRASSDATA (GRASS GIS) 
@@ -62,4 +67,156 @@ def rzonalclasses_sql_insert(table_name, header, value_dict, overwrite=True):
             fsql.write(insert_statement)
     fsql.write('END TRANSACTION;')
     fsql.close()
-    gscript.run_command('db.execute', input=sql_query, quiet=True)
\ No newline at end of file
+    gscript.run_command('db.execute', input=sql_query, quiet=True)
+
+
+def raster_prop_coverage(con, connexion_param_dict, basemap_schema, basemap_name, basemap_id, overlaymap_schema, overlaymap_name, capa_vector, resolution, **kwargs):
+    """Function to compute an approximation of the proportion of polygonal geometries from 'basemap', e.g. cadastral parcels, covered by polygonal geometries 
+    from 'overlaymap', using rasters instead of polygon intersections. The overlay is imported in GRASS GIS from PostGIS and rasterized together with the 
+    reference units at the given resolution, and the coverage of each reference unit is the number of cells of the overlay divided by the number of cells 
+    of the reference unit (zonal counting with r.stats). The result table has the same name and columns as the table created by the function 'prop_coverage' 
+    and its values can be used for exploratory runs (e.g. tuning of classification rules). Reference units smaller than a cell could be missing.
+    The error compared to the exact method ('prop_coverage') is computed and printed on a random sample of reference units.
+    Overlapping overlay polygons are rasterized once, so that the coverage can not exceed 1.0. With 'class_column', the overlay is rasterized once 
+    for each class (v.to.rast gives each cell to a single polygon, so that the classes of overlapping polygons would be undercounted in a single 
+    raster), which costs one rasterization by class: the coverage of each class is the one of the polygons of this class dissolved together. 
+    The exact coverage used for the error is the one stored by 'prop_coverage' (sum of the areas of intersection, clamped to 1.0), so that the 
+    error includes the effect of overlapping polygons. The computational region is set to the reference units for the rasterization and 
+    restored at the end. The function should be run in a GRASS GIS session where the reference units are already imported as vector map (see notebook A).
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        connexion_param_dict (dict): A dictionnary containing informations for connection to the database, used by v.in.ogr (see function "create_pg_connexion").
+        basemap_schema (str): Name of the schema where the table with reference units is located.
+        basemap_name (str): Name of the table with reference units.
+        basemap_id (str): Name of column with unique id in the table with reference units. The same column should exist in the attribute table of 'capa_vector'.
+        overlaymap_schema (str): Name of the schema where the table with ancillary data (overlaying layer) is located.
+        overlaymap_name (str): Name of the table with ancillary data (overlaying layer).
+        capa_vector (str): Name of the vector map of the reference units in GRASS GIS.
+        resolution (float): Resolution of the rasters (in map units).
+        **kwargs: 
+            'class_column' (str): Name of the column containing the type of class for overlaying polygons. If provided, the result table will have multiple columns corresponding to each distinct 'class_column' values.
+            'sample_size' (int): Number of reference units randomly selected for the computation of the error compared to the exact method. If 0, the error is not computed. Default value is 1000.
+            'keep_maps' (bool): If True, the rasters and the vector map of the overlay are kept in GRASS GIS. Default value is False.
+
+    Returns:
+        dict: Dictionnary with the number of reference units sampled ('n'), the mean absolute error ('mae'), the root mean square error ('rmse') and 
+        the maximum absolute error ('max') of the coverage, or None if the error is not computed.
+    """
+    try:
+        ## Saving current time for processing time management
+        begintime = time.time()
+        class_column = kwargs.get('class_column', None)
+        # Import the overlay from PostGIS
+        pg_input = "PG:dbname={dbname} host={host} user={user} password={password}".format(dbname=connexion_param_dict['pg_dbname'], 
+                    host=connexion_param_dict['pg_host'], user=connexion_param_dict['pg_user'], password=connexion_param_dict['pg_password'])
+        overlay_vector = "tmp_%s"%overlaymap_name
+        gscript.run_command('v.in.ogr', overwrite=True, quiet=True, flags='o', input=pg_input, 
+                            layer='%s.%s'%(overlaymap_schema,overlaymap_name), output=overlay_vector)
+        # Rasterize the reference units and the overlay at the given resolution, in a temporary region (see 'finally' below)
+        gscript.use_temp_region()
+        gscript.run_command('g.region', flags='a', vector=capa_vector, res=resolution)
+        cell_area = float(gscript.region()['nsres']) * float(gscript.region()['ewres'])
+        capa_raster = "tmp_%s_%s"%(capa_vector, str(resolution).replace('.','_'))
+        overlay_raster = "%s_%s"%(overlay_vector, str(resolution).replace('.','_'))
+        gscript.run_command('v.to.rast', overwrite=True, quiet=True, input=capa_vector, output=capa_raster, use='cat', memory=10000)
+        # Link between the categories of the rasters and the id of the reference units and the classes of the overlay
+        capa_ids = dict([(int(k), v[0]) for k, v in gscript.vector_db_select(capa_vector, columns=basemap_id)['values'].items()])
+        if class_column:
+            overlay_classes = dict([(int(k), v[0]) for k, v in gscript.vector_db_select(overlay_vector, columns=class_column)['values'].items()])
+            classes = sorted(set([str(x) for x in overlay_classes.values() if x not in (None, '')]))
+            # One raster by class, so that each class gets all the cells of its polygons even where polygons of other classes overlap them
+            overlay_rasters = [("%s_%s"%(overlay_raster, i), x) for i, x in enumerate(classes, 1)]
+            for raster, _class in overlay_rasters:
+                gscript.run_command('v.to.rast', overwrite=True, quiet=True, input=overlay_vector, output=raster, use='val', value=1, 
+                                    where="%s = '%s'"%(class_column, str(_class).replace("'","''")), memory=10000)
+        else:
+            overlay_rasters = [(overlay_raster, None)]
+            gscript.run_command('v.to.rast', overwrite=True, quiet=True, input=overlay_vector, output=overlay_raster, use='val', value=1, memory=10000)
+        print(print_processing_time(begintime, "Rasterization achieved in "))
+        # Zonal counting of the cells
+        capa_cells = {}
+        for line in gscript.read_command('r.stats', flags='cn', input=capa_raster, separator='|').splitlines():
+            cat, count = line.split('|')
+            capa_cells[int(cat)] = int(count)
+        overlay_cells = {}
+        for raster, key in overlay_rasters:
+            for line in gscript.read_command('r.stats', flags='cn', input='%s,%s'%(capa_raster,raster), separator='|').splitlines():
+                cat, value, count = line.split('|')
+                overlay_cells.setdefault(int(cat), {})
+                overlay_cells[int(cat)][key] = overlay_cells[int(cat)].get(key, 0) + int(count)
+        # Coverage by reference unit (and by class)
+        coverage = {}
+        for cat, counts in overlay_cells.items():
+            coverage[str(capa_ids[cat])] = dict([(k, (v, round(float(v)/capa_cells[cat], 4))) for k, v in counts.items()])
+        print(print_processing_time(begintime, "Zonal counting achieved in "))
+        # Create the result table
+        cursor = con.cursor()
+        table_name = '%s_overlay_%s'%(basemap_name,overlaymap_name)
+        query = "SELECT format_type(atttypid, atttypmod) FROM pg_attribute WHERE attrelid = '{schema}.{table}'::regclass AND attname = %s;"
+        cursor.execute(query.format(schema=basemap_schema, table=basemap_name), (basemap_id,))
+        id_type = 'varchar' if class_column else cursor.fetchone()[0]
+        columns = ["%s_%s %s"%(basemap_id, overlaymap_name, id_type)]
+        if class_column:
+            [columns.append("%s_prop_%s numeric"%(overlaymap_name, x)) for x in classes]
+        else:
+            columns += ["%s_area numeric"%overlaymap_name, "%s_coverage numeric"%overlaymap_name]
+        query = "DROP TABLE IF EXISTS {schema}.{table}; CREATE TABLE {schema}.{table} ({columns});"
+        query = query.format(schema=overlaymap_schema, table=table_name, columns=", ".join(columns))
+        print(query + "\n")
+        cursor.execute(query)
+        # Write the rows with COPY
+        lines = []
+        for capa_id, values in coverage.items():
+            if class_column:
+                row = [str(capa_id)] + ["%.4f"%values[x][1] if x in values else "\\N" for x in classes]
+            else:
+                row = [str(capa_id), "%.4f"%(values[None][0]*cell_area), "%.4f"%values[None][1]]
+            lines.append("\t".join(row) + "\n")
+        cursor.copy_expert("COPY {schema}.{table} FROM STDIN".format(schema=overlaymap_schema, table=table_name), io.StringIO("".join(lines)))
+        con.commit()
+        print(print_processing_time(begintime, "Computation of approximate PropCoverage (raster at resolution %s) achieved in "%resolution))
+        # Remove temporary maps
+        if not kwargs.get('keep_maps', False):
+            gscript.run_command('g.remove', flags='f', quiet=True, type='raster', name=','.join([capa_raster] + [x[0] for x in overlay_rasters]))
+            gscript.run_command('g.remove', flags='f', quiet=True, type='vector', name=overlay_vector)
+        # Error compared to the exact method on a random sample of reference units intersecting the overlay, with the same expression as 
+        # the function 'prop_coverage' (sum of the areas of intersection, clamped to 1.0 below)
+        errors = None
+        sample_size = int(kwargs.get('sample_size', 1000))
+        if sample_size > 0:
+            query = "WITH sample AS (SELECT {id_}, geom FROM {b_schema}.{b_name} AS base WHERE EXISTS (SELECT 1 FROM {o_schema}.{o_name} AS overlay "
+            query += "WHERE st_intersects(base.geom,overlay.geom)) ORDER BY random() LIMIT {n}) "
+            query += "SELECT base.{id_}, {_class}ROUND(CAST(SUM(st_area(st_Intersection(base.geom,overlay.geom))/st_area(base.geom)) AS numeric),4) "
+            query += "FROM sample AS base JOIN {o_schema}.{o_name} AS overlay ON st_intersects(base.geom,overlay.geom) "
+            query += "GROUP BY base.{id_}{group_by};"
+            query = query.format(id_=basemap_id, b_schema=basemap_schema, b_name=basemap_name, o_schema=overlaymap_schema, 
+                                 o_name=overlaymap_name, n=sample_size, _class="overlay.%s, "%class_column if class_column else "NULL, ", 
+                                 group_by=", overlay.%s"%class_column if class_column else "")
+            print(query + "\n")
+            cursor.execute(query)
+            exact = {}
+            for capa_id, _class, value in cursor.fetchall():
+                if class_column and _class in (None, ''):
+                    continue
+                # The ids and classes read in GRASS GIS are strings
+                capa_id, _class = str(capa_id), str(_class) if class_column else None
+                exact.setdefault(capa_id, {})
+                exact[capa_id][_class] = min(float(value), 1.0)
+            differences = []
+            for capa_id, values in exact.items():
+                approx = coverage.get(capa_id, {})
+                keys = classes if class_column else [None]
+                [differences.append(abs(values.get(k, 0.0) - approx.get(k, (0, 0.0))[1])) for k in keys]
+            if differences:
+                errors = {'n': len(exact), 'mae': sum(differences)/len(differences), 
+                          'rmse': (sum([x*x for x in differences])/len(differences))**0.5, 'max': max(differences)}
+                print("Error of the approximate coverage on %s sampled reference units: mean absolute error %s, RMSE %s, max absolute error %s"%(
+                      errors['n'], round(errors['mae'],4), round(errors['rmse'],4), round(errors['max'],4)))
+        cursor.close()
+        return errors
+    except (Exception, psycopg2.DatabaseError) as error:
+        sys.exit(error)
+    finally:
+        # Restore the computational region of the session
+        gscript.del_temp_region()
@@ -0,0 +1,576 @@
+#!/usr/bin/env python
+"""
+WALOUS_UTS - Copyright (C) <2020> <Service Public de Wallonie (SWP), Belgique,
+					          		Institut Scientifique de Service Public (ISSeP), Belgique,
+									Université catholique de Louvain (UCLouvain), Belgique,
+									Université Libre de Bruxelles (ULB), Belgique>
+						 							
+	
+List of the contributors to the development of WALOUS_UTS: see LICENSE file.
+Description and complete License: see LICENSE file.
+	
+This program (WALOUS_UTS) is free software:
+you can redistribute it and/or modify it under the terms of the
+GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option)
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program (see COPYING file).  If not,
+see <http://www.gnu.org/licenses/>.
+"""
+
+
+import re
+import sys
+import time
+import psycopg2
+from processing_time import print_processing_time
+from postgres_parallel import update_table
+
+## Columns containing codes of the legend scheme, stored as text by the processing chain
+LABEL_COLUMNS = ['walousmaj', 'walousmaj_l1', 'walousmaj_l2', 'walousmaj_l3', 'walousmaj_l4', 'hilucslanduse_1', 'nat_lu_maj', 'dbris_maj']
+## Comments of the encoded columns, used to decode them
+LABEL_COMMENT = "encoded with %s"
+SCALE_COMMENT = "scaled by %s"
+## Number of bits of the bitsets of arrays of codes, i.e. maximum identifier of the dictionary they can contain
+BITSET_LENGTH = 256
+
+
+def decode_label(column, dictionary=None):
+    """Function to get the expression giving the code (e.g. '5_1_D') of a column with classification results, 
+    either stored as text or encoded with a dictionary table (see function 'create_hilucs_dictionary').
+
+    Args:
+        column (str): The column (or expression) containing the code.
+        dictionary (str): Name of the dictionary table ('schema.table'). Default value is None (the column is not encoded).
+
+    Returns:
+        str: The expression.
+    """
+    if not dictionary:
+        return column
+    return "%s_decode(%s)"%(dictionary,column)
+
+
+def encode_label(expression, dictionary=None):
+    """Function to get the expression to be stored in a column with classification results, either stored as text or encoded 
+    with a dictionary table (see function 'create_hilucs_dictionary'). The codes missing in the dictionary are added.
+
+    Args:
+        expression (str): The expression giving the code (e.g. "'5_1'").
+        dictionary (str): Name of the dictionary table ('schema.table'). Default value is None (the column is not encoded).
+
+    Returns:
+        str: The expression.
+    """
+    if not dictionary:
+        return expression
+    return "%s_encode(%s)"%(dictionary,expression)
+
+
+def label_comment_query(schema, table, column, dictionary):
+    """Function to get the query setting the comment of an encoded column, used to decode it (see function 'create_decoding_view').
+
+    Args:
+        schema (str): Name of the schema where the table is located.
+        table (str): Name of the table.
+        column (str): Name of the encoded column.
+        dictionary (str): Name of the dictionary table ('schema.table').
+
+    Returns:
+        str: The COMMENT query.
+    """
+    return "COMMENT ON COLUMN %s.%s.%s IS '%s'"%(schema,table,column,LABEL_COMMENT%dictionary)
+
+
+def create_hilucs_dictionary(con, schema, dictionary_table='hilucs_dictionary', codes=None):
+    """Function to create the dictionary table shared by the tables with encoded classification results, if it does not exist yet. 
+    Each code (e.g. '5_1_D') has a smallint identifier ('id') and its level ('level'). The identifiers are never changed, so that the 
+    dictionary can be shared by several tables. Two functions are created next to the table: '<dictionary_table>_decode(smallint)' 
+    giving the code of an identifier and '<dictionary_table>_encode(text)' giving the identifier of a code, adding the codes missing 
+    in the dictionary.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        schema (str): Name of the schema where the dictionary should be created.
+        dictionary_table (str): Name of the dictionary table. Default value is 'hilucs_dictionary'.
+        codes (list of str): Codes to be added to the dictionary, with the codes of their upper levels. Default value is None.
+
+    Returns:
+        str: The name of the dictionary table ('schema.table').
+    """
+    dictionary = '%s.%s'%(schema,dictionary_table)
+    cursor = con.cursor()
+    query = "CREATE TABLE IF NOT EXISTS {d} (id smallserial PRIMARY KEY, code text NOT NULL UNIQUE, level smallint);"
+    query += "CREATE OR REPLACE FUNCTION {d}_decode(smallint) RETURNS text AS 'SELECT code FROM {d} WHERE id = $1' LANGUAGE sql STABLE;"
+    query += "CREATE OR REPLACE FUNCTION {d}_encode(label text) RETURNS smallint AS $$ "
+    query += "DECLARE result smallint; "
+    query += "BEGIN "
+    query += "IF label IS NULL THEN RETURN NULL; END IF; "
+    query += "SELECT id INTO result FROM {d} WHERE code = label; "
+    query += "IF result IS NULL THEN "
+    query += "INSERT INTO {d} (code, level) SELECT label, cardinality(string_to_array(label,'_')) "
+    query += "WHERE NOT EXISTS (SELECT 1 FROM {d} WHERE code = label) ON CONFLICT (code) DO NOTHING; "
+    query += "SELECT id INTO result FROM {d} WHERE code = label; "
+    query += "END IF; "
+    query += "RETURN result; "
+    query += "END $$ LANGUAGE plpgsql;"
+    query = query.format(d=dictionary)
+    print(query + "\n")
+    cursor.execute(query)
+    if codes:
+        # Codes and their upper levels, sorted to get identifiers in the order of the legend
+        levels = set()
+        [levels.update('_'.join(x.split('_')[:i]) for i in range(1,len(x.split('_'))+1)) for x in codes if x]
+        # Only the missing codes are inserted, so that no value of the sequence of the identifiers is used by the existing codes
+        query = "INSERT INTO {d} (code, level) SELECT c, l FROM unnest(%s::text[], %s::smallint[]) WITH ORDINALITY AS t(c, l, o) "
+        query += "WHERE NOT EXISTS (SELECT 1 FROM {d} AS d WHERE d.code = t.c) ORDER BY o ON CONFLICT (code) DO NOTHING;"
+        levels = sorted(levels)
+        cursor.execute(query.format(d=dictionary), (levels, [len(x.split('_')) for x in levels]))
+    con.commit()
+    cursor.close()
+    return dictionary
+
+
+def check_scaled_range(con, relation, columns, scale):
+    """Function to check that the values of columns can be stored as smallint values once multiplied by 'scale' (see function 'encode_table'), 
+    i.e. that their absolute value is at most 32767 / 'scale' (3.2767 with the default scale). A ValueError is raised otherwise.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        relation (str): Name of the table with the values ('schema.table').
+        columns (list of str): Names of the columns to be checked.
+        scale (int): Multiplier of the values.
+
+    Returns:
+        This function has no return value.
+    """
+    if not columns:
+        return
+    cursor = con.cursor()
+    query = "SELECT %s FROM %s;"%(", ".join(["max(abs(%s))"%x for x in columns]),relation)
+    cursor.execute(query)
+    maximums = cursor.fetchone()
+    cursor.close()
+    invalid = ["%s (%s)"%(name,value) for name, value in zip(columns, maximums) if value is not None and round(float(value)*scale) > 32767]
+    if invalid:
+        raise ValueError("The values of columns %s of %s are too large to be stored as smallint with scale %s, use proportion_type='real'."%(
+            ", ".join(invalid),relation,scale))
+
+
+def encode_table(con, schema, table, dictionary, label_columns=None, proportion_columns=None, proportion_type='real', scale=10000):
+    """Function to convert a table with classification results to a compact storage: the columns with codes of the legend scheme 
+    are replaced by smallint identifiers of a dictionary table (see function 'create_hilucs_dictionary') and the numeric columns 
+    with proportions are replaced by real values or by smallint values multiplied by 'scale'. All the columns are converted in one 
+    rewrite of the table. The converted columns get a comment used to decode them (see function 'create_decoding_view').
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        schema (str): Name of the schema where the table is located.
+        table (str): Name of the table to be converted.
+        dictionary (str): Name of the dictionary table ('schema.table').
+        label_columns (list of str): Columns with codes to be encoded. Default value is None and the columns of 'LABEL_COLUMNS' stored as text are used.
+        proportion_columns (list of str): Columns with proportions to be converted. Default value is None and the numeric columns with names 
+        containing '_prop_' or ending with '_coverage' are used.
+        proportion_type (str): Either 'real' or 'scaled' (smallint values multiplied by 'scale'). Default value is 'real'. With 'scaled', the 
+        values should be at most 32767 / 'scale' (see function 'check_scaled_range'), which is not the case of coverages which are not clamped.
+        scale (int): Multiplier of the proportions stored as smallint. Default value is 10000 (4 decimals, as the proportions computed with 'prop_coverage').
+
+    Returns:
+        This function has no return value.
+    """
+    try:
+        ## Saving current time for processing time management
+        begintime = time.time()
+        cursor = con.cursor()
+        query = "SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute WHERE attrelid = '%s.%s'::regclass "%(schema,table)
+        query += "AND attnum > 0 AND NOT attisdropped ORDER BY attnum;"
+        cursor.execute(query)
+        columns = cursor.fetchall()
+        if label_columns is None:
+            label_columns = [x[0] for x in columns if x[0] in LABEL_COLUMNS and (x[1] == 'text' or x[1].startswith('character varying'))]
+        if proportion_columns is None:
+            proportion_columns = [x[0] for x in columns if x[1].startswith('numeric') and ('_prop_' in x[0] or x[0].endswith('_coverage'))]
+        if not label_columns and not proportion_columns:
+            print("No column to be converted in table %s.%s\n"%(schema,table))
+            return
+        # Add the codes of the table in the dictionary
+        if label_columns:
+            query = "SELECT DISTINCT unnest(ARRAY[%s]::text[]) FROM %s.%s;"%(','.join(label_columns),schema,table)
+            cursor.execute(query)
+            create_hilucs_dictionary(con, *dictionary.split('.'), codes=[x[0] for x in cursor.fetchall()])
+        if proportion_type == 'scaled':
+            check_scaled_range(con, '%s.%s'%(schema,table), proportion_columns, scale)
+        # Convert all the columns in one rewrite of the table
+        alter = ["ALTER COLUMN %s TYPE smallint USING %s"%(x,encode_label('%s::text'%x,dictionary)) for x in label_columns]
+        if proportion_type == 'scaled':
+            alter += ["ALTER COLUMN %s TYPE smallint USING round(%s * %s)::smallint"%(x,x,scale) for x in proportion_columns]
+        else:
+            alter += ["ALTER COLUMN %s TYPE real USING %s::real"%(x,x) for x in proportion_columns]
+        queries = ["ALTER TABLE %s.%s %s"%(schema,table,', '.join(alter))]
+        queries += [label_comment_query(schema,table,x,dictionary) for x in label_columns]
+        if proportion_type == 'scaled':
+            queries += ["COMMENT ON COLUMN %s.%s.%s IS '%s'"%(schema,table,x,SCALE_COMMENT%scale) for x in proportion_columns]
+        print(';\n'.join(queries)+';\n')
+        cursor.execute(';\n'.join(queries))
+        con.commit()
+        cursor.close()
+        print(print_processing_time(begintime, "Encoding of %s columns of table %s.%s achieved in "%(len(label_columns)+len(proportion_columns),schema,table)))
+    except (Exception, psycopg2.DatabaseError) as error:
+        sys.exit(error)
+
+
+def decoded_columns(con, schema, table):
+    """Function to get the columns of a table with the expressions decoding the columns converted with the function 'encode_table' 
+    (found with their comment), keeping the names of the columns.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        schema (str): Name of the schema where the table is located.
+        table (str): Name of the table.
+
+    Returns:
+        list of str: The expressions of the columns, to be used in a SELECT.
+    """
+    cursor = con.cursor()
+    query = "SELECT attname, col_description(attrelid, attnum) FROM pg_attribute WHERE attrelid = '%s.%s'::regclass "%(schema,table)
+    query += "AND attnum > 0 AND NOT attisdropped ORDER BY attnum;"
+    cursor.execute(query)
+    columns = []
+    for name, comment in cursor.fetchall():
+        label = re.match('^%s$'%(LABEL_COMMENT%r'([\w\.]+)'), comment or '')
+        scaled = re.match('^%s$'%(SCALE_COMMENT%r'(\d+)'), comment or '')
+        if label:
+            columns.append('%s AS "%s"'%(decode_label('"%s"'%name,label.group(1)),name))
+        elif scaled:
+            columns.append('"%s"::real / %s AS "%s"'%(name,scaled.group(1),name))
+        else:
+            columns.append('"%s"'%name)
+    cursor.close()
+    return columns
+
+
+def encoded_columns(con, schema, table, columns, source=None):
+    """Function to get the expressions converting values with codes as text and proportions as numeric (e.g. from a table which 
+    is not encoded) to the storage of the columns of a table converted with the function 'encode_table' (found with their comment).
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        schema (str): Name of the schema where the encoded table is located.
+        table (str): Name of the encoded table.
+        columns (list of str): Names of the columns to be converted.
+        source (str): Name of the table with the values to be converted ('schema.table'). If provided, the values of the scaled 
+        columns are checked (see function 'check_scaled_range'). Default value is None.
+
+    Returns:
+        list of str: The expressions of the columns, to be used in a SELECT.
+    """
+    cursor = con.cursor()
+    query = "SELECT attname, col_description(attrelid, attnum) FROM pg_attribute WHERE attrelid = '%s.%s'::regclass "%(schema,table)
+    query += "AND attnum > 0 AND NOT attisdropped;"
+    cursor.execute(query)
+    comments = dict(cursor.fetchall())
+    cursor.close()
+    expressions = []
+    for name in columns:
+        label = re.match('^%s$'%(LABEL_COMMENT%r'([\w\.]+)'), comments.get(name) or '')
+        scaled = re.match('^%s$'%(SCALE_COMMENT%r'(\d+)'), comments.get(name) or '')
+        if label:
+            expressions.append(encode_label('%s::text'%name,label.group(1)))
+        elif scaled:
+            if source:
+                check_scaled_range(con, source, [name], int(scaled.group(1)))
+            expressions.append('round(%s * %s)::smallint'%(name,scaled.group(1)))
+        else:
+            expressions.append(name)
+    return expressions
+
+
+def create_decoding_view(con, schema, table, view_name=None):
+    """Function to create a view of a table converted with the function 'encode_table', with the codes and proportions decoded and 
+    the names of the columns of the table, to be used by end-users and by the queries written for the original table. The view 
+    should be created again when columns are added to the table.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        schema (str): Name of the schema where the table is located.
+        table (str): Name of the table.
+        view_name (str): Name of the view. Default value is None and '<table>_decoded' is used.
+
+    Returns:
+        str: The name of the view ('schema.view').
+    """
+    try:
+        view_name = view_name if view_name else '%s_decoded'%table
+        cursor = con.cursor()
+        query = "DROP VIEW IF EXISTS %s.%s; CREATE VIEW %s.%s AS SELECT %s FROM %s.%s;"%(schema,view_name,schema,view_name,
+                                                                                    ', '.join(decoded_columns(con, schema, table)),schema,table)
+        print(query + "\n")
+        cursor.execute(query)
+        con.commit()
+        cursor.close()
+        return '%s.%s'%(schema,view_name)
+    except (Exception, psycopg2.DatabaseError) as error:
+        sys.exit(error)
+
+
+def copy_column_comments(con, source_schema, source_table, schema, table):
+    """Function to copy the comments of the columns of a table to the columns with the same names of another table (e.g. a copy 
+    of the table created with CREATE TABLE AS), so that the encoded columns can still be decoded (see function 'create_decoding_view').
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        source_schema (str): Name of the schema where the source table is located.
+        source_table (str): Name of the table with the comments.
+        schema (str): Name of the schema where the table is located.
+        table (str): Name of the table on which the comments should be set.
+
+    Returns:
+        This function has no return value.
+    """
+    cursor = con.cursor()
+    query = "SELECT s.attname, col_description(s.attrelid, s.attnum) FROM pg_attribute AS s JOIN pg_attribute AS t ON t.attname = s.attname "
+    query += "WHERE s.attrelid = '%s.%s'::regclass AND t.attrelid = '%s.%s'::regclass "%(source_schema,source_table,schema,table)
+    query += "AND s.attnum > 0 AND t.attnum > 0 AND NOT t.attisdropped AND col_description(s.attrelid, s.attnum) IS NOT NULL;"
+    cursor.execute(query)
+    for name, comment in cursor.fetchall():
+        cursor.execute("COMMENT ON COLUMN %s.%s.%s IS %%s"%(schema,table,name), (comment,))
+    con.commit()
+    cursor.close()
+
+
+def hilucs_code_ids(con, dictionary, codes):
+    """Function to get the identifiers of codes in a dictionary table (see function 'create_hilucs_dictionary'). 
+    The codes missing in the dictionary are added in the current transaction, which is committed by the caller.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        dictionary (str): Name of the dictionary table ('schema.table').
+        codes (list of str): The codes, e.g. ['1_1_1', '8_8'].
+
+    Returns:
+        list of int: The identifiers of the codes, in the same order.
+    """
+    cursor = con.cursor()
+    cursor.execute("SELECT %s FROM unnest(%%s::text[]) WITH ORDINALITY AS t(c, o) ORDER BY o;"%encode_label('c',dictionary), (list(codes),))
+    ids = [x[0] for x in cursor.fetchall()]
+    cursor.close()
+    return ids
+
+
+def label_literals(con, dictionary, codes):
+    """Function to get the SQL literals to be compared with (or stored in) a column with codes, either stored as text (the quoted codes) 
+    or encoded with a dictionary table (the identifiers of the codes, see function 'hilucs_code_ids'), so that the encoded columns are 
+    compared without decoding each row.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        dictionary (str): Name of the dictionary table ('schema.table'). Default value is None (the column is not encoded).
+        codes (list of str): The codes, e.g. ['1_1', '1_1_1'].
+
+    Returns:
+        dict: The literal of each code.
+    """
+    codes = list(codes)
+    if not dictionary:
+        return dict((x, "'%s'"%x) for x in codes)
+    return dict(zip(codes, [str(x) for x in hilucs_code_ids(con, dictionary, codes)]))
+
+
+def dictionary_codes(con, dictionary):
+    """Function to get all the codes of a dictionary table (see function 'create_hilucs_dictionary').
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        dictionary (str): Name of the dictionary table ('schema.table').
+
+    Returns:
+        list of str: The codes, ordered by identifier.
+    """
+    cursor = con.cursor()
+    cursor.execute("SELECT code FROM %s ORDER BY id;"%dictionary)
+    codes = [x[0] for x in cursor.fetchall()]
+    cursor.close()
+    return codes
+
+
+def decode_case(con, dictionary, column):
+    """Function to get the CASE expression giving the code of an encoded column from the identifiers of all the codes of the dictionary 
+    table, resolved once instead of a lookup of the dictionary for each row (see function 'decode_label').
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        dictionary (str): Name of the dictionary table ('schema.table'). Default value is None (the column is not encoded).
+        column (str): The column (or expression) containing the identifier.
+
+    Returns:
+        str: The CASE expression.
+    """
+    if not dictionary:
+        return column
+    cursor = con.cursor()
+    cursor.execute("SELECT id, code FROM %s ORDER BY id;"%dictionary)
+    case_query = "CASE %s "%column + "".join(["WHEN %s THEN '%s' "%x for x in cursor.fetchall()]) + "END"
+    cursor.close()
+    return case_query
+
+
+def encode_all_hilucs(con, schema, table, dictionary, column='all_hilucs', parallel=False, **kwargs):
+    """Function to add encoded representations of an array of codes (e.g. 'all_hilucs') using the identifiers of a dictionary table 
+    (see function 'create_hilucs_dictionary'), so that the membership of codes can be tested without unnesting the array:
+    '<column>_ids' (smallint[]) with the identifiers of the codes of the array, '<column>_ancestors' (smallint[]) with the identifiers 
+    of the upper levels of the codes (e.g. '1' and '1_1' for '1_1_1'), both with a GIN index, and '<column>_bits' (bit(BITSET_LENGTH)) 
+    where the bit of each code and of its upper levels is set. The columns are NULL if the array is NULL and the NULL items of the 
+    array are ignored. The predicates on these 
+    columns are written with the functions 'hilucs_member', 'hilucs_subtree', 'hilucs_descendant' and 'hilucs_only'.
+    The columns should be computed again if the array is changed.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        schema (str): Name of the schema where the table is located.
+        table (str): Name of the table.
+        dictionary (str): Name of the dictionary table ('schema.table').
+        column (str): Name of the array of codes. Default value is 'all_hilucs'.
+        parallel (bool): If True, the update is executed in parallel on ranges of the table (see function 'parallel_update'). Default value is False.
+        **kwargs: Options of the parallel update ('connexion_param_dict', 'njobs', 'npartitions', 'key_column', 'retries'), see function 'update_table'.
+
+    Returns:
+        This function has no return value.
+    """
+    try:
+        ## Saving current time for processing time management
+        begintime = time.time()
+        cursor = con.cursor()
+        # Add the codes of the table and their upper levels in the dictionary
+        query = "SELECT DISTINCT unnest(%s) FROM %s.%s;"%(column,schema,table)
+        cursor.execute(query)
+        create_hilucs_dictionary(con, *dictionary.split('.'), codes=[x[0] for x in cursor.fetchall()])
+        cursor.execute("SELECT max(id) FROM %s;"%dictionary)
+        if (cursor.fetchone()[0] or 0) > BITSET_LENGTH:
+            raise ValueError("The dictionary %s has more than %s codes, they can not be stored in a bitset."%(dictionary,BITSET_LENGTH))
+        # Add columns
+        queries = []
+        queries.append("ALTER TABLE %s.%s ADD COLUMN IF NOT EXISTS %s_ids smallint[]"%(schema,table,column))
+        queries.append("ALTER TABLE %s.%s ADD COLUMN IF NOT EXISTS %s_ancestors smallint[]"%(schema,table,column))
+        queries.append("ALTER TABLE %s.%s ADD COLUMN IF NOT EXISTS %s_bits bit(%s)"%(schema,table,column,BITSET_LENGTH))
+        print(';\n'.join(queries)+';\n')
+        cursor.execute(';\n'.join(queries))
+        con.commit()
+        # Identifiers of the codes, of their upper levels and bitset of both
+        ancestor = "left(c, length(d.code) + 1) = d.code || '_'"
+        zero = "lpad('', %s, '0')::bit(%s)"%(BITSET_LENGTH,BITSET_LENGTH)
+        set_clause = "{c}_ids = (CASE WHEN {c} IS NOT NULL THEN ARRAY(SELECT DISTINCT d.id FROM unnest({c}) AS c JOIN {d} AS d ON d.code = c ORDER BY 1) END), "
+        set_clause += "{c}_ancestors = (CASE WHEN {c} IS NOT NULL THEN ARRAY(SELECT d.id FROM {d} AS d "
+        set_clause += "WHERE EXISTS (SELECT 1 FROM unnest({c}) AS c WHERE {a}) ORDER BY 1) END), "
+        set_clause += "{c}_bits = (CASE WHEN {c} IS NOT NULL THEN (SELECT COALESCE(bit_or(set_bit({z}, d.id - 1, 1)), {z}) FROM {d} AS d "
+        set_clause += "WHERE EXISTS (SELECT 1 FROM unnest({c}) AS c WHERE c = d.code OR {a})) END)"
+        update_table(con, schema, table, set_clause.format(c=column, d=dictionary, a=ancestor, z=zero), parallel=parallel, **kwargs)
+        # Indexes of the arrays of identifiers
+        queries = []
+        for suffix in ('ids', 'ancestors'):
+            queries.append("DROP INDEX IF EXISTS %s.%s_%s_%s_idx"%(schema,table,column,suffix))
+            queries.append("CREATE INDEX %s_%s_%s_idx ON %s.%s USING gin (%s_%s)"%(table,column,suffix,schema,table,column,suffix))
+        queries.append("ANALYZE %s.%s"%(schema,table))
+        print(';\n'.join(queries)+';\n')
+        cursor.execute(';\n'.join(queries))
+        con.commit()
+        cursor.close()
+        print(print_processing_time(begintime, "Encoding of column '%s' of table %s.%s achieved in "%(column,schema,table)))
+    except (Exception, psycopg2.DatabaseError) as error:
+        sys.exit(error)
+
+
+def has_encoded_array(con, schema, table, column='all_hilucs'):
+    """Function to check if the encoded representations of an array of codes were added to a table (see function 'encode_all_hilucs').
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        schema (str): Name of the schema where the table is located.
+        table (str): Name of the table.
+        column (str): Name of the array of codes. Default value is 'all_hilucs'.
+
+    Returns:
+        bool: True if the table has the encoded columns.
+    """
+    cursor = con.cursor()
+    query = "SELECT count(*) FROM information_schema.columns WHERE table_schema = %s AND table_name = %s AND column_name IN %s;"
+    cursor.execute(query, (schema, table, tuple('%s_%s'%(column,x) for x in ('ids','ancestors','bits'))))
+    result = cursor.fetchone()[0] == 3
+    cursor.close()
+    return result
+
+
+def hilucs_member(con, dictionary, codes, column='all_hilucs'):
+    """Function to get the predicate testing if one of the codes is in the array of codes, e.g. 'all_hilucs' (indexed, 
+    see function 'encode_all_hilucs'). For one code, the predicate is equivalent to "'1_1' = ANY(all_hilucs)".
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        dictionary (str): Name of the dictionary table ('schema.table').
+        codes (list of str): The codes, e.g. ['1_1'].
+        column (str): Name of the array of codes. Default value is 'all_hilucs'.
+
+    Returns:
+        str: The predicate.
+    """
+    return "%s_ids && '{%s}'::smallint[]"%(column,','.join(str(x) for x in hilucs_code_ids(con, dictionary, codes)))
+
+
+def hilucs_descendant(con, dictionary, code, column='all_hilucs'):
+    """Function to get the predicate testing if a code more detailed than a code is in the array of codes, e.g. 'all_hilucs' (indexed, 
+    see function 'encode_all_hilucs'). The predicate is equivalent to "EXISTS (SELECT 1 FROM unnest(all_hilucs) AS c WHERE c LIKE '1_1_1_%')".
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        dictionary (str): Name of the dictionary table ('schema.table').
+        code (str): The code, e.g. '1_1_1'.
+        column (str): Name of the array of codes. Default value is 'all_hilucs'.
+
+    Returns:
+        str: The predicate.
+    """
+    return "%s_ancestors @> '{%s}'::smallint[]"%(column,hilucs_code_ids(con, dictionary, [code])[0])
+
+
+def hilucs_subtree(con, dictionary, codes, column='all_hilucs'):
+    """Function to get the predicate testing if one of the codes or a more detailed code is in the array of codes, e.g. 'all_hilucs', 
+    with the bitset of the array (see function 'encode_all_hilucs'). For one code, the predicate only uses the function 'get_bit' 
+    and can be used in the rules evaluated in memory (see module 'rule_engine').
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        dictionary (str): Name of the dictionary table ('schema.table').
+        codes (list of str): The codes, e.g. ['1_1_1'].
+        column (str): Name of the array of codes. Default value is 'all_hilucs'.
+
+    Returns:
+        str: The predicate.
+    """
+    ids = hilucs_code_ids(con, dictionary, codes)
+    if len(ids) == 1:
+        return "get_bit(%s_bits, %s) = 1"%(column,ids[0]-1)
+    mask = sum(1 << (BITSET_LENGTH - x) for x in ids)
+    mask = "X'%s'"%format(mask, '0%sx'%(BITSET_LENGTH//4))
+    return "(%s_bits & %s) <> lpad('', %s, '0')::bit(%s)"%(column,mask,BITSET_LENGTH,BITSET_LENGTH)
+
+
+def hilucs_only(con, dictionary, codes, column='all_hilucs'):
+    """Function to get the predicate testing if the array of codes, e.g. 'all_hilucs', only contains some of the codes (indexed, 
+    see function 'encode_all_hilucs'). For one code, the predicate is equivalent to "'8_8' = ALL(all_hilucs)".
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        dictionary (str): Name of the dictionary table ('schema.table').
+        codes (list of str): The codes, e.g. ['8_8'].
+        column (str): Name of the array of codes. Default value is 'all_hilucs'.
+
+    Returns:
+        str: The predicate.
+    """
+    return "%s_ids <@ '{%s}'::smallint[]"%(column,','.join(str(x) for x in hilucs_code_ids(con, dictionary, codes)))
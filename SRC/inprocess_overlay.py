@@ -0,0 +1,496 @@
+#!/usr/bin/env python
+"""
+WALOUS_UTS - Copyright (C) <2020> <Service Public de Wallonie (SWP), Belgique,
+					          		Institut Scientifique de Service Public (ISSeP), Belgique,
+									Université catholique de Louvain (UCLouvain), Belgique,
+									Université Libre de Bruxelles (ULB), Belgique>
+						 							
+	
+List of the contributors to the development of WALOUS_UTS: see LICENSE file.
+Description and complete License: see LICENSE file.
+	
+This program (WALOUS_UTS) is free software:
+you can redistribute it and/or modify it under the terms of the
+GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option)
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program (see COPYING file).  If not,
+see <http://www.gnu.org/licenses/>.
+"""
+
+
+## This module requires shapely>=2.0 (vectorised geometry functions and STRtree.query with predicates), which is not 
+## part of the 'walous_lu' environment (shapely 2 needs python>=3.7). It is only imported when the 'inprocess' backend is used.
+
+import io
+import sys
+import time
+import multiprocessing
+import numpy as np
+import psycopg2
+import shapely
+from processing_time import print_processing_time
+from postgres_geom import prepare_overlay
+
+## State of the overlay in each worker process, set by 'init_overlay_worker'
+overlay_state = {}
+
+
+def column_type(cursor, schema_name, table_name, column_name):
+    """Function to get the SQL type of a column, e.g. 'character varying(20)', used to create the result tables with the same types 
+    as the tables created by the SQL functions.
+
+    Args:
+        cursor (psycopg2 cursor object): Cursor on the database.
+        schema_name (str): Name of the schema where the table is located.
+        table_name (str): Name of the table.
+        column_name (str): Name of the column.
+
+    Returns:
+        str: The SQL type of the column.
+    """
+    query = "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+    query += "WHERE attrelid = '{schema}.{table}'::regclass AND attname = %s;"
+    cursor.execute(query.format(schema=schema_name, table=table_name), (column_name,))
+    return cursor.fetchone()[0]
+
+
+def load_overlay(con, schema_name, table_name, columns):
+    """Function to load the geometries (as WKB) and some attribute columns of an overlay table in memory.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        schema_name (str): Name of the schema where the table is located.
+        table_name (str): Name of the table.
+        columns (list of str): List of the attribute columns to be loaded.
+
+    Returns:
+        tuple: The list of WKB geometries and a dictionnary with the list of values of each attribute column.
+    """
+    cursor = con.cursor()
+    query = "SELECT ST_AsBinary(geom){columns} FROM {schema}.{table} WHERE geom IS NOT NULL;"
+    query = query.format(columns="".join([", %s"%x for x in columns]), schema=schema_name, table=table_name)
+    print(query + "\n")
+    cursor.execute(query)
+    rows = cursor.fetchall()
+    cursor.close()
+    wkb = [bytes(x[0]) for x in rows]
+    attributes = dict([(column, [x[i] for x in rows]) for i, column in enumerate(columns, 1)])
+    return wkb, attributes
+
+
+def iter_base_chunks(con, schema_name, table_name, id_column, chunksize):
+    """Function to stream the reference units of a table by chunks, using a server-side cursor.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        schema_name (str): Name of the schema where the table is located.
+        table_name (str): Name of the table.
+        id_column (str): Name of column with unique id.
+        chunksize (int): Number of reference units by chunk.
+
+    Returns:
+        generator: Generator of tuples with the list of ids and the list of WKB geometries of each chunk.
+    """
+    cursor = con.cursor(name='inprocess_base_%s'%table_name)
+    cursor.itersize = chunksize
+    query = "SELECT {id_}, ST_AsBinary(geom) FROM {schema}.{table} WHERE geom IS NOT NULL;"
+    cursor.execute(query.format(id_=id_column, schema=schema_name, table=table_name))
+    while True:
+        rows = cursor.fetchmany(chunksize)
+        if not rows:
+            break
+        yield [x[0] for x in rows], [bytes(x[1]) for x in rows]
+    cursor.close()
+
+
+def init_overlay_worker(overlay_wkb, attributes):
+    """Function to initialize a worker process: the overlay geometries are parsed and indexed in a STRtree once by process, 
+    and the attribute columns are encoded as integer codes (the same value, including NULL, gives the same code).
+
+    Args:
+        overlay_wkb (list of bytes): List of WKB geometries of the overlay.
+        attributes (dict): Dictionnary with the list of values of each attribute column of the overlay.
+
+    Returns:
+        This function has no return value.
+    """
+    overlay_state['geoms'] = shapely.from_wkb(overlay_wkb)
+    overlay_state['tree'] = shapely.STRtree(overlay_state['geoms'])
+    overlay_state['attributes'] = attributes
+    overlay_state['codes'] = {}
+    overlay_state['values'] = {}
+    for column, values in attributes.items():
+        distinct_values = []
+        lookup = {}
+        for x in values:
+            if x not in lookup:
+                lookup[x] = len(distinct_values)
+                distinct_values.append(x)
+        overlay_state['codes'][column] = np.array([lookup[x] for x in values], dtype=np.int64)
+        overlay_state['values'][column] = distinct_values
+
+
+def copy_value(value):
+    """Function to format a value for COPY (text format), NULL values being written as '\\N'.
+
+    Args:
+        value: The value to be formatted. Float values are rounded to 4 decimals as with ROUND(...,4) in the SQL functions.
+
+    Returns:
+        str: The formatted value.
+    """
+    if value is None:
+        return "\\N"
+    if isinstance(value, (float, np.floating)):
+        return "%.4f"%value
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def process_chunk(args):
+    """Function executed by the workers on each chunk of reference units. The candidate pairs are given by the STRtree of the overlay 
+    (predicate 'intersects', as ST_Intersects) and aggregated by reference unit with vectorised numpy operations.
+
+    Args:
+        args (tuple): Tuple containing the type of computation ('coverage', 'count' or 'sum'), a dictionnary of options, the list of ids 
+        and the list of WKB geometries of the reference units of the chunk.
+
+    Returns:
+        str: Rows of the result table for this chunk, formatted for COPY.
+    """
+    mode, options, ids, base_wkb = args
+    base = shapely.from_wkb(base_wkb)
+    base_idx, over_idx = overlay_state['tree'].query(base, predicate='intersects')
+    if len(base_idx) == 0:
+        return ""
+    ids = np.array(ids, dtype=object)
+    # Value aggregated for each pair
+    if mode == 'coverage':
+        base_area = shapely.area(base)
+        pair_value = shapely.area(shapely.intersection(base[base_idx], overlay_state['geoms'][over_idx]))
+        pair_ratio = pair_value / base_area[base_idx]
+    elif mode == 'sum':
+        # NULL values are ignored by the sum
+        sum_values = np.array([0.0 if x is None else x for x in overlay_state['attributes'][options['sum_column']]], dtype=float)
+        pair_value = sum_values[over_idx]
+    else:
+        pair_value = np.ones(len(base_idx))
+    lines = []
+    if options.get('class_column'):
+        # One row by reference unit with one column by class
+        codes = overlay_state['codes'][options['class_column']][over_idx]
+        classes = overlay_state['values'][options['class_column']]
+        units, unit_idx = np.unique(base_idx, return_inverse=True)
+        key = unit_idx * len(classes) + codes
+        size = len(units) * len(classes)
+        weights = pair_ratio if mode == 'coverage' else pair_value
+        sums = np.bincount(key, weights=weights, minlength=size).reshape(len(units), len(classes))
+        counts = np.bincount(key, minlength=size).reshape(len(units), len(classes))
+        columns = [classes.index(x) for x in options['classes']]
+        for i, unit in enumerate(units):
+            row = [ids[unit]]
+            for j in columns:
+                if counts[i, j] == 0:
+                    row.append(None)
+                elif mode == 'coverage':
+                    value = round(sums[i, j], 4)
+                    row.append(1.0 if value > 1.0 and options['clamp'] else value)
+                else:
+                    row.append(int(counts[i, j]))
+            lines.append("\t".join([copy_value(x) for x in row]))
+    else:
+        # One row by reference unit (and by value of the extra column, as in the GROUP BY of the SQL function)
+        if options.get('extra_column'):
+            codes = overlay_state['codes'][options['extra_column']][over_idx]
+            extra_values = overlay_state['values'][options['extra_column']]
+        else:
+            codes = np.zeros(len(base_idx), dtype=np.int64)
+            extra_values = [None]
+        groups, group_idx = np.unique(base_idx * len(extra_values) + codes, return_inverse=True)
+        sums = np.bincount(group_idx, weights=pair_value, minlength=len(groups))
+        counts = np.bincount(group_idx, minlength=len(groups))
+        if mode == 'coverage':
+            ratios = np.bincount(group_idx, weights=pair_ratio, minlength=len(groups))
+        for i, group in enumerate(groups):
+            unit, code = divmod(int(group), len(extra_values))
+            row = [ids[unit]]
+            if mode == 'coverage':
+                value = round(ratios[i], 4)
+                row += [sums[i], 1.0 if value > 1.0 and options['clamp'] else value]
+            elif mode == 'sum':
+                row += [sums[i], int(counts[i])]
+            else:
+                row.append(int(counts[i]))
+            if options.get('extra_column'):
+                value = extra_values[code]
+                aggregate = options['extra_aggregate'].upper()
+                if aggregate == 'COUNT':
+                    value = int(counts[i]) if value is not None else 0
+                elif aggregate == 'SUM' and value is not None:
+                    value = value * int(counts[i])
+                row.append(value)
+            lines.append("\t".join([copy_value(x) for x in row]))
+    return "".join([x + "\n" for x in lines])
+
+
+def run_inprocess(con, basemap_schema, basemap_name, basemap_id, overlay_schema, overlay_table, columns, 
+                  output_schema, output_table, output_columns, mode, options, njobs, chunksize):
+    """Function to run an in-process overlay: the overlay is loaded and indexed in each worker, the reference units are streamed by chunks 
+    which are distributed on a pool of processes, and the rows returned are written in the result table with COPY.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        basemap_schema (str): Name of the schema where the table with reference units is located.
+        basemap_name (str): Name of the table with reference units.
+        basemap_id (str): Name of column with unique id in the table with reference units.
+        overlay_schema (str): Name of the schema where the overlay table is located.
+        overlay_table (str): Name of the overlay table to be loaded.
+        columns (list of str): List of the attribute columns of the overlay to be loaded.
+        output_schema (str): Name of the schema where the result table should be created.
+        output_table (str): Name of the result table.
+        output_columns (list of str): Declaration of the columns of the result table, e.g. 'capakey_sigec_p varchar'.
+        mode (str): Type of computation ('coverage', 'count' or 'sum').
+        options (dict): Options of the computation (see function 'process_chunk').
+        njobs (int): Number of processes. If 1, the chunks are processed in the current process.
+        chunksize (int): Number of reference units by chunk.
+
+    Returns:
+        This function has no return value.
+    """
+    cursor = con.cursor()
+    # Create the result table
+    query = "DROP TABLE IF EXISTS {schema}.{table}; CREATE TABLE {schema}.{table} ({columns});"
+    query = query.format(schema=output_schema, table=output_table, columns=", ".join(output_columns))
+    print(query + "\n")
+    cursor.execute(query)
+    copyquery = "COPY {schema}.{table} FROM STDIN".format(schema=output_schema, table=output_table)
+    # Load the overlay
+    overlay_wkb, attributes = load_overlay(con, overlay_schema, overlay_table, columns)
+    print("%s overlay geometries loaded\n"%len(overlay_wkb))
+    chunks = iter_base_chunks(con, basemap_schema, basemap_name, basemap_id, chunksize)
+    nchunks = 0
+    if njobs > 1:
+        pool = multiprocessing.Pool(processes=njobs, initializer=init_overlay_worker, initargs=(overlay_wkb, attributes))
+    else:
+        pool = None
+        init_overlay_worker(overlay_wkb, attributes)
+    try:
+        while True:
+            # Read a batch of chunks (one by process) so that the memory used stays bounded
+            batch = []
+            for ids, wkb in chunks:
+                batch.append((mode, options, ids, wkb))
+                if len(batch) >= njobs:
+                    break
+            if not batch:
+                break
+            results = pool.map(process_chunk, batch) if pool else [process_chunk(x) for x in batch]
+            for result in results:
+                if result:
+                    cursor.copy_expert(copyquery, io.StringIO(result))
+            nchunks += len(batch)
+            print("%s chunks of %s reference units processed"%(nchunks, chunksize))
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    # Make the changes to the database persistent
+    con.commit()
+    cursor.close()
+
+
+def prop_coverage_inprocess(con, basemap_schema, basemap_name, basemap_id, overlaymap_schema, overlaymap_name, **kwargs):
+    """Function to compute the proportion of polygonal geometries from 'basemap', e.g. cadastral parcels, covered by polygonal geometries from 'overlaymap', 
+    computed in Python instead of PostGIS. It creates the same table, with the same columns, as the function 'prop_coverage' and can be used to cross-check 
+    or benchmark it (see function 'compare_tables').
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        basemap_schema (str): Name of the schema where the table with reference units is located.
+        basemap_name (str): Name of the table with reference units.
+        basemap_id (str): Name of column with unique id in the table with reference units.
+        overlaymap_schema (str): Name of the schema where the table with ancillary data (overlaying layer) is located.
+        overlaymap_name (str): Name of the table with ancillary data (overlaying layer).
+        **kwargs: 
+            'class_column' (str): Name of the column containing the type of class for overlaying polygons (see function 'prop_coverage').
+            'select_extra_column'(tupple): Tupple containing the name of another column and the type of aggregation (see function 'prop_coverage').
+            'prepared' (bool): If True, the overlay is read from its prepared table (see function 'prepare_overlay'). Default value is False.
+            'max_vertices' (int): Maximum number of vertices of the subdivided polygons of the prepared table. Default value is 256.
+            'njobs' (int): Number of processes. Default value is 1.
+            'chunksize' (int): Number of reference units by chunk. Default value is 5000.
+
+    Returns:
+        This function has no return value. 
+    """
+    try:
+        ## Saving current time for processing time management
+        begintime = time.time()
+        cursor = con.cursor()
+        group_columns = []
+        if 'class_column' in kwargs:
+            group_columns.append(kwargs['class_column'])
+        if 'select_extra_column' in kwargs:
+            group_columns.append(kwargs['select_extra_column'][0])
+        # Table to be used for the overlay
+        if kwargs.get('prepared', False):
+            overlay_table = prepare_overlay(con, overlaymap_schema, overlaymap_name, class_columns=group_columns, 
+                                            max_vertices=kwargs.get('max_vertices', 256))
+        else:
+            overlay_table = overlaymap_name
+        options = {'clamp': not kwargs.get('prepared', False)}
+        if 'class_column' in kwargs:
+            query = "SELECT DISTINCT {_class} FROM {schema}.{overlay} WHERE {_class} IS NOT NULL ORDER BY {_class};"
+            cursor.execute(query.format(schema=overlaymap_schema, overlay=overlaymap_name, _class=kwargs['class_column']))
+            options['class_column'] = kwargs['class_column']
+            options['classes'] = [x[0] for x in cursor.fetchall()]
+            columns = [kwargs['class_column']]
+            output_columns = ["%s_%s varchar"%(basemap_id, overlaymap_name)]
+            [output_columns.append("%s_prop_%s numeric"%(overlaymap_name, x)) for x in options['classes']]
+        else:
+            columns = []
+            output_columns = ["%s_%s %s"%(basemap_id, overlaymap_name, column_type(cursor, basemap_schema, basemap_name, basemap_id)), 
+                              "%s_area numeric"%overlaymap_name, "%s_coverage numeric"%overlaymap_name]
+            if 'select_extra_column' in kwargs:
+                xtra_col, aggregate = kwargs['select_extra_column']
+                options['extra_column'] = xtra_col
+                options['extra_aggregate'] = aggregate
+                columns.append(xtra_col)
+                xtra_type = "bigint" if aggregate.upper() == 'COUNT' else column_type(cursor, overlaymap_schema, overlaymap_name, xtra_col)
+                output_columns.append("%s_%s %s"%(overlaymap_name, xtra_col, xtra_type))
+        cursor.close()
+        run_inprocess(con, basemap_schema, basemap_name, basemap_id, overlaymap_schema, overlay_table, columns, 
+                      overlaymap_schema, '%s_overlay_%s'%(basemap_name,overlaymap_name), output_columns, 'coverage', options, 
+                      int(kwargs.get('njobs', 1)), int(kwargs.get('chunksize', 5000)))
+        ## Print processing time
+        print(print_processing_time(begintime, "Computation of PropCoverage function (in-process) achieved in "))
+    except (Exception, psycopg2.DatabaseError) as error:
+        sys.exit(error)
+
+
+def count_points_inprocess(con, basemap_schema, basemap_name, basemap_id, overlaymap_schema, overlaymap_name, **kwargs):
+    """Function to count the number of points from a 'overlaymap', e.g. buildings centroids, that are inside the polygonal geometries of a 'basemap', 
+    computed in Python instead of PostGIS. It creates the same table, with the same columns, as the function 'count_points'.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        basemap_schema (str): Name of the schema where the table with reference units is located.
+        basemap_name (str): Name of the table with reference units.
+        basemap_id (str): Name of column with unique id in the table with reference units.
+        overlaymap_schema (str): Name of the schema where the table with ancillary data (overlaying layer) is located.
+        overlaymap_name (str): Name of the table with ancillary data (overlaying layer).
+        **kwargs: 
+            'class_column' (str): Name of the column containing the type of class for overlaying points (see function 'count_points').
+            'njobs' (int): Number of processes. Default value is 1.
+            'chunksize' (int): Number of reference units by chunk. Default value is 5000.
+
+    Returns:
+        This function has no return value. 
+    """
+    try:
+        ## Saving current time for processing time management
+        begintime = time.time()
+        cursor = con.cursor()
+        options = {}
+        if 'class_column' in kwargs:
+            query = "SELECT DISTINCT {_class} FROM {schema}.{overlay} WHERE {_class} IS NOT NULL ORDER BY {_class};"
+            cursor.execute(query.format(schema=overlaymap_schema, overlay=overlaymap_name, _class=kwargs['class_column']))
+            options['class_column'] = kwargs['class_column']
+            options['classes'] = [x[0] for x in cursor.fetchall()]
+            columns = [kwargs['class_column']]
+            output_columns = ["%s_%s varchar"%(basemap_id, overlaymap_name)]
+            [output_columns.append("%s_count_%s numeric"%(overlaymap_name, x)) for x in options['classes']]
+        else:
+            columns = []
+            output_columns = ["%s_%s %s"%(basemap_id, overlaymap_name, column_type(cursor, basemap_schema, basemap_name, basemap_id)), 
+                              "%s_count bigint"%overlaymap_name]
+        cursor.close()
+        run_inprocess(con, basemap_schema, basemap_name, basemap_id, overlaymap_schema, overlaymap_name, columns, 
+                      overlaymap_schema, '%s_count_%s'%(basemap_name,overlaymap_name), output_columns, 'count', options, 
+                      int(kwargs.get('njobs', 1)), int(kwargs.get('chunksize', 5000)))
+        ## Print processing time
+        print(print_processing_time(begintime, "Computation of CountPoints function (in-process) achieved in "))
+    except (Exception, psycopg2.DatabaseError) as error:
+        sys.exit(error)
+
+
+def sum_points_inprocess(con, basemap_schema, basemap_name, basemap_id, overlaymap_schema, overlaymap_name, overlaymap_sumcolumn, **kwargs):
+    """Function to compute the sum of an attribute column of points from a 'overlaymap' map that are inside the polygonal geometries of a 'basemap', 
+    computed in Python instead of PostGIS. It creates the same table, with the same columns, as the function 'sum_points'.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        basemap_schema (str): Name of the schema where the table with reference units is located.
+        basemap_name (str): Name of the table with reference units.
+        basemap_id (str): Name of column with unique id in the table with reference units.
+        overlaymap_schema (str): Name of the schema where the table with ancillary data (overlaying layer) is located.
+        overlaymap_name (str): Name of the table with ancillary data (overlaying layer).
+        overlaymap_sumcolumn (str): Name of the column containing values for which the sum should be computed.
+        **kwargs: 
+            'njobs' (int): Number of processes. Default value is 1.
+            'chunksize' (int): Number of reference units by chunk. Default value is 5000.
+
+    Returns:
+        This function has no return value. 
+    """
+    try:
+        ## Saving current time for processing time management
+        begintime = time.time()
+        cursor = con.cursor()
+        output_columns = ["%s_%s %s"%(basemap_id, overlaymap_name, column_type(cursor, basemap_schema, basemap_name, basemap_id)), 
+                          "%s_tot numeric"%overlaymap_sumcolumn, "count_%s_points bigint"%overlaymap_name]
+        cursor.close()
+        run_inprocess(con, basemap_schema, basemap_name, basemap_id, overlaymap_schema, overlaymap_name, [overlaymap_sumcolumn], 
+                      overlaymap_schema, '%s_sum_%s'%(basemap_name,overlaymap_name), output_columns, 'sum', 
+                      {'sum_column': overlaymap_sumcolumn}, int(kwargs.get('njobs', 1)), int(kwargs.get('chunksize', 5000)))
+        ## Print processing time
+        print(print_processing_time(begintime, "Computation of SumPoints function (in-process) achieved in "))
+    except (Exception, psycopg2.DatabaseError) as error:
+        sys.exit(error)
+
+
+def compare_tables(con, schema_name, table_a, table_b, key_column, tolerance=0.0001):
+    """Function to cross-check two result tables with the same columns, e.g. the tables created by the SQL and the in-process version 
+    of the same overlay function. For each column, the number of rows with different values (or with a difference greater than the 
+    tolerance for numeric columns) is printed.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        schema_name (str): Name of the schema where the tables are located.
+        table_a (str): Name of the first table.
+        table_b (str): Name of the second table.
+        key_column (str): Name of the column with the unique id of the rows, e.g. 'capakey_sigec_p'.
+        tolerance (float): Maximum difference between numeric values considered as equal. Default value is 0.0001.
+
+    Returns:
+        dict: Dictionnary with the number of different rows for each column, and the number of rows missing in one of the tables ('missing').
+    """
+    cursor = con.cursor()
+    query = "SELECT column_name, data_type FROM information_schema.columns WHERE table_schema = %s AND table_name = %s AND column_name <> %s ORDER BY ordinal_position;"
+    cursor.execute(query, (schema_name, table_a, key_column))
+    columns = cursor.fetchall()
+    differences = []
+    for column, data_type in columns:
+        if data_type in ('numeric', 'double precision', 'real', 'integer', 'bigint', 'smallint'):
+            differences.append("count(*) FILTER (WHERE abs(coalesce(a.{col},0) - coalesce(b.{col},0)) > {tol} OR (a.{col} IS NULL) <> (b.{col} IS NULL))".format(col=column, tol=tolerance))
+        else:
+            differences.append("count(*) FILTER (WHERE a.{col} IS DISTINCT FROM b.{col})".format(col=column))
+    query = "SELECT count(*) FILTER (WHERE a.{key} IS NULL OR b.{key} IS NULL){differences} "
+    query += "FROM {schema}.{table_a} AS a FULL OUTER JOIN {schema}.{table_b} AS b ON a.{key} = b.{key};"
+    query = query.format(key=key_column, differences="".join([", %s"%x for x in differences]), 
+                         schema=schema_name, table_a=table_a, table_b=table_b)
+    print(query + "\n")
+    cursor.execute(query)
+    counts = cursor.fetchone()
+    cursor.close()
+    result = {'missing': counts[0]}
+    [result.update({column[0]: counts[i]}) for i, column in enumerate(columns, 1)]
+    print("Rows missing in one of the tables: %s"%result['missing'])
+    [print("Rows with different '%s': %s"%(column[0], result[column[0]])) for column in columns]
+    return result
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+"""
+WALOUS_UTS - Copyright (C) <2020> <Service Public de Wallonie (SWP), Belgique,
+					          		Institut Scientifique de Service Public (ISSeP), Belgique,
+									Université catholique de Louvain (UCLouvain), Belgique,
+									Université Libre de Bruxelles (ULB), Belgique>
+						 							
+	
+List of the contributors to the development of WALOUS_UTS: see LICENSE file.
+Description and complete License: see LICENSE file.
+	
+This program (WALOUS_UTS) is free software:
+you can redistribute it and/or modify it under the terms of the
+GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option)
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program (see COPYING file).  If not,
+see <http://www.gnu.org/licenses/>.
+"""
+
+
+import io
+import os
+import sys
+import time
+import multiprocessing
+import numpy as np
+import psycopg2
+from processing_time import print_processing_time
+
+## Model used by the current process (see function 'init_model_worker')
+model_state = {}
+
+
+def load_model(model):
+    """Function to get a trained classifier (scikit-learn estimator), either given directly or saved in a file with joblib.dump.
+
+    Args:
+        model (str or estimator): Path to the file of the model or the fitted estimator.
+
+    Returns:
+        estimator: The fitted estimator.
+    """
+    if isinstance(model, str):
+        import joblib
+        return joblib.load(model)
+    return model
+
+
+def init_model_worker(model, model_id, fill_value):
+    """Function to initialize a worker process: the model is loaded once by process.
+
+    Args:
+        model (str or estimator): Path to the file of the model or the fitted estimator.
+        model_id (str): Identifier of the model written in the result table.
+        fill_value (float): Value used for the missing values of the features, or None to keep them as NaN.
+
+    Returns:
+        This function has no return value.
+    """
+    model_state['model'] = load_model(model)
+    model_state['model_id'] = model_id
+    model_state['fill_value'] = fill_value
+
+
+def copy_text(value):
+    """Function to format a value for the text format of COPY.
+
+    Args:
+        value: The value to be formated.
+
+    Returns:
+        str: The value formated, '\\N' for NULL.
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, (float, np.floating)):
+        return repr(float(value)) if np.isfinite(value) else '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def predict_chunk(args):
+    """Function executed by the workers of 'model_classification': it predicts the label of a chunk of rows with 'predict' and their 
+    confidence, i.e. the probability of the predicted label returned by 'predict_proba' if the model supports it (the label is not 
+    always the class with the highest probability, e.g. for a model with a decision threshold).
+
+    Args:
+        args (tuple): Tuple containing the list of keys and the list of rows of features of the chunk.
+
+    Returns:
+        str: The rows of the result table, in the text format of COPY.
+    """
+    keys, rows = args
+    features = np.array([[np.nan if x is None else x for x in row] for row in rows], dtype=np.float64)
+    if model_state['fill_value'] is not None:
+        features[np.isnan(features)] = model_state['fill_value']
+    model = model_state['model']
+    labels = model.predict(features)
+    if hasattr(model, 'predict_proba'):
+        probabilities = model.predict_proba(features)
+        # Column of the predicted label in the probabilities
+        columns = dict([(x, i) for i, x in enumerate(np.asarray(model.classes_).tolist())])
+        index = np.array([columns.get(x, -1) for x in np.asarray(labels).tolist()], dtype=np.int64)
+        confidence = np.where(index >= 0, probabilities[np.arange(len(index)), index], np.nan)
+    else:
+        confidence = [None]*len(keys)
+    output = io.StringIO()
+    [output.write("%s\t%s\t%s\t%s\n"%(copy_text(k), copy_text(l), copy_text(c), copy_text(model_state['model_id']))) 
+     for k, l, c in zip(keys, labels, confidence)]
+    return output.getvalue()
+
+
+def model_classification(con, result_table_schema, result_table_name, stats_table_schema, stats_table_name, model, 
+                         feature_columns, key_column='capakey', colum_label='walousmaj', **kwargs):
+    """Function for creation of a table with the label predicted by a trained classifier (scikit-learn estimator) for each row of the 
+    statistics table, as an alternative to the rule-based classification (see function 'decision_tree_classification'). 
+    The statistics table is streamed by chunks with a server-side cursor, the chunks are predicted by a pool of processes (the model is 
+    loaded once by process) and the results are written with COPY. Only 'njobs' chunks are in memory at the same time.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        result_table_schema (str): Name of the schema on which the new table with classification results will be created.
+        result_table_name (str): Name of the table with classification results to be created.
+        stats_table_schema (str): Name of the schema where to find the table containing the features, e.g. the table created by 'get_final_table'.
+        stats_table_name (str): Name of the table containing the features.
+        model (str or estimator): Path to the file of the model saved with joblib.dump or the fitted estimator.
+        feature_columns (list of str): List of the columns (or expressions) used as features, in the order used to train the model. 
+        The features should be numeric (they are casted to float8): categorical columns (e.g. 'nat_lu_maj', 'dbris_maj') should be encoded first.
+        key_column (str): Name of the column with unique id of the rows. Default value is 'capakey'.
+        colum_label (str): Name of the column that will contain the predicted label. Default value is 'walousmaj'.
+        **kwargs:
+        'colum_confidence' (str): Name of the column that will contain the confidence of the prediction. Default value is 'confidence'.
+        'colum_model' (str): Name of the column that will contain the identifier of the model. Default value is 'model_id'.
+        'model_id' (str): Identifier of the model. Default value is the name of the file of the model, or the name of the class of the estimator.
+        'fill_value' (float): Value used for the missing values (NULL) of the features. Default value is None and they are kept as NaN.
+        'njobs' (int): Number of processes. Default value is 1 and the chunks are predicted in the current process.
+        'chunksize' (int): Number of rows by chunk. Default value is 50000.
+
+    Returns:
+        This function has no return value.
+    """
+    try:
+        # Time at starting
+        begintime = time.time()
+        colum_confidence = kwargs.get('colum_confidence', 'confidence')
+        colum_model = kwargs.get('colum_model', 'model_id')
+        fill_value = kwargs.get('fill_value', None)
+        njobs = max(int(kwargs.get('njobs', 1)), 1)
+        chunksize = int(kwargs.get('chunksize', 50000))
+        if isinstance(model, str):
+            model_id = kwargs.get('model_id', os.path.basename(model))
+        else:
+            model_id = kwargs.get('model_id', type(model).__name__)
+        if not feature_columns:
+            raise ValueError("The list of feature columns should be provided")
+        cursor = con.cursor()
+        # Check that the features are numeric before reading the table
+        query = "SELECT {columns} FROM {schema}.{table} LIMIT 0;"
+        cursor.execute(query.format(columns=", ".join(["(%s)"%x for x in feature_columns]), schema=stats_table_schema, table=stats_table_name))
+        type_oids = [x[1] for x in cursor.description]
+        cursor.execute("SELECT oid, format_type(oid, NULL), typcategory FROM pg_type WHERE oid = ANY(%s);", (type_oids,))
+        types = dict([(x[0], x[1:]) for x in cursor.fetchall()])
+        non_numeric = ["%s (%s)"%(x, types[y][0]) for x, y in zip(feature_columns, type_oids) if types[y][1] != 'N']
+        if non_numeric:
+            raise ValueError("The following feature columns are not numeric: %s"%", ".join(non_numeric))
+        # Create the result table
+        query = "DROP TABLE IF EXISTS {schema}.{table}; CREATE TABLE {schema}.{table} "
+        query += "({key} varchar, {label} varchar, {confidence} real, {model} varchar);"
+        query = query.format(schema=result_table_schema, table=result_table_name, key=key_column, label=colum_label, 
+                             confidence=colum_confidence, model=colum_model)
+        print(query + "\n")
+        cursor.execute(query)
+        copyquery = "COPY {schema}.{table} FROM STDIN".format(schema=result_table_schema, table=result_table_name)
+        # Stream the features with a server-side cursor
+        reader = con.cursor(name='model_features_%s'%stats_table_name)
+        reader.itersize = chunksize
+        query = "SELECT {key}, {columns} FROM {schema}.{table};"
+        query = query.format(key=key_column, columns=", ".join(["(%s)::float8"%x for x in feature_columns]), 
+                             schema=stats_table_schema, table=stats_table_name)
+        print(query + "\n")
+        reader.execute(query)
+        if njobs > 1:
+            pool = multiprocessing.Pool(processes=njobs, initializer=init_model_worker, initargs=(model, model_id, fill_value))
+        else:
+            pool = None
+            init_model_worker(model, model_id, fill_value)
+        nrows = 0
+        try:
+            while True:
+                # Read a batch of chunks (one by process) so that the memory used stays bounded
+                batch = []
+                while len(batch) < njobs:
+                    rows = reader.fetchmany(chunksize)
+                    if not rows:
+                        break
+                    batch.append(([x[0] for x in rows], [x[1:] for x in rows]))
+                if not batch:
+                    break
+                results = pool.map(predict_chunk, batch) if pool else [predict_chunk(x) for x in batch]
+                for result in results:
+                    cursor.copy_expert(copyquery, io.StringIO(result))
+                nrows += sum([len(x[0]) for x in batch])
+                print("%s rows predicted"%nrows)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        reader.close()
+        query = "ALTER TABLE {schema}.{table} ADD PRIMARY KEY ({key});".format(schema=result_table_schema, table=result_table_name, key=key_column)
+        print(query + "\n")
+        cursor.execute(query)
+        # Make the changes to the database persistent
+        con.commit()
+        cursor.close()
+        ## Print processing time
+        print(print_processing_time(begintime, "Classification with model '%s' of %s rows achieved in "%(model_id, nrows)))
+    except (Exception, psycopg2.DatabaseError) as error:
+        sys.exit(error)
@@ -30,10 +30,12 @@ import sys
 import psycopg2
 import time
 from processing_time import start_processing, print_processing_time
+from postgres_parallel import update_table
    
 def decision_tree_classification(con, result_table_schema, result_table_name, 
                                stats_table_schema, stats_table_name, 
-                               list_rules, colum_label="walousmaj", colum_leaf="rulebased_leaf", grant_user=None):
+                               list_rules, colum_label="walousmaj", colum_leaf="rulebased_leaf", grant_user=None, 
+                               compiled=False, unlogged=False, parallel_workers=None, profile=False, parallel=False, **kwargs):
     '''Function for creation of table with the 'walousmaj' column resulting from a rule-based decision-tree classification.
     This function handle the automated creation of the rule-based query to be used to define the value of 'walousmaj'.
 
@@ -49,6 +51,15 @@ def decision_tree_classification(con, result_table_schema, result_table_name,
 		colum_label (str): Name of the column that will contain the label resulting from the rule-based classification. Default value is 'walousmaj'. 
 		colum_leaf (str): Name of the column that will contain the number of the rule that is used to assign a label in the rule-based classification. Default value is 'rulebased_leaf'.
 		grant_user (list of str): List of users who should be granted complete privileges (ALL) on the newly created table. Default value is None and no other user than the current user is granted privileges.
+		compiled (bool): If True, the result table is created in one statement with the query returned by 'compile_decision_tree' (the rules are evaluated 
+		once for both columns and each row is written once) instead of a copy of the statistics table followed by two updates. The results are identical. Default value is False.
+		unlogged (bool): With 'compiled', either the result table should be created as UNLOGGED table (faster, but not crash-safe and not replicated). Default value is False.
+		parallel_workers (int): With 'compiled', maximum number of parallel workers used by PostgreSQL for the query (max_parallel_workers_per_gather). Default value is None (server setting).
+		profile (bool): If True, the rules are profiled after the classification (see function 'profile_decision_tree') and the profile is stored in the table 
+		'rule_profile' of the result schema. Default value is False.
+		parallel (bool): Without 'compiled', if True the label and rule number columns are updated together in parallel on ranges of the table 
+		(see function 'parallel_update'). Default value is False.
+		**kwargs: Options of the parallel update ('connexion_param_dict', 'njobs', 'npartitions', 'key_column', 'retries'), see function 'update_table'.
 
     Returns:
 		This function has no return value. 
@@ -69,6 +80,30 @@ def decision_tree_classification(con, result_table_schema, result_table_name,
         cursor.execute(query)
         cursor.close()
         con.commit()
+        if compiled:
+            # Create the table with label and rule number in one statement
+            cursor = con.cursor()
+            if parallel_workers is not None:
+                cursor.execute('SET max_parallel_workers_per_gather = %s;'%int(parallel_workers))
+            query = compile_decision_tree(con, result_table_schema, result_table_name, stats_table_schema, stats_table_name, 
+                                          list_rules, colum_label=colum_label, colum_leaf=colum_leaf, unlogged=unlogged)
+            print(query + "\n")
+            cursor.execute(query)
+            if parallel_workers is not None:
+                cursor.execute('RESET max_parallel_workers_per_gather;')
+            # Grant user(s) on the new table
+            if grant_user:
+                for user in grant_user:
+                    query = 'GRANT ALL PRIVILEGES ON %s.%s TO %s;'%(result_table_schema,result_table_name,user)
+                    print(query + "\n")
+                    cursor.execute(query)
+            cursor.close()
+            con.commit()
+            ## Print processing time
+            print(print_processing_time(begintime, "Classification and creation of result table achieved in "))
+            if profile:
+                profile_decision_tree(con, stats_table_schema, stats_table_name, list_rules, profile_table_schema=result_table_schema)
+            return
         # Create table
         query = 'CREATE TABLE %s.%s AS(SELECT * FROM %s.%s);'%(result_table_schema,result_table_name,stats_table_schema,stats_table_name)
         print(query + "\n")
@@ -94,6 +129,20 @@ def decision_tree_classification(con, result_table_schema, result_table_name,
                 cursor.execute(query)
                 cursor.close()
                 con.commit()
+        if parallel:
+            # Update both columns in one parallel update
+            set_clause = '%s = (CASE '%colum_label
+            for when,then in list_rules:
+                set_clause += 'WHEN %s THEN %s '%(when,then)
+            set_clause += "ELSE '6_6_A' END), %s = (CASE "%colum_leaf
+            for i,rule in enumerate(list_rules,1):
+                set_clause += 'WHEN %s THEN %s '%(rule[0],i)
+            set_clause += "ELSE %s END)"%int(len(list_rules)+1)
+            update_table(con, result_table_schema, result_table_name, set_clause, parallel=True, **kwargs)
+            print(print_processing_time(begintime, "Classification and creation of result table achieved in "))
+            if profile:
+                profile_decision_tree(con, stats_table_schema, stats_table_name, list_rules, profile_table_schema=result_table_schema)
+            return
         # Update columns using decision tree hierarchical classification - LABEL column  
         query = 'UPDATE %s.%s SET %s = (CASE '%(result_table_schema,result_table_name,colum_label)
         for when,then in list_rules:
@@ -118,6 +167,150 @@ def decision_tree_classification(con, result_table_schema, result_table_name,
         cursor.close()
         ## Print processing time
         print(print_processing_time(begintime, "Classification and creation of result table achieved in "))
+        if profile:
+            profile_decision_tree(con, stats_table_schema, stats_table_name, list_rules, profile_table_schema=result_table_schema)
     except (Exception, psycopg2.DatabaseError) as error:
         sys.exit(error)
         
+
+
+def compile_decision_tree(con, result_table_schema, result_table_name, stats_table_schema, stats_table_name, 
+                          list_rules, colum_label="walousmaj", colum_leaf="rulebased_leaf", unlogged=False):
+    '''Function to compile the rules of a rule-based decision-tree classification into one 'CREATE TABLE AS' query. The rules are evaluated 
+    once in an inner query which gives the number of the first rule matching each row, and the label is derived from this number in the outer 
+    query. The columns of the result table are the columns of the statistics table, followed by the label (varchar) and the rule number (integer), 
+    as in the table created by the function 'decision_tree_classification'.
+
+    Args: 
+		con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+		result_table_schema (str): Name of the schema on which the new table with classification results will be created.
+		result_table_name (str): Name of the table with classification results to be created.
+		stats_table_schema (str): Name of the schema where to find the table containing all statistics used in the classification rules.
+		stats_table_name (str): Name of the table containing all statistics used in the classification rules.
+		list_rules (list of tupple): List of tuples containing the classification rules (see function 'decision_tree_classification').  
+		colum_label (str): Name of the column that will contain the label resulting from the rule-based classification. Default value is 'walousmaj'. 
+		colum_leaf (str): Name of the column that will contain the number of the rule that is used to assign a label. Default value is 'rulebased_leaf'.
+		unlogged (bool): Either the result table should be created as UNLOGGED table. Default value is False.
+
+    Returns:
+		str: The 'CREATE TABLE AS' query.
+    '''
+    # Columns of the statistics table
+    cursor = con.cursor()
+    query = "SELECT column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s ORDER BY ordinal_position;"
+    cursor.execute(query, (stats_table_schema, stats_table_name))
+    columns = ['"%s"'%x[0] for x in cursor.fetchall()]
+    cursor.close()
+    # Outer query: label of the rule
+    query = 'CREATE %sTABLE %s.%s AS (%s);'%('UNLOGGED ' if unlogged else '',result_table_schema,result_table_name,
+                                             decision_tree_select(columns, stats_table_schema, stats_table_name, list_rules, colum_label, colum_leaf))
+    return query
+
+
+def decision_tree_select(columns, stats_table_schema, stats_table_name, list_rules, colum_label="walousmaj", colum_leaf="rulebased_leaf"):
+    '''Function to build the SELECT query of a compiled rule-based decision-tree classification (see function 'compile_decision_tree').
+
+    Args: 
+		columns (list of str): List of the columns of the statistics table to be selected before the label and the rule number.
+		stats_table_schema (str): Name of the schema where to find the table containing all statistics used in the classification rules.
+		stats_table_name (str): Name of the table containing all statistics used in the classification rules.
+		list_rules (list of tupple): List of tuples containing the classification rules (see function 'decision_tree_classification').  
+		colum_label (str): Name of the column that will contain the label resulting from the rule-based classification. Default value is 'walousmaj'. 
+		colum_leaf (str): Name of the column that will contain the number of the rule that is used to assign a label. Default value is 'rulebased_leaf'.
+
+    Returns:
+		str: The SELECT query.
+    '''
+    # Inner query: number of the first rule matching each row
+    leafquery = 'SELECT *, (CASE '
+    for i,rule in enumerate(list_rules,1):
+        leafquery += 'WHEN %s THEN %s '%(rule[0],i)
+    leafquery += 'ELSE %s END) AS %s FROM %s.%s'%(int(len(list_rules)+1),colum_leaf,stats_table_schema,stats_table_name)
+    # Outer query: label of the rule
+    query = 'SELECT %s, '%', '.join(columns)
+    query += 'CAST((CASE %s '%colum_leaf
+    for i,rule in enumerate(list_rules,1):
+        query += 'WHEN %s THEN %s '%(i,rule[1])
+    query += "ELSE '6_6_A' END) AS varchar) AS %s, "%colum_label
+    query += 'CAST(%s AS integer) AS %s FROM (%s) AS leaf'%(colum_leaf,colum_leaf,leafquery)
+    return query
+
+
+def profile_decision_tree(con, stats_table_schema, stats_table_name, list_rules, profile_table_schema='results', profile_table_name='rule_profile'):
+    '''Function to profile the rules of a rule-based decision-tree classification. For each rule, the number of rows classified by the rule 
+    (first rule matching), the number of rows matching the rule on its own, the total area of the rows classified by the rule (if the statistics 
+    table has a 'geom' column) and the time spent to evaluate the condition of the rule on the whole table are computed. The time of the condition 
+    is the time of a count query with this condition minus the time of the same query without condition. The results are stored in a table and 
+    a summary is printed, in which the rules which never classify any row ('dead' rules) are flagged.
+
+    Args: 
+		con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+		stats_table_schema (str): Name of the schema where to find the table containing all statistics used in the classification rules.
+		stats_table_name (str): Name of the table containing all statistics used in the classification rules.
+		list_rules (list of tupple): List of tuples containing the classification rules (see function 'decision_tree_classification').  
+		profile_table_schema (str): Name of the schema where the profile table should be created. Default value is 'results'.
+		profile_table_name (str): Name of the profile table. Default value is 'rule_profile'.
+
+    Returns:
+		list of tupple: The profile of each rule (rule number, condition, label, rows classified, rows matching, area classified, time in ms).
+    '''
+    try:
+        # Time at starting
+        begintime = time.time() 
+        cursor = con.cursor()
+        # Check if the area can be computed
+        query = "SELECT count(*) FROM information_schema.columns WHERE table_schema = %s AND table_name = %s AND column_name = 'geom';"
+        cursor.execute(query, (stats_table_schema, stats_table_name))
+        has_geom = cursor.fetchone()[0] > 0
+        # Time of a scan of the table without condition
+        query = 'SELECT count(*) FROM %s.%s;'%(stats_table_schema,stats_table_name)
+        starttime = time.time()
+        cursor.execute(query)
+        cursor.fetchone()
+        scantime = time.time() - starttime
+        # Rows matching each rule on its own and time of its condition
+        standalone = []
+        for rule in list_rules:
+            query = 'SELECT count(*) FROM %s.%s WHERE %s;'%(stats_table_schema,stats_table_name,rule[0])
+            starttime = time.time()
+            cursor.execute(query)
+            standalone.append((cursor.fetchone()[0], max(time.time() - starttime - scantime, 0)*1000))
+        # Rows classified by each rule (first rule matching)
+        query = 'SELECT leaf, count(*), %s FROM (SELECT (CASE '%('sum(ST_Area(geom))' if has_geom else 'NULL')
+        for i,rule in enumerate(list_rules,1):
+            query += 'WHEN %s THEN %s '%(rule[0],i)
+        query += 'ELSE %s END) AS leaf%s FROM %s.%s) AS a GROUP BY leaf;'%(int(len(list_rules)+1),', geom' if has_geom else '',stats_table_schema,stats_table_name)
+        print(query + "\n")
+        cursor.execute(query)
+        first_match = dict([(x[0], (x[1], x[2])) for x in cursor.fetchall()])
+        profile = []
+        for i,rule in enumerate(list_rules,1):
+            hits, area = first_match.get(i, (0, None))
+            profile.append((i, rule[0], rule[1], hits, standalone[i-1][0], float(area) if area is not None else None, round(standalone[i-1][1],1)))
+        hits, area = first_match.get(len(list_rules)+1, (0, None))
+        profile.append((len(list_rules)+1, 'ELSE', "'6_6_A'", hits, None, float(area) if area is not None else None, None))
+        # Store the profile
+        query = "DROP TABLE IF EXISTS {schema}.{table}; CREATE TABLE {schema}.{table} (rule integer, condition text, label text, "
+        query += "first_match bigint, standalone bigint, first_match_area double precision, predicate_ms double precision, "
+        query += "stats_table text, profiled_at timestamp DEFAULT now());"
+        query = query.format(schema=profile_table_schema, table=profile_table_name)
+        print(query + "\n")
+        cursor.execute(query)
+        query = "INSERT INTO {schema}.{table} (rule, condition, label, first_match, standalone, first_match_area, predicate_ms, stats_table) "
+        query += "VALUES (%s, %s, %s, %s, %s, %s, %s, %s);"
+        query = query.format(schema=profile_table_schema, table=profile_table_name)
+        [cursor.execute(query, x + ('%s.%s'%(stats_table_schema,stats_table_name),)) for x in profile]
+        con.commit()
+        cursor.close()
+        # Summary
+        print("Profile of %s rules on %s.%s (scan of the table: %s ms)"%(len(list_rules), stats_table_schema, stats_table_name, round(scantime*1000,1)))
+        print("%5s %12s %12s %16s %12s  %s"%('rule', 'first_match', 'standalone', 'area', 'time (ms)', 'label / condition'))
+        for x in profile:
+            flag = ' (dead rule)' if x[3] == 0 and x[1] != 'ELSE' else ''
+            print("%5s %12s %12s %16s %12s  %s <- %s%s"%(x[0], x[3], '' if x[4] is None else x[4], '' if x[5] is None else round(x[5],1), 
+                                                        '' if x[6] is None else x[6], x[2], x[1], flag))
+        ## Print processing time
+        print(print_processing_time(begintime, "Profiling of the rules achieved in "))
+        return profile
+    except (Exception, psycopg2.DatabaseError) as error:
+        sys.exit(error)
@@ -27,9 +27,12 @@ see <http://www.gnu.org/licenses/>.
 
 import os 
 import sys
+import hashlib
 import psycopg2
 import time
 from processing_time import print_processing_time
+from postgres_parallel import get_key_ranges, execute_parallel_queries, create_table_by_partitions
+from postgres_geom import prepare_overlay, build_pair_cache
 
 
 def create_pg_connexion(connexion_param_dict):
@@ -186,7 +189,8 @@ def add_serial_pkey(con, schema_name, table_name, column, pkey=True):
         
 def prop_coverage(con, basemap_schema, basemap_name, basemap_id, overlaymap_schema, overlaymap_name, **kwargs):  
     """Function to compute the proportion of polygonal geometries from 'basemap', e.g. cadastral parcels, covered by polygonal geometries from 'overlaymap', e.g. vacant lands.
-    This execution of this function could be extremely slow if the overlaymap is made of multipolygons. If it is the case, please consider using the function 'split_multipolygon_to_singlepolygon' before this one.
+    This execution of this function could be extremely slow if the overlaymap is made of multipolygons. If it is the case, please consider using the 'prepared' option 
+    (see function 'prepare_overlay') or the function 'split_multipolygon_to_singlepolygon' before this one.
 
     The trick was found here : https://gis.stackexchange.com/questions/222800/how-to-get-the-area-of-two-intersecting-polygons-on-postgis
 
@@ -200,118 +204,229 @@ def prop_coverage(con, basemap_schema, basemap_name, basemap_id, overlaymap_sche
         **kwargs: 
             'class_column' (str): Name of the column containing the type of class for overlaying polygons. If provided, the result table will have multiple columns corresponding to each distinct 'class_column' values.
             'select_extra_column'(tupple): Tupple containing as first element, the name of another column to be used in the group by query, and as second element the type of aggregation to be used, e.g., SUM or MIN.
+            'njobs' (int): Number of parallel jobs. If provided and greater than 1, the reference units are splitted in ranges of 'basemap_id' and the 
+            intersection/aggregation is computed for each range on its own connexion before being merged in the same result table. The content of the 
+            result table is the same as with the serial execution. 'connexion_param_dict' should be provided too.
+            'npartitions' (int): Number of ranges in which the reference units are splitted for the parallel execution. Default value is 'njobs'.
+            'connexion_param_dict' (dict): A dictionnary containing informations for connection to the database, used by each parallel job (see function "create_pg_connexion").
+            'fast_path' (bool): If True, each candidate pair is classified before computing its area of intersection. Reference units fully covered by 
+            the overlay get their own area, overlays fully inside the reference unit get the overlay area, and only partial overlaps compute an 
+            intersection (once per pair). Pairs that only touch each other are pruned: they are kept with an area of 0 without computing their 
+            intersection, so that reference units only touching the overlay have a coverage of 0, as with the exact method. The number of pairs by computation path is printed. Default value is False.
+            'bbox_tolerance' (float): With 'fast_path', pairs whose bounding boxes overlap on an area smaller or equal to this value (in sq. units of 
+            the CRS) are pruned. Default value is 0, which only prunes pairs that can not share any area.
+            'prepared' (bool): If True, the overlay is read from its prepared table '<overlaymap_name>_prepared' (see function 'prepare_overlay'), dissolved 
+            by 'class_column' and 'select_extra_column' and subdivided. The prepared table is created or rebuilt only if needed. Since overlapping polygons are 
+            dissolved, the coverage can not exceed 1.0 and no correction is applied. Default value is False.
+            'max_vertices' (int): Maximum number of vertices of the subdivided polygons of the prepared table. Default value is 256.
+            'pair_cache' (bool): If True, the candidate pairs (and the area of their intersection) are read from the persistent pair table of the reference 
+            units and the overlay (see function 'build_pair_cache'), which is created or rebuilt only if needed. Default value is False.
+            'overlay_id' (str): Name of column with unique id in the overlay table, used by the pair table. Default value is 'gid' (always 'gid' with 'prepared').
+            'backend' (str): Either 'postgis' (default), 'inprocess' or 'raster'. With 'inprocess', the same table is computed in Python with shapely 
+            (see function 'prop_coverage_inprocess'), using 'njobs' processes and chunks of 'chunksize' reference units. With 'raster', an approximation 
+            is computed in a GRASS GIS session by zonal counting of rasters at resolution 'resolution', using the vector map of the reference units 
+            'capa_vector' and 'connexion_param_dict' (see function 'raster_prop_coverage'). The error compared to the exact method is printed.
 
     Returns:
         This function has no return value. 
     """
+    # In-process backend (requires shapely>=2.0)
+    if kwargs.get('backend', 'postgis') == 'inprocess':
+        from inprocess_overlay import prop_coverage_inprocess
+        return prop_coverage_inprocess(con, basemap_schema, basemap_name, basemap_id, overlaymap_schema, overlaymap_name, **kwargs)
+    # Raster approximation (requires a GRASS GIS session)
+    if kwargs.get('backend', 'postgis') == 'raster':
+        missing = [x for x in ('connexion_param_dict', 'capa_vector', 'resolution') if x not in kwargs]
+        if missing:
+            sys.exit("ERROR: %s argument(s) should be provided if 'backend' is 'raster'."%", ".join(["'%s'"%x for x in missing]))
+        from grass_processing import raster_prop_coverage
+        raster_prop_coverage(con, kwargs['connexion_param_dict'], basemap_schema, basemap_name, basemap_id, overlaymap_schema, overlaymap_name, 
+                             kwargs['capa_vector'], kwargs['resolution'], **dict([(k,v) for k,v in kwargs.items() if k in ('class_column','sample_size','keep_maps')]))
+        return
     try:
         ## Saving current time for processing time management
         begintime = time.time()
         # Get ID of current processus 
         pid = os.getpid()
+        # Check parallel execution parameters
+        njobs = int(kwargs.get('njobs', 1))
+        if njobs > 1 and 'connexion_param_dict' not in kwargs:
+            sys.exit("ERROR: 'connexion_param_dict' argument should be provided if 'njobs' is greater than 1.")
         # Create cursor
         cursor = con.cursor()
         # Get list of distinct class name if 'class_column' is provided
         if 'class_column' in kwargs:
-            distinctlabelquery = "SELECT DISTINCT {_class} FROM {schema}.{overlay} ORDER BY {_class};"
+            distinctlabelquery = "SELECT DISTINCT {_class} FROM {schema}.{overlay} WHERE {_class} IS NOT NULL ORDER BY {_class};"
             distinctlabelquery = distinctlabelquery.format(schema=overlaymap_schema,overlay=overlaymap_name,_class=kwargs['class_column'])
             print(distinctlabelquery + "\n")
             cursor.execute(distinctlabelquery)
             distinct_classes = [x[0] for x in cursor.fetchall()]
         # Drop table if exits
         query = "DROP TABLE IF EXISTS {schema}.{table};"
-        if 'class_column' not in kwargs:
-            query = query.format(schema=overlaymap_schema,table='%s_overlay_%s'%(basemap_name,overlaymap_name))
-        else:
-            query = query.format(schema=overlaymap_schema,table='tmp_%s'%pid)
+        query = query.format(schema=overlaymap_schema,table='%s_overlay_%s'%(basemap_name,overlaymap_name))
         print(query + "\n")
         cursor.execute(query)
-        # Subquery 
-        if 'class_column' not in kwargs:
-            subquery = "SELECT base.{id_} as {id_}_{suffix}, "
-            subquery = subquery.format(id_=basemap_id, suffix=overlaymap_name)
-        else:
-            subquery = "SELECT base.{id_} as {id_}_{suffix}, overlay.{class_column}, "
-            subquery = subquery.format(id_=basemap_id, suffix=overlaymap_name, class_column=kwargs['class_column'])
-        subquery += "ROUND(CAST(SUM(st_area(st_Intersection(base.geom,overlay.geom))) AS numeric),4) AS {o_name}_area, "
-        subquery += "ROUND(CAST(SUM(st_area(st_Intersection(base.geom,overlay.geom))/st_area(base.geom)) AS numeric),4) AS {o_name}_coverage "
-        if 'select_extra_column' in kwargs:
-            subquery += ", {aggregate}(overlay.{xtra_col}) as {prefix}_{xtra_col} ".format(
-                aggregate=kwargs['select_extra_column'][1].upper(), id_=basemap_id,
-                xtra_col=kwargs['select_extra_column'][0], prefix=overlaymap_name)
-        subquery += "FROM {b_schema}.{b_name} AS base "
-        subquery += "JOIN {o_schema}.{o_name} AS overlay ON st_intersects(base.geom,overlay.geom) "
-        subquery = subquery.format(id_=basemap_id, suffix=overlaymap_name, 
-                                   b_schema=basemap_schema, o_schema=overlaymap_schema, 
-                                   b_name=basemap_name, o_name=overlaymap_name)
-        subquery += "GROUP BY base.%s"%basemap_id
+        # Columns of the overlay used in the group by query
+        group_columns = []
         if 'class_column' in kwargs:
-            subquery += ", overlay.%s"%kwargs['class_column']
+            group_columns.append(kwargs['class_column'])
         if 'select_extra_column' in kwargs:
-            subquery += ", overlay.%s"%kwargs['select_extra_column'][0]   
-            
-        # Create table query
-        query = "CREATE TABLE {schema}.{table} AS ({subquery});"
-        if 'class_column' not in kwargs:
-            query = query.format(schema=overlaymap_schema, 
-                                 table='%s_overlay_%s'%(basemap_name,overlaymap_name), subquery=subquery)
+            group_columns.append(kwargs['select_extra_column'][0])
+        fast_path = kwargs.get('fast_path', False)
+        # Table to be used for the overlay
+        if kwargs.get('prepared', False):
+            overlay_table = prepare_overlay(con, overlaymap_schema, overlaymap_name, class_columns=group_columns, 
+                                            max_vertices=kwargs.get('max_vertices', 256))
         else:
-            query = query.format(schema=overlaymap_schema, 
-                                 table='tmp_%s'%pid, subquery=subquery)
-        print(query + "\n")
-        cursor.execute(query)
-        # Update values where unprecise division result may occur
-        query = "UPDATE {schema}.{table} "
-        if 'class_column' not in kwargs:
-            query = query.format(schema=overlaymap_schema, 
-                                 table='%s_overlay_%s'%(basemap_name,overlaymap_name), subquery=subquery)
+            overlay_table = overlaymap_name
+        # Join between reference units and overlay, and area of intersection of each pair
+        if kwargs.get('pair_cache', False):
+            pair_table = build_pair_cache(con, basemap_schema, basemap_name, basemap_id, overlaymap_schema, overlay_table, 
+                                          overlay_id='gid' if kwargs.get('prepared', False) else kwargs.get('overlay_id', 'gid'), 
+                                          with_area=not fast_path, njobs=njobs, connexion_param_dict=kwargs.get('connexion_param_dict'))
+            join_clause = "JOIN {o_schema}.{pairs} AS pairs ON pairs.base_id = base.{id_} JOIN {o_schema}.{o_table} AS overlay ON overlay.{o_id} = pairs.overlay_id "
+            join_clause = join_clause.format(o_schema=overlaymap_schema, pairs=pair_table, id_=basemap_id, o_table=overlay_table, 
+                                             o_id='gid' if kwargs.get('prepared', False) else kwargs.get('overlay_id', 'gid'))
+            intersection_area = "pairs.area"
         else:
-            query = query.format(schema=overlaymap_schema, 
-                                 table='tmp_%s'%pid, subquery=subquery)
-        query += "SET {o_name}_coverage = 1.0 WHERE {o_name}_coverage > 1.0;"
-        query = query.format(schema=overlaymap_schema,b_name=basemap_name,o_name=overlaymap_name)
-        print(query + "\n")
-        cursor.execute(query)
-        # Make the changes to the database persistent
-        con.commit()
-        # If multiclass overlay calculation, pivoting table
+            join_clause = "JOIN {o_schema}.{o_table} AS overlay ON st_intersects(base.geom,overlay.geom) "
+            join_clause = join_clause.format(o_schema=overlaymap_schema, o_table=overlay_table)
+            intersection_area = "st_area(st_Intersection(base.geom,overlay.geom))"
         if 'class_column' in kwargs:
-            # Crosstab query argument
-            crosstabquery = "SELECT {id_}_{suffix}, {class_column}, {suffix}_coverage "
-            crosstabquery += "FROM {schema}.{table} ORDER  BY 1,2"
-            crosstabquery = crosstabquery.format(id_=basemap_id, suffix=overlaymap_name,
-                                                 class_column=kwargs['class_column'],
-                                                 schema=overlaymap_schema, table='tmp_%s'%pid)
-            # Declaration of colums for the pivot table
-            columns=["{id_}_{suffix} VARCHAR".format(id_=basemap_id, suffix=overlaymap_name),]
-            [columns.append("{suffix}_prop_{_class} NUMERIC".format(suffix=overlaymap_name,_class=_class)) for _class in distinct_classes]
-            
-            # Queries for pivoting table
-            query = "DROP TABLE IF EXISTS {schema}.{table};"
-            query = query.format(schema=overlaymap_schema,table='%s_overlay_%s'%(basemap_name,overlaymap_name))
+            # Pivot columns computed by conditional aggregation, one column by class
+            pivotcolumn = "ROUND(CAST(SUM({area}) FILTER (WHERE {class_column} = {value}) AS numeric),4) AS {o_name}_prop_{_class}"
+            pivot_area = "pair_area/base_area" if fast_path else "%s/st_area(base.geom)"%intersection_area
+            pivot_columns = [pivotcolumn.format(area=pivot_area, value=cursor.mogrify("%s", (_class,)).decode(), 
+                                                class_column=kwargs['class_column'] if fast_path else "overlay.%s"%kwargs['class_column'], 
+                                                o_name=overlaymap_name, _class=_class) for _class in distinct_classes]
+        if not fast_path:
+            # Subquery 
+            subquery = "SELECT base.{id_} as {id_}_{suffix}"
+            if 'class_column' in kwargs:
+                subquery = "SELECT base.{id_}::varchar as {id_}_{suffix}"
+                subquery += "".join([", %s"%x for x in pivot_columns]) + " "
+            else:
+                subquery += ", ROUND(CAST(SUM(%s) AS numeric),4) AS {o_name}_area, "%intersection_area
+                subquery += "ROUND(CAST(SUM(%s/st_area(base.geom)) AS numeric),4) AS {o_name}_coverage "%intersection_area
+            if 'select_extra_column' in kwargs and 'class_column' not in kwargs:
+                subquery += ", {aggregate}(overlay.{xtra_col}) as {prefix}_{xtra_col} ".format(
+                    aggregate=kwargs['select_extra_column'][1].upper(), id_=basemap_id,
+                    xtra_col=kwargs['select_extra_column'][0], prefix=overlaymap_name)
+            subquery += "FROM {b_schema}.{b_name} AS base "
+            subquery += join_clause
+            subquery = subquery.format(id_=basemap_id, suffix=overlaymap_name, 
+                                       b_schema=basemap_schema, o_schema=overlaymap_schema, 
+                                       b_name=basemap_name, o_name=overlaymap_name, o_table=overlay_table)
+            subquery += "{where}"
+            subquery += "GROUP BY base.%s"%basemap_id
+            if 'class_column' not in kwargs:
+                subquery += "".join([", overlay.%s"%x for x in group_columns])
+        else:
+            # Pair query: each candidate pair is classified first and only partial overlaps pay for an intersection, computed once.
+            # Pairs whose bounding boxes overlap on an area smaller or equal to 'bbox_tolerance' are pruned (they can only touch): they are kept 
+            # with an area of 0, without computing the intersection, as the reference units only touching the overlay in the exact method.
+            pairquery = "SELECT base.{id_}, "
+            pairquery += "".join(["overlay.%s, "%x for x in group_columns])
+            pairquery += "c.path, st_area(base.geom) AS base_area, "
+            pairquery += "CASE c.path WHEN 'pruned' THEN 0.0 WHEN 'covered' THEN st_area(base.geom) WHEN 'inside' THEN st_area(overlay.geom) "
+            pairquery += "WHEN 'partial' THEN st_area(st_Intersection(base.geom,overlay.geom)) END AS pair_area "
+            pairquery += "FROM {b_schema}.{b_name} AS base "
+            pairquery += join_clause
+            pairquery += "CROSS JOIN LATERAL (SELECT CASE "
+            pairquery += "WHEN (LEAST(ST_XMax(base.geom),ST_XMax(overlay.geom))-GREATEST(ST_XMin(base.geom),ST_XMin(overlay.geom)))"
+            pairquery += "*(LEAST(ST_YMax(base.geom),ST_YMax(overlay.geom))-GREATEST(ST_YMin(base.geom),ST_YMin(overlay.geom))) <= {tolerance} THEN 'pruned' "
+            pairquery += "WHEN ST_Covers(overlay.geom,base.geom) THEN 'covered' "
+            pairquery += "WHEN ST_Covers(base.geom,overlay.geom) THEN 'inside' "
+            pairquery += "ELSE 'partial' END AS path) AS c "
+            pairquery = pairquery.format(id_=basemap_id, b_schema=basemap_schema, o_schema=overlaymap_schema, 
+                                         b_name=basemap_name, o_table=overlay_table, 
+                                         tolerance=float(kwargs.get('bbox_tolerance', 0)))
+            pairquery += "{where}"
+            # Aggregation of the pairs
+            subquery = "SELECT {id_} as {id_}_{suffix}"
+            if 'class_column' in kwargs:
+                subquery = "SELECT {id_}::varchar as {id_}_{suffix}"
+                subquery += "".join([", %s"%x for x in pivot_columns]) + " "
+            else:
+                subquery += ", ROUND(CAST(SUM(pair_area) AS numeric),4) AS {o_name}_area, "
+                subquery += "ROUND(CAST(SUM(pair_area/base_area) AS numeric),4) AS {o_name}_coverage "
+            if 'select_extra_column' in kwargs and 'class_column' not in kwargs:
+                subquery += ", {aggregate}({xtra_col}) as {prefix}_{xtra_col} ".format(
+                    aggregate=kwargs['select_extra_column'][1].upper(),
+                    xtra_col=kwargs['select_extra_column'][0], prefix=overlaymap_name)
+            subquery += "FROM {o_schema}.{{pairs}} "
+            subquery += "GROUP BY {id_}"
+            subquery = subquery.format(id_=basemap_id, suffix=overlaymap_name, 
+                                       o_schema=overlaymap_schema, o_name=overlaymap_name)
+            if 'class_column' not in kwargs:
+                subquery += "".join([", %s"%x for x in group_columns])
+        # Proportions of each class are set to 1.0 where unprecise division result may occur (not needed if overlapping overlays are dissolved)
+        if 'class_column' in kwargs and not kwargs.get('prepared', False):
+            clampcolumn = "CASE WHEN {col} > 1.0 THEN 1.0 ELSE {col} END AS {col}"
+            subquery = "SELECT {id_}_{suffix}".format(id_=basemap_id, suffix=overlaymap_name) + \
+                       "".join([", " + clampcolumn.format(col="%s_prop_%s"%(overlaymap_name,_class)) for _class in distinct_classes]) + \
+                       " FROM (" + subquery + ") AS a"
+
+        # Name of the table to be created
+        create_table = '%s_overlay_%s'%(basemap_name,overlaymap_name)
+        # Split reference units in ranges of id if parallel execution
+        if njobs > 1:
+            conditions = get_key_ranges(con, basemap_schema, basemap_name, basemap_id, 
+                                        kwargs.get('npartitions', njobs), column_expression='base.%s'%basemap_id)
+            partial_tables = ['tmp_%s_part%s'%(pid,i) for i,x in enumerate(conditions,1)]
+            pair_tables = ['tmp_pairs_%s_part%s'%(pid,i) for i,x in enumerate(conditions,1)]
+        else:
+            conditions = [None]
+            partial_tables = [create_table]
+            pair_tables = ['tmp_pairs_%s'%pid]
+        list_of_queries = []
+        for partial_table, pair_table, condition in zip(partial_tables, pair_tables, conditions):
+            where = "WHERE %s "%condition if condition else ""
+            query = ""
+            if fast_path:
+                query += "DROP TABLE IF EXISTS {schema}.{pairs}; CREATE UNLOGGED TABLE {schema}.{pairs} AS ({pairquery}); "
+                query = query.format(schema=overlaymap_schema, pairs=pair_table, pairquery=pairquery.format(where=where))
+                partial_query = subquery.format(pairs=pair_table)
+            else:
+                partial_query = subquery.format(where=where)
+            query += "DROP TABLE IF EXISTS {schema}.{table}; CREATE TABLE {schema}.{table} AS ({subquery});"
+            list_of_queries.append(query.format(schema=overlaymap_schema, table=partial_table, subquery=partial_query))
+        print(list_of_queries[0] + "\n")
+        if njobs > 1:
+            # Compute each range in a partial table on its own connexion
+            execute_parallel_queries(kwargs['connexion_param_dict'], list_of_queries, njobs)
+            # Merge partial tables
+            query = "CREATE TABLE {schema}.{table} AS ({subquery});"
+            query = query.format(schema=overlaymap_schema, table=create_table, 
+                                 subquery=" UNION ALL ".join(["SELECT * FROM %s.%s"%(overlaymap_schema,x) for x in partial_tables]))
             print(query + "\n")
             cursor.execute(query)
-            
-            subquery = "SELECT * FROM crosstab('{crosstabquery}', '{distinctlabelquery}') "
-            subquery += " AS ct ({columns_declaration})"
-            subquery = subquery.format(crosstabquery=crosstabquery, 
-                                       distinctlabelquery=distinctlabelquery,
-                                       columns_declaration=','.join(columns))
-            # Create table query
-            query = "CREATE TABLE {schema}.{table} AS ({subquery});"
-            query = query.format(schema=overlaymap_schema, 
-                                 table='%s_overlay_%s'%(basemap_name,overlaymap_name), 
-                                 subquery=subquery)
+            query = "DROP TABLE {tables};".format(tables=", ".join(["%s.%s"%(overlaymap_schema,x) for x in partial_tables]))
             print(query + "\n")
-            cursor.execute(query)                 
-            # Remove temporary table if needed
-            query = "DROP TABLE {schema}.{table};"
-            query = query.format(schema=overlaymap_schema, 
-                                 table='tmp_%s'%pid)
+            cursor.execute(query)
+        else:
+            cursor.execute(list_of_queries[0])
+        if fast_path:
+            # Report the number of pairs by computation path
+            query = "SELECT path, count(*) FROM ({pairs}) AS a GROUP BY path ORDER BY path;"
+            query = query.format(pairs=" UNION ALL ".join(["SELECT path FROM %s.%s"%(overlaymap_schema,x) for x in pair_tables]))
+            cursor.execute(query)
+            paths = dict(cursor.fetchall())
+            print("Candidate pairs by computation path: %s covered (area of reference unit), %s inside (area of overlay), %s partial (intersection), %s pruned\n"%(
+                paths.get('covered',0), paths.get('inside',0), paths.get('partial',0), paths.get('pruned',0)))
+            query = "DROP TABLE {tables};".format(tables=", ".join(["%s.%s"%(overlaymap_schema,x) for x in pair_tables]))
+            print(query + "\n")
+            cursor.execute(query)
+        # Update values where unprecise division result may occur (not needed if overlapping overlays are dissolved)
+        if 'class_column' not in kwargs and not kwargs.get('prepared', False):
+            query = "UPDATE {schema}.{table} "
+            query = query.format(schema=overlaymap_schema, table=create_table)
+            query += "SET {o_name}_coverage = 1.0 WHERE {o_name}_coverage > 1.0;"
+            query = query.format(schema=overlaymap_schema,b_name=basemap_name,o_name=overlaymap_name)
             print(query + "\n")
-            cursor.execute(query)   
-            # Make the changes to the database persistent
-            con.commit()
+            cursor.execute(query)
+        # Make the changes to the database persistent
+        con.commit()
         # Close connection with database
         cursor.close()
         ## Print processing time
@@ -320,6 +435,255 @@ def prop_coverage(con, basemap_schema, basemap_name, basemap_id, overlaymap_sche
         sys.exit(error)
         
 
+def prop_coverage_batch(con, basemap_schema, basemap_name, basemap_id, overlay_specs, output_schema, output_table, **kwargs):
+    """Function to compute, in a single pass on the reference units (e.g. cadastral parcels), the proportion covered by the polygonal geometries of several 
+    overlay maps. It gives the same columns as calling 'prop_coverage' for each overlay, but the reference units are read only once, their area is computed 
+    only once, and all columns are written in one wide table with one row by reference unit intersecting at least one overlay.
+    The result table can be used in the function 'get_final_table' with '<basemap_id>_<output_table>' as foreign key.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        basemap_schema (str): Name of the schema where the table with reference units is located.
+        basemap_name (str): Name of the table with reference units.
+        basemap_id (str): Name of column with unique id in the table with reference units.
+        overlay_specs (list of dict): List of dictionnaries describing each overlay map. Each dictionnary should contain 'schema' (str) and 'table' (str) 
+        with the name of the schema and table of the overlay map, and optionally:
+            'class_column' (str): Name of the column containing the type of class for overlaying polygons. If provided, columns '<table>_prop_<class>' are 
+            computed for each distinct 'class_column' values instead of '<table>_area' and '<table>_coverage'.
+            'select_extra_column'(tupple): Tupple containing as first element, the name of another column of the overlay, and as second element the type 
+            of aggregation to be used, e.g., SUM or MIN. Contrary to 'prop_coverage', the aggregation is made on all overlay polygons intersecting the 
+            reference unit, which gives one row by reference unit.
+            'prepared' (bool): Either the overlay should be read from its prepared table (see function 'prepare_overlay'). Default value is the value of the 
+            keyword argument 'prepared'. The coverage is still set to 1.0 where it exceeds 1.0 if 'select_extra_column' is provided, since the prepared 
+            table is then dissolved by each extra value too and the polygons of different values may overlap.
+            'pair_cache' (bool): Either the candidate pairs and the area of their intersection should be read from the persistent pair table (see function 
+            'build_pair_cache'). Default value is the value of the keyword argument 'pair_cache'.
+            'overlay_id' (str): Name of column with unique id in the overlay table, used by the pair table. Default value is 'gid' (always 'gid' with 'prepared').
+        output_schema (str): Name of the schema where the result table should be created.
+        output_table (str): Name of the result table.
+        **kwargs: 
+            'prepared' (bool): Default value of 'prepared' for overlays which do not specify it. Default value is False.
+            'max_vertices' (int): Maximum number of vertices of the subdivided polygons of prepared tables. Default value is 256.
+            'pair_cache' (bool): Default value of 'pair_cache' for overlays which do not specify it. Default value is False.
+            'njobs' (int): Number of parallel jobs. If provided and greater than 1, the reference units are splitted in ranges of 'basemap_id' computed 
+            on their own connexion. 'connexion_param_dict' should be provided too.
+            'npartitions' (int): Number of ranges in which the reference units are splitted for the parallel execution. Default value is 'njobs'.
+            'connexion_param_dict' (dict): A dictionnary containing informations for connection to the database, used by each parallel job (see function "create_pg_connexion").
+
+    Returns:
+        This function has no return value. 
+
+    Example:
+        prop_coverage_batch(con, 'agdp', 'capa', 'capakey', [{'schema':'sigec','table':'sigec_p'}, {'schema':'picc','table':'picc_surface','class_column':'hilucs'}, 
+        {'schema':'schools','table':'schools','select_extra_column':('indice_con','min')}], 'results', 'capa_overlay_batch', njobs=6, connexion_param_dict=config_parameters)
+    """
+    try:
+        ## Saving current time for processing time management
+        begintime = time.time()
+        # Check parallel execution parameters
+        njobs = int(kwargs.get('njobs', 1))
+        if njobs > 1 and 'connexion_param_dict' not in kwargs:
+            sys.exit("ERROR: 'connexion_param_dict' argument should be provided if 'njobs' is greater than 1.")
+        # Create cursor
+        cursor = con.cursor()
+        # Build one lateral subquery for each overlay
+        select_columns = []
+        lateral_queries = []
+        for i, spec in enumerate(overlay_specs, 1):
+            o_name = spec['table']
+            prepared = spec.get('prepared', kwargs.get('prepared', False))
+            # Columns of the overlay used in the aggregation
+            group_columns = []
+            if 'class_column' in spec:
+                group_columns.append(spec['class_column'])
+            if 'select_extra_column' in spec:
+                group_columns.append(spec['select_extra_column'][0])
+            # Table to be used for the overlay
+            if prepared:
+                overlay_table = prepare_overlay(con, spec['schema'], o_name, class_columns=group_columns, 
+                                                max_vertices=kwargs.get('max_vertices', 256))
+            else:
+                overlay_table = o_name
+            # Columns aggregated for this overlay
+            aggregates = ["count(*) AS n"]
+            coverage_columns = []
+            if 'class_column' in spec:
+                distinctlabelquery = "SELECT DISTINCT {_class} FROM {schema}.{overlay} WHERE {_class} IS NOT NULL ORDER BY {_class};"
+                distinctlabelquery = distinctlabelquery.format(schema=spec['schema'],overlay=o_name,_class=spec['class_column'])
+                print(distinctlabelquery + "\n")
+                cursor.execute(distinctlabelquery)
+                for _class in [x[0] for x in cursor.fetchall()]:
+                    aggregate = "ROUND(CAST(SUM(a/base.base_area) FILTER (WHERE {class_column} = {value}) AS numeric),4) AS {o_name}_prop_{_class}"
+                    aggregates.append(aggregate.format(class_column=spec['class_column'], value=cursor.mogrify("%s", (_class,)).decode(), 
+                                                       o_name=o_name, _class=_class))
+                    coverage_columns.append("%s_prop_%s"%(o_name,_class))
+            else:
+                aggregates.append("ROUND(CAST(SUM(a) AS numeric),4) AS {o_name}_area".format(o_name=o_name))
+                aggregates.append("ROUND(CAST(SUM(a/base.base_area) AS numeric),4) AS {o_name}_coverage".format(o_name=o_name))
+                select_columns.append("o_{i}.{o_name}_area".format(i=i, o_name=o_name))
+                coverage_columns.append("%s_coverage"%o_name)
+            # Coverage is set to 1.0 where unprecise division result may occur (not needed if overlapping overlays are dissolved, unless they are 
+            # dissolved by the extra column too: the polygons of different extra values may overlap and they are all summed in one row)
+            for column in coverage_columns:
+                if prepared and 'select_extra_column' not in spec:
+                    select_columns.append("o_{i}.{col}".format(i=i, col=column))
+                else:
+                    select_columns.append("CASE WHEN o_{i}.{col} > 1.0 THEN 1.0 ELSE o_{i}.{col} END AS {col}".format(i=i, col=column))
+            if 'select_extra_column' in spec:
+                aggregates.append("{aggregate}({xtra_col}) AS {o_name}_{xtra_col}".format(aggregate=spec['select_extra_column'][1].upper(), 
+                                                                                         xtra_col=spec['select_extra_column'][0], o_name=o_name))
+                select_columns.append("o_{i}.{o_name}_{xtra_col}".format(i=i, o_name=o_name, xtra_col=spec['select_extra_column'][0]))
+            # Lateral subquery: the intersection is computed once for each pair
+            if spec.get('pair_cache', kwargs.get('pair_cache', False)):
+                overlay_id = 'gid' if prepared else spec.get('overlay_id', 'gid')
+                pair_table = build_pair_cache(con, basemap_schema, basemap_name, basemap_id, spec['schema'], overlay_table, overlay_id=overlay_id, with_area=True, 
+                                              njobs=njobs, connexion_param_dict=kwargs.get('connexion_param_dict'))
+                lateral = "CROSS JOIN LATERAL (SELECT {aggregates} FROM (SELECT {cols}pairs.area AS a "
+                lateral += "FROM {o_schema}.%s AS pairs JOIN {o_schema}.{o_table} AS overlay ON overlay.%s = pairs.overlay_id "%(pair_table, overlay_id)
+                lateral += "WHERE pairs.base_id = base.%s) AS p) AS o_{i} "%basemap_id
+            else:
+                lateral = "CROSS JOIN LATERAL (SELECT {aggregates} FROM (SELECT {cols}st_area(st_Intersection(base.geom,overlay.geom)) AS a "
+                lateral += "FROM {o_schema}.{o_table} AS overlay WHERE st_intersects(base.geom,overlay.geom)) AS p) AS o_{i} "
+            lateral = lateral.format(aggregates=", ".join(aggregates), cols="".join(["overlay.%s, "%x for x in group_columns]),
+                                     o_schema=spec['schema'], o_table=overlay_table, i=i)
+            lateral_queries.append(lateral)
+        # Main query, with a '{where}' placeholder for the partitions of reference units
+        subquery = "SELECT base.{id_} AS {id_}_{output}, {columns} "
+        subquery += "FROM (SELECT {id_}, geom, st_area(geom) AS base_area FROM {b_schema}.{b_name} AS base {{where}}) AS base "
+        subquery += "{laterals}"
+        subquery += "WHERE {count} > 0"
+        subquery = subquery.format(id_=basemap_id, output=output_table, columns=", ".join(select_columns),
+                                   b_schema=basemap_schema, b_name=basemap_name, laterals="".join(lateral_queries),
+                                   count=" + ".join(["o_%s.n"%i for i,x in enumerate(overlay_specs, 1)]))
+        # Partitions of reference units
+        if njobs > 1:
+            conditions = get_key_ranges(con, basemap_schema, basemap_name, basemap_id, 
+                                        kwargs.get('npartitions', njobs), column_expression='base.%s'%basemap_id)
+        else:
+            conditions = ["TRUE"]
+        cursor.close()
+        create_table_by_partitions(con, kwargs.get('connexion_param_dict'), output_schema, output_table, subquery, conditions, njobs)
+        ## Print processing time
+        print(print_processing_time(begintime, "Computation of PropCoverageBatch function achieved in "))
+    except (Exception, psycopg2.DatabaseError) as error:
+        sys.exit(error)
+        
+
+def nearest_distance(con, basemap_schema, basemap_name, basemap_id, overlaymap_schema, overlaymap_name, **kwargs):
+    """Function to compute the distance between each polygonal geometry from 'basemap', e.g. cadastral parcels, and the nearest geometry from 'overlaymap', 
+    e.g. seveso sites or schools. The nearest geometry is found with the KNN ordering of the spatial index (operator '<->'). The distance is 0 for reference 
+    units intersecting the overlay. The table '<basemap_name>_nearest_<overlaymap_name>' is created in the schema of the overlay, with the column 
+    '<overlaymap_name>_distance' and '<basemap_id>_nearest_<overlaymap_name>' as foreign key (to be used with the function 'get_final_table').
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        basemap_schema (str): Name of the schema where the table with reference units is located.
+        basemap_name (str): Name of the table with reference units.
+        basemap_id (str): Name of column with unique id in the table with reference units.
+        overlaymap_schema (str): Name of the schema where the table with ancillary data (overlaying layer) is located.
+        overlaymap_name (str): Name of the table with ancillary data (overlaying layer).
+        **kwargs: 
+            'overlay_filter' (str): SQL condition on the overlay (alias 'overlay') to select the features considered, e.g. "overlay.seuil = 'haut'".
+            'max_distance' (float): Maximum distance searched. Reference units without any feature at this distance get a NULL distance. Default value is None (no limit).
+            'njobs' (int): Number of parallel jobs. If provided and greater than 1, the reference units are splitted in ranges of 'basemap_id' computed 
+            on their own connexion. 'connexion_param_dict' should be provided too.
+            'npartitions' (int): Number of ranges in which the reference units are splitted for the parallel execution. Default value is 'njobs'.
+            'connexion_param_dict' (dict): A dictionnary containing informations for connection to the database, used by each parallel job (see function "create_pg_connexion").
+
+    Returns:
+        This function has no return value. 
+    """
+    try:
+        ## Saving current time for processing time management
+        begintime = time.time()
+        # Check parallel execution parameters
+        njobs = int(kwargs.get('njobs', 1))
+        if njobs > 1 and 'connexion_param_dict' not in kwargs:
+            sys.exit("ERROR: 'connexion_param_dict' argument should be provided if 'njobs' is greater than 1.")
+        # Conditions on the overlay features
+        overlay_conditions = []
+        if 'overlay_filter' in kwargs:
+            overlay_conditions.append("(%s)"%kwargs['overlay_filter'])
+        if kwargs.get('max_distance', None) is not None:
+            overlay_conditions.append("ST_DWithin(base.geom,overlay.geom,%s)"%float(kwargs['max_distance']))
+        # Nearest feature found with the KNN ordering of the spatial index
+        subquery = "SELECT base.{id_} AS {id_}_nearest_{o_name}, ROUND(CAST(nearest.distance AS numeric),4) AS {o_name}_distance "
+        subquery += "FROM {b_schema}.{b_name} AS base LEFT JOIN LATERAL (SELECT ST_Distance(base.geom,overlay.geom) AS distance "
+        subquery += "FROM {o_schema}.{o_name} AS overlay {conditions}ORDER BY base.geom <-> overlay.geom LIMIT 1) AS nearest ON TRUE {{where}}"
+        subquery = subquery.format(id_=basemap_id, b_schema=basemap_schema, b_name=basemap_name, o_schema=overlaymap_schema, o_name=overlaymap_name,
+                                   conditions="WHERE %s "%" AND ".join(overlay_conditions) if overlay_conditions else "")
+        # Partitions of reference units
+        if njobs > 1:
+            conditions = get_key_ranges(con, basemap_schema, basemap_name, basemap_id, 
+                                        kwargs.get('npartitions', njobs), column_expression='base.%s'%basemap_id)
+        else:
+            conditions = ["TRUE"]
+        create_table_by_partitions(con, kwargs.get('connexion_param_dict'), overlaymap_schema, '%s_nearest_%s'%(basemap_name,overlaymap_name), 
+                                   subquery, conditions, njobs)
+        ## Print processing time
+        print(print_processing_time(begintime, "Computation of NearestDistance function achieved in "))
+    except (Exception, psycopg2.DatabaseError) as error:
+        sys.exit(error)
+
+
+def radius_aggregate(con, basemap_schema, basemap_name, basemap_id, overlaymap_schema, overlaymap_name, radius, **kwargs):
+    """Function to compute the number of geometries from 'overlaymap', e.g. address points, within a given distance of each polygonal geometry from 'basemap', 
+    e.g. cadastral parcels, and optionally the sum of an attribute column of these geometries, e.g. the population. The distance filter (ST_DWithin) uses 
+    the spatial index. The table '<basemap_name>_radius_<overlaymap_name>' is created in the schema of the overlay, with the columns 
+    '<overlaymap_name>_count_<radius>m' (and '<sum_column>_sum_<radius>m') and '<basemap_id>_radius_<overlaymap_name>' as foreign key (to be used with 
+    the function 'get_final_table'). Reference units without any geometry within the distance are not present in the table.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        basemap_schema (str): Name of the schema where the table with reference units is located.
+        basemap_name (str): Name of the table with reference units.
+        basemap_id (str): Name of column with unique id in the table with reference units.
+        overlaymap_schema (str): Name of the schema where the table with ancillary data (overlaying layer) is located.
+        overlaymap_name (str): Name of the table with ancillary data (overlaying layer).
+        radius (int): Distance (in map units) from the reference units.
+        **kwargs: 
+            'sum_column' (str): Name of the column containing values for which the sum should be computed.
+            'overlay_filter' (str): SQL condition on the overlay (alias 'overlay') to select the features considered.
+            'njobs' (int): Number of parallel jobs. If provided and greater than 1, the reference units are splitted in ranges of 'basemap_id' computed 
+            on their own connexion. 'connexion_param_dict' should be provided too.
+            'npartitions' (int): Number of ranges in which the reference units are splitted for the parallel execution. Default value is 'njobs'.
+            'connexion_param_dict' (dict): A dictionnary containing informations for connection to the database, used by each parallel job (see function "create_pg_connexion").
+
+    Returns:
+        This function has no return value. 
+
+    Example:
+        radius_aggregate(con, 'agdp', 'capa', 'capakey', 'rnpp', 'rnpp', 200, sum_column='population', njobs=6, connexion_param_dict=config_parameters)
+    """
+    try:
+        ## Saving current time for processing time management
+        begintime = time.time()
+        # Check parallel execution parameters
+        njobs = int(kwargs.get('njobs', 1))
+        if njobs > 1 and 'connexion_param_dict' not in kwargs:
+            sys.exit("ERROR: 'connexion_param_dict' argument should be provided if 'njobs' is greater than 1.")
+        # Features within the distance
+        subquery = "SELECT base.{id_} AS {id_}_radius_{o_name}, count(*) AS {o_name}_count_{r}m"
+        if 'sum_column' in kwargs:
+            subquery += ", sum(overlay.{sum_col}) AS {sum_col}_sum_{r}m".format(sum_col=kwargs['sum_column'], r=int(radius))
+        subquery += " FROM {b_schema}.{b_name} AS base JOIN {o_schema}.{o_name} AS overlay ON ST_DWithin(base.geom,overlay.geom,{radius}){o_filter} "
+        subquery += "{{where}}GROUP BY base.{id_}"
+        subquery = subquery.format(id_=basemap_id, b_schema=basemap_schema, b_name=basemap_name, o_schema=overlaymap_schema, o_name=overlaymap_name,
+                                   r=int(radius), radius=float(radius), o_filter=" AND (%s)"%kwargs['overlay_filter'] if 'overlay_filter' in kwargs else "")
+        # Partitions of reference units
+        if njobs > 1:
+            conditions = get_key_ranges(con, basemap_schema, basemap_name, basemap_id, 
+                                        kwargs.get('npartitions', njobs), column_expression='base.%s'%basemap_id)
+        else:
+            conditions = ["TRUE"]
+        create_table_by_partitions(con, kwargs.get('connexion_param_dict'), overlaymap_schema, '%s_radius_%s'%(basemap_name,overlaymap_name), 
+                                   subquery, conditions, njobs)
+        ## Print processing time
+        print(print_processing_time(begintime, "Computation of RadiusAggregate function achieved in "))
+    except (Exception, psycopg2.DatabaseError) as error:
+        sys.exit(error)
+
+
 def count_points(con, basemap_schema, basemap_name, basemap_id, overlaymap_schema, overlaymap_name, **kwargs):
     """Function to compute the count of points from a 'overlaymap' map, e.g. windturbines, that are inside the polygonal geometries of a 'basemap', e.g. cadastral parcels.
     
@@ -333,35 +697,45 @@ def count_points(con, basemap_schema, basemap_name, basemap_id, overlaymap_schem
         **kwargs: 
             'class_column' (str): Name of the column containing the type of class for overlaying polygons. If provided, the result table will have multiple columns corresponding to each distinct 'class_column' values.
             'select_extra_column'(tupple): Tupple containing as first element, the name of another column to be used in the group by query, and as second element the type of aggregation to be used, e.g., SUM or MIN.
+            'pair_cache' (bool): If True, the candidate pairs are read from the persistent pair table of the reference units and the overlay 
+            (see function 'build_pair_cache'), which is created or rebuilt only if needed. Default value is False.
+            'overlay_id' (str): Name of column with unique id in the overlay table, used by the pair table. Default value is 'gid'.
+            'backend' (str): Either 'postgis' (default) or 'inprocess'. With 'inprocess', the same table is computed in Python with shapely 
+            (see function 'count_points_inprocess'), using 'njobs' processes and chunks of 'chunksize' reference units.
 
     Returns:
         This function has no return value. 
     """
+    # In-process backend (requires shapely>=2.0)
+    if kwargs.get('backend', 'postgis') == 'inprocess':
+        from inprocess_overlay import count_points_inprocess
+        return count_points_inprocess(con, basemap_schema, basemap_name, basemap_id, overlaymap_schema, overlaymap_name, **kwargs)
     try:
         ## Saving current time for processing time management
         begintime = time.time()    
-        # Get ID of current processus 
-        pid = os.getpid()
         # Create cursor
         cursor = con.cursor()
         # Get list of distinct class name if 'class_column' is provided
         if 'class_column' in kwargs:
-            distinctlabelquery = "SELECT DISTINCT {_class} FROM {schema}.{overlay} ORDER BY {_class};"
+            distinctlabelquery = "SELECT DISTINCT {_class} FROM {schema}.{overlay} WHERE {_class} IS NOT NULL ORDER BY {_class};"
             distinctlabelquery = distinctlabelquery.format(schema=overlaymap_schema,overlay=overlaymap_name,_class=kwargs['class_column'])
             print(distinctlabelquery + "\n")
             cursor.execute(distinctlabelquery)
             distinct_classes = [x[0] for x in cursor.fetchall()]
         # Drop table if exits
         query = "DROP TABLE IF EXISTS {schema}.{table};"
-        if 'class_column' not in kwargs:
-            query = query.format(schema=overlaymap_schema,table='%s_count_%s'%(basemap_name,overlaymap_name))
-        else:
-            query = query.format(schema=overlaymap_schema,table='tmp_%s'%pid)
+        query = query.format(schema=overlaymap_schema,table='%s_count_%s'%(basemap_name,overlaymap_name))
         print(query + "\n")
         cursor.execute(query)
         # WITH Query 
         withquery = "WITH tmp AS (SELECT a.*,b.{id_} FROM {o_schema}.{o_name} as a "
-        withquery += "JOIN {b_schema}.{b_name} as b ON ST_Intersects(a.geom,b.geom))"
+        if kwargs.get('pair_cache', False):
+            pair_table = build_pair_cache(con, basemap_schema, basemap_name, basemap_id, overlaymap_schema, overlaymap_name, 
+                                          overlay_id=kwargs.get('overlay_id', 'gid'))
+            withquery += "JOIN {o_schema}.%s as pairs ON pairs.overlay_id = a.%s "%(pair_table, kwargs.get('overlay_id', 'gid'))
+            withquery += "JOIN {b_schema}.{b_name} as b ON b.{id_} = pairs.base_id)"
+        else:
+            withquery += "JOIN {b_schema}.{b_name} as b ON ST_Intersects(a.geom,b.geom))"
         withquery = withquery.format(id_=basemap_id, b_schema=basemap_schema, b_name=basemap_name,
                                      o_schema=overlaymap_schema, o_name=overlaymap_name)        
         # MAIN query 
@@ -370,61 +744,23 @@ def count_points(con, basemap_schema, basemap_name, basemap_id, overlaymap_schem
             mainquery = mainquery.format(with_=withquery, id_=basemap_id, 
                                          o_name=overlaymap_name, suffix=overlaymap_name)
         else:
-            mainquery = "{with_} SELECT {id_} as {id_}_{o_name}, {_class}, count(*) FROM tmp "
+            # Pivot columns computed by conditional aggregation, one column by class
+            pivotcolumn = "CAST(NULLIF(count(*) FILTER (WHERE {_class} = {value}),0) AS numeric) AS {suffix}_count_{label}"
+            pivot_columns = [pivotcolumn.format(_class=kwargs['class_column'], value=cursor.mogrify("%s", (label,)).decode(), 
+                                                suffix=overlaymap_name, label=label) for label in distinct_classes]
+            mainquery = "{with_} SELECT {id_}::varchar as {id_}_{o_name}{columns} FROM tmp "
             mainquery = mainquery.format(with_=withquery, 
                                         id_=basemap_id, o_name=overlaymap_name, 
-                                        _class=kwargs['class_column'])    
+                                        columns="".join([", %s"%x for x in pivot_columns]))    
         mainquery += "GROUP BY %s"%basemap_id
-        if 'class_column' in kwargs:
-            mainquery += ", %s"%kwargs['class_column']          
         # Create table query
         query = "CREATE TABLE {schema}.{table} AS ({mainquery});"
-        if 'class_column' not in kwargs:
-            query = query.format(schema=overlaymap_schema, 
-                                 table='%s_count_%s'%(basemap_name,overlaymap_name), mainquery=mainquery)
-        else:
-            query = query.format(schema=overlaymap_schema, 
-                                 table='tmp_%s'%pid, mainquery=mainquery)
+        query = query.format(schema=overlaymap_schema, 
+                             table='%s_count_%s'%(basemap_name,overlaymap_name), mainquery=mainquery)
         print(query + "\n")
         cursor.execute(query)
         # Make the changes to the database persistent
         con.commit()
-        # If multiclass overlay calculation, pivoting table
-        if 'class_column' in kwargs:
-            # Crosstab query argument
-            crosstabquery = "SELECT {id_}_{suffix}, {class_column}, count "
-            crosstabquery += "FROM {schema}.{table} ORDER  BY 1,2"
-            crosstabquery = crosstabquery.format(id_=basemap_id, suffix=overlaymap_name,
-                                                 class_column=kwargs['class_column'],
-                                                 schema=overlaymap_schema, table='tmp_%s'%pid)
-            # Declaration of colums for the pivot table
-            columns=["{id_}_{suffix} VARCHAR".format(id_=basemap_id, suffix=overlaymap_name),]
-            [columns.append("{suffix}_count_{_class} NUMERIC".format(suffix=overlaymap_name,_class=_class)) for _class in distinct_classes]
-            # Queries for pivoting table
-            query = "DROP TABLE IF EXISTS {schema}.{table};"
-            query = query.format(schema=overlaymap_schema,table='%s_count_%s'%(basemap_name,overlaymap_name))
-            print(query + "\n")
-            cursor.execute(query)
-            subquery = "SELECT * FROM crosstab('{crosstabquery}', '{distinctlabelquery}') "
-            subquery += " AS ct ({columns_declaration})"
-            subquery = subquery.format(crosstabquery=crosstabquery, 
-                                       distinctlabelquery=distinctlabelquery,
-                                       columns_declaration=','.join(columns))
-            # Create table query
-            query = "CREATE TABLE {schema}.{table} AS ({subquery});"
-            query = query.format(schema=overlaymap_schema, 
-                                 table='%s_count_%s'%(basemap_name,overlaymap_name), 
-                                 subquery=subquery)
-            print(query + "\n")
-            cursor.execute(query)                 
-            # Remove temporary table if needed
-            query = "DROP TABLE {schema}.{table};"
-            query = query.format(schema=overlaymap_schema, 
-                                 table='tmp_%s'%pid)
-            print(query + "\n")
-            cursor.execute(query)   
-            # Make the changes to the database persistent
-            con.commit()
         # Close connection with database
         cursor.close()
         ## Print processing time
@@ -433,7 +769,7 @@ def count_points(con, basemap_schema, basemap_name, basemap_id, overlaymap_schem
         sys.exit(error)
         
 
-def sum_points(con, basemap_schema, basemap_name, basemap_id, overlaymap_schema, overlaymap_name, overlaymap_sumcolumn):
+def sum_points(con, basemap_schema, basemap_name, basemap_id, overlaymap_schema, overlaymap_name, overlaymap_sumcolumn, **kwargs):
     """Function to compute the sum of an attribute column of points from a 'overlaymap' map, e.g. windturbines, that are inside the polygonal geometries of a 'basemap', e.g. cadastral parcels.
     
     Args:
@@ -444,10 +780,20 @@ def sum_points(con, basemap_schema, basemap_name, basemap_id, overlaymap_schema,
         overlaymap_schema (str): Name of the schema where the table with ancillary data (overlaying layer) is located.
         overlaymap_name (str): Name of the table with ancillary data (overlaying layer).
         overlaymap_sumcolumn (str): Name of the column containing values for which the sum should be computed.
+        **kwargs: 
+            'pair_cache' (bool): If True, the candidate pairs are read from the persistent pair table of the reference units and the overlay 
+            (see function 'build_pair_cache'), which is created or rebuilt only if needed. Default value is False.
+            'overlay_id' (str): Name of column with unique id in the overlay table, used by the pair table. Default value is 'gid'.
+            'backend' (str): Either 'postgis' (default) or 'inprocess'. With 'inprocess', the same table is computed in Python with shapely 
+            (see function 'sum_points_inprocess'), using 'njobs' processes and chunks of 'chunksize' reference units.
 
     Returns:
         This function has no return value. 
     """
+    # In-process backend (requires shapely>=2.0)
+    if kwargs.get('backend', 'postgis') == 'inprocess':
+        from inprocess_overlay import sum_points_inprocess
+        return sum_points_inprocess(con, basemap_schema, basemap_name, basemap_id, overlaymap_schema, overlaymap_name, overlaymap_sumcolumn, **kwargs)
     try:
         ## Saving current time for processing time management
         begintime = time.time()
@@ -460,7 +806,13 @@ def sum_points(con, basemap_schema, basemap_name, basemap_id, overlaymap_schema,
         cursor.execute(query)
         # Query 
         withquery = "WITH tmp AS (SELECT a.*,b.{id_} FROM {o_schema}.{o_name} as a "
-        withquery += "JOIN {b_schema}.{b_name} as b ON ST_Intersects(a.geom,b.geom))"
+        if kwargs.get('pair_cache', False):
+            pair_table = build_pair_cache(con, basemap_schema, basemap_name, basemap_id, overlaymap_schema, overlaymap_name, 
+                                          overlay_id=kwargs.get('overlay_id', 'gid'))
+            withquery += "JOIN {o_schema}.%s as pairs ON pairs.overlay_id = a.%s "%(pair_table, kwargs.get('overlay_id', 'gid'))
+            withquery += "JOIN {b_schema}.{b_name} as b ON b.{id_} = pairs.base_id)"
+        else:
+            withquery += "JOIN {b_schema}.{b_name} as b ON ST_Intersects(a.geom,b.geom))"
         withquery = withquery.format(id_=basemap_id, b_schema=basemap_schema, b_name=basemap_name,
                                      o_schema=overlaymap_schema, o_name=overlaymap_name)
         
@@ -484,6 +836,113 @@ def sum_points(con, basemap_schema, basemap_name, basemap_id, overlaymap_schema,
         sys.exit(error)
         
 
+def aggregate_points(con, basemap_schema, basemap_name, basemap_id, point_specs, **kwargs):
+    """Function to compute statistics of several point layers, e.g. address points or windturbines, by polygonal geometries of a 'basemap', e.g. cadastral parcels.
+    Contrary to the functions 'count_points' and 'sum_points', each point is assigned to exactly one reference unit (the one with the lowest id among 
+    those intersecting the point, found with an indexed lookup), so that points on a shared boundary are not counted twice. Each point layer is read only 
+    once (the points are assigned once in a temporary table, from which the tables of all specs of the layer are created) and only the columns aggregated 
+    are carried. The tables created have the same names and columns as the tables of 'count_points' and 'sum_points'.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        basemap_schema (str): Name of the schema where the table with reference units is located.
+        basemap_name (str): Name of the table with reference units.
+        basemap_id (str): Name of column with unique id in the table with reference units.
+        point_specs (list of dict): List of dictionnaries describing each point layer. Each dictionnary should contain 'schema' (str) and 'table' (str) 
+        with the name of the schema and table of the point layer, and optionally:
+            'sum_column' (str): Name of the column containing values for which the sum should be computed. If provided, the table '<basemap_name>_sum_<table>' 
+            is created as with 'sum_points'.
+            'class_column' (str): Name of the column containing the type of class of the points. If provided, the table '<basemap_name>_count_<table>' has one 
+            column by class as with 'count_points'.
+            If both are provided, both tables are created. Otherwise the table '<basemap_name>_count_<table>' is created with the number of points as 
+            with 'count_points'. Several specs of the same point layer can not create the same table.
+        **kwargs: 
+            'njobs' (int): Number of point layers processed at the same time, each on its own connexion (with all its specs). 'connexion_param_dict' should be provided too.
+            'connexion_param_dict' (dict): A dictionnary containing informations for connection to the database, used by each parallel job (see function "create_pg_connexion").
+
+    Returns:
+        This function has no return value. 
+
+    Example:
+        aggregate_points(con, 'agdp', 'capa', 'capakey', [{'schema':'rnpp','table':'rnpp'}, {'schema':'eoliennes','table':'eoliennes','sum_column':'puissance'}, 
+        {'schema':'picc','table':'picc_symbology','class_column':'hilucs'}], njobs=3, connexion_param_dict=config_parameters)
+    """
+    try:
+        ## Saving current time for processing time management
+        begintime = time.time()
+        # Check parallel execution parameters
+        njobs = int(kwargs.get('njobs', 1))
+        if njobs > 1 and 'connexion_param_dict' not in kwargs:
+            sys.exit("ERROR: 'connexion_param_dict' argument should be provided if 'njobs' is greater than 1.")
+        # Create cursor
+        cursor = con.cursor()
+        # Specs grouped by point layer, in the order of their first occurence
+        layers = {}
+        for spec in point_specs:
+            layers.setdefault((spec['schema'], spec['table']), []).append(spec)
+        list_of_queries = []
+        for i, ((o_schema, o_name), specs) in enumerate(layers.items(), 1):
+            # Columns of the points carried in the query, for all specs of the layer
+            columns = []
+            for spec in specs:
+                columns += [spec[x] for x in ('sum_column', 'class_column') if x in spec and spec[x] not in columns]
+            # Each point is assigned to the reference unit with the lowest id among those intersecting it. The assignment is computed once 
+            # by point layer in a temporary table, from which the tables of all specs of the layer are created
+            assign_table = 'tmp_assign_%s'%i
+            assignquery = "SELECT assign.{id_}{cols} FROM {o_schema}.{o_name} AS p "
+            assignquery += "CROSS JOIN LATERAL (SELECT b.{id_} FROM {b_schema}.{b_name} AS b WHERE ST_Intersects(b.geom,p.geom) ORDER BY b.{id_} LIMIT 1) AS assign"
+            assignquery = assignquery.format(id_=basemap_id, cols="".join([", p.%s"%x for x in columns]), o_schema=o_schema, o_name=o_name,
+                                             b_schema=basemap_schema, b_name=basemap_name)
+            queries = ["DROP TABLE IF EXISTS pg_temp.{a}; CREATE TEMP TABLE {a} AS ({assignquery});".format(a=assign_table, assignquery=assignquery)]
+            tables = []
+            for spec in specs:
+                mainqueries = []
+                if 'sum_column' in spec:
+                    table_name = '%s_sum_%s'%(basemap_name,o_name)
+                    mainquery = "SELECT {id_} as {id_}_{suffix}, sum({sum_col}) as {sum_col}_tot, count(*) as count_{suffix}_points "
+                    mainqueries.append((table_name, mainquery.format(id_=basemap_id, suffix=o_name, sum_col=spec['sum_column'])))
+                if 'class_column' in spec:
+                    table_name = '%s_count_%s'%(basemap_name,o_name)
+                    distinctlabelquery = "SELECT DISTINCT {_class} FROM {schema}.{overlay} WHERE {_class} IS NOT NULL ORDER BY {_class};"
+                    distinctlabelquery = distinctlabelquery.format(schema=o_schema,overlay=o_name,_class=spec['class_column'])
+                    print(distinctlabelquery + "\n")
+                    cursor.execute(distinctlabelquery)
+                    # Pivot columns computed by conditional aggregation, one column by class
+                    pivotcolumn = "CAST(NULLIF(count(*) FILTER (WHERE {_class} = {value}),0) AS numeric) AS {suffix}_count_{label}"
+                    pivot_columns = [pivotcolumn.format(_class=spec['class_column'], value=cursor.mogrify("%s", (x[0],)).decode(), 
+                                                        suffix=o_name, label=x[0]) for x in cursor.fetchall()]
+                    mainquery = "SELECT {id_}::varchar as {id_}_{suffix}{columns} "
+                    mainqueries.append((table_name, mainquery.format(id_=basemap_id, suffix=o_name, columns="".join([", %s"%x for x in pivot_columns]))))
+                if not mainqueries:
+                    table_name = '%s_count_%s'%(basemap_name,o_name)
+                    mainquery = "SELECT {id_} as {id_}_{suffix}, count(*) as {suffix}_count ".format(id_=basemap_id, suffix=o_name)
+                    mainqueries.append((table_name, mainquery))
+                for table_name, mainquery in mainqueries:
+                    if table_name in tables:
+                        sys.exit("ERROR: the table '%s.%s' is created by several specs of the point layer."%(o_schema,table_name))
+                    tables.append(table_name)
+                    mainquery += "FROM pg_temp.{a} AS a GROUP BY {id_}".format(a=assign_table, id_=basemap_id)
+                    query = "DROP TABLE IF EXISTS {schema}.{table}; CREATE TABLE {schema}.{table} AS ({mainquery});"
+                    queries.append(query.format(schema=o_schema, table=table_name, mainquery=mainquery))
+            queries.append("DROP TABLE pg_temp.%s;"%assign_table)
+            query = " ".join(queries)
+            print(query + "\n")
+            list_of_queries.append(query)
+        if njobs > 1:
+            # Each point layer is processed on its own connexion
+            execute_parallel_queries(kwargs['connexion_param_dict'], list_of_queries, njobs)
+        else:
+            [cursor.execute(query) for query in list_of_queries]
+        # Make the changes to the database persistent
+        con.commit()
+        # Close connection with database
+        cursor.close()
+        ## Print processing time
+        print(print_processing_time(begintime, "Computation of AggregatePoints function achieved in "))
+    except (Exception, psycopg2.DatabaseError) as error:
+        sys.exit(error)
+        
+
 def get_final_table(con, table_name, join_table_informations):
     """Function to create the final table joining the cadastral parcels with all other tables.
     
@@ -533,4 +992,102 @@ def get_final_table(con, table_name, join_table_informations):
     ## Print processing time
     print(print_processing_time(begintime, "Creation of final table achieved in "))
     
-    
\ No newline at end of file
+    
+
+def get_final_table_batched(con, table_name, join_table_informations, **kwargs):
+    """Function to create the final table joining the cadastral parcels with all other tables, in batches of cadastral parcels. 
+    Contrary to the function 'get_final_table', the table is created directly with its final columns (no columns are dropped afterwards) and 
+    each batch (range of capakey) is committed separately and recorded in a checkpoint table '<table_name>_checkpoint', so that a failed run 
+    can be resumed from the last batch committed. A hash of the query (tables, columns and joins) is stored as comment of the checkpoint 
+    table, and a run with a different query does not resume the previous one but exits with an error.
+    
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        table_name (str): Name of the table to be created.
+        join_table_informations (list of tupple): A list of tupple containing the informations about the different tables to be jointed together. 
+        The first element (str) of each tupple should contain the name of the schema where the table is located, the second element (str) should contain the name 
+        of the table to be jointed, and the third element (str) should contain the foreign key to be used with the capakey. The fourth element (list of str) is 
+        optional and contains the list of columns to be kept from the table. If not provided, all columns are kept, except the foreign key and 'cat'.
+        **kwargs: 
+            'nbatches' (int): Number of batches (ranges of capakey). Default value is 20.
+            'resume' (bool): If True and a checkpoint table exists for this table, only the batches not yet achieved are computed. If False, the table is 
+            created again from the first batch. Default value is True.
+   
+    Returns:
+        This function has no return value. 
+    """
+    ## Saving current time for processing time management
+    begintime = time.time()   
+    # Create cursor
+    cursor = con.cursor()
+    checkpoint_table = '%s_checkpoint'%table_name
+    # List of columns kept from each table
+    select_columns = ["a.geom", "a.capakey"]
+    for i,table_info in enumerate(join_table_informations,1):
+        if len(table_info) > 3:
+            columns = table_info[3]
+        else:
+            query = "SELECT column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s ORDER BY ordinal_position;"
+            cursor.execute(query, (table_info[0], table_info[1]))
+            columns = [x[0] for x in cursor.fetchall() if x[0] not in (table_info[2], 'cat')]
+        [select_columns.append("b_%s.%s"%(i,x)) for x in columns]
+    # Query 
+    mainquery = "SELECT " + ", ".join(select_columns)
+    mainquery += " FROM agdp.capa AS a "
+    for i,table_info in enumerate(join_table_informations,1):
+        mainquery += "LEFT JOIN {sche}.{tabl} AS b_{i} ON a.capakey=b_{i}.{z} ".format(sche=table_info[0],tabl=table_info[1],
+                                                                          i=i,z=table_info[2])
+    # Hash of the query, stored with the checkpoint table
+    spec = "query=%s"%hashlib.md5(mainquery.encode()).hexdigest()
+    # Check if a previous run can be resumed
+    cursor.execute("SELECT to_regclass('results.%s') IS NOT NULL AND to_regclass('results.%s') IS NOT NULL;"%(table_name,checkpoint_table))
+    resume = kwargs.get('resume', True) and cursor.fetchone()[0]
+    if resume:
+        cursor.execute("SELECT obj_description('results.%s'::regclass, 'pg_class');"%checkpoint_table)
+        if cursor.fetchone()[0] != spec:
+            cursor.close()
+            sys.exit("ERROR: the checkpoint table 'results.%s' was created for other tables or columns, the run can not be resumed. "
+                     "Please use 'resume=False' to create the table again."%checkpoint_table)
+        print("Resuming the creation of table 'results.%s' from its checkpoint table\n"%table_name)
+    else:
+        # Create the table empty with its final columns
+        query = "DROP TABLE IF EXISTS results.{table_name}; DROP TABLE IF EXISTS results.{checkpoint};"
+        query += "CREATE TABLE results.{table_name} AS ({mainquery}) WITH NO DATA;"
+        query = query.format(table_name=table_name, checkpoint=checkpoint_table, mainquery=mainquery)
+        cursor.execute(query)
+        print(query + "\n")
+        # Create the checkpoint table with the ranges of capakey
+        query = "CREATE TABLE results.{checkpoint} (batch integer PRIMARY KEY, condition text, done boolean DEFAULT FALSE, done_at timestamp);"
+        query += "COMMENT ON TABLE results.{checkpoint} IS %s;"
+        query = query.format(checkpoint=checkpoint_table)
+        cursor.execute(query, (spec,))
+        print(query + "\n")
+        conditions = get_key_ranges(con, 'agdp', 'capa', 'capakey', kwargs.get('nbatches', 20), column_expression='a.capakey')
+        [cursor.execute("INSERT INTO results.%s (batch, condition) VALUES (%%s, %%s);"%checkpoint_table, (i, x)) for i,x in enumerate(conditions,1)]
+        # Make the changes to the database persistent
+        con.commit()
+    # Batches not yet achieved
+    cursor.execute("SELECT batch, condition FROM results.%s WHERE NOT done ORDER BY batch;"%checkpoint_table)
+    batches = cursor.fetchall()
+    cursor.execute("SELECT count(*) FROM results.%s;"%checkpoint_table)
+    nbatches = cursor.fetchone()[0]
+    for batch, condition in batches:
+        # Insert the batch and record it in the checkpoint table in the same transaction
+        query = "INSERT INTO results.{table_name} ({mainquery} WHERE {condition});"
+        query = query.format(table_name=table_name, mainquery=mainquery, condition=condition)
+        if batch == batches[0][0]:
+            print(query + "\n")
+        cursor.execute(query)
+        cursor.execute("UPDATE results.%s SET done = TRUE, done_at = now() WHERE batch = %%s;"%checkpoint_table, (batch,))
+        con.commit()
+        print(print_processing_time(begintime, "Batch %s/%s achieved in "%(batch, nbatches)))
+    # Remove the checkpoint table
+    query = "DROP TABLE results.{checkpoint};".format(checkpoint=checkpoint_table)
+    cursor.execute(query)
+    print(query + "\n")
+    # Make the changes to the database persistent
+    con.commit()
+    # Close connection with database
+    cursor.close()
+    ## Print processing time
+    print(print_processing_time(begintime, "Creation of final table achieved in "))
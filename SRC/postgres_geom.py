@@ -30,8 +30,9 @@ import sys
 import psycopg2
 import time
 from processing_time import print_processing_time
+from postgres_parallel import get_key_ranges, create_table_by_partitions, update_table
 
-def make_valid(con, schema, table, geomcolumn, geometry_type=3, quiet=False):
+def make_valid(con, schema, table, geomcolumn, geometry_type=3, quiet=False, parallel=False, **kwargs):
     """Function to update invalid geometries in a PostgreSQL/GIS table in order to make them valid using ST_Makevalid() function.
     Idealy, this function should be executed after each importation of raw data in the PostgreSQL/GIS database.
 
@@ -42,6 +43,8 @@ def make_valid(con, schema, table, geomcolumn, geometry_type=3, quiet=False):
         geomcolumn (str): Name of the geometry column.
         geometry_type (str): Type of the geometry. 1 for POINT, 2 for LINESTRING, 3 for POLYGON. Default value is 3.
         quiet (bool): Either the function should print (False) output or not (True). Default value is False.
+        parallel (bool): If True, the update is executed in parallel on ranges of the table (see function 'parallel_update'). Default value is False.
+        **kwargs: Options of the parallel update ('connexion_param_dict', 'njobs', 'npartitions', 'key_column', 'retries'), see function 'update_table'.
 
     Returns:
         This function has no return value. 
@@ -49,6 +52,12 @@ def make_valid(con, schema, table, geomcolumn, geometry_type=3, quiet=False):
     try:
         ## Saving current time for processing time management
         begintime_copy = time.time()
+        if parallel:
+            update_table(con, schema, table, "{geom} = St_Multi(St_Collectionextract(St_Makevalid({geom}),3))".format(geom=geomcolumn), 
+                         "ST_isvalid({geom}) is False".format(geom=geomcolumn), parallel=True, **kwargs)
+            if not quiet:
+                print(print_processing_time(begintime_copy, "Process achieved in "))
+            return
         # Create cursor
         cursor = con.cursor()
         # Update geom with ST_Makevalid function query
@@ -113,3 +122,247 @@ def split_multipolygon_to_singlepolygon(con, schema, table, idcolumn, geomcolumn
 
     except (Exception, psycopg2.DatabaseError) as error:
         sys.exit(error)
+
+
+def table_fingerprint(con, schema, table, columns=None, method='xmin'):
+    """Function to compute a fingerprint of the content of a table, used to know if a table derived from it should be rebuilt.
+    Two methods are available:
+        'xmin': the fingerprint is made of the file node of the table, the number of rows and the highest transaction id (xmin) of the rows, which 
+        change when rows are inserted, updated or deleted and when the table is rewritten. It only reads the headers of the rows (one sequential 
+        scan, without reading nor hashing the geometries) but it changes when the table is restored or copied, even with the same content.
+        'md5': the fingerprint is made of the number of rows and the sum of the hash (md5) of each row (or of the 'columns'), so that it does not 
+        depend on the physical order of the rows nor on the transactions. Each row is converted to text and hashed, geometry included, which 
+        costs as much as reading the whole table with its geometries: it should be restricted to the needed columns.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion".
+        schema (str): Name of the schema where the table is stored.
+        table (str): Name of the table.
+        columns (list of str): With the method 'md5', list of the columns to be used, e.g. only the id and the geometry. Default value is None and all columns are used.
+        method (str): Either 'xmin' or 'md5'. Default value is 'xmin'.
+
+    Returns:
+        str: The fingerprint of the table.
+    """
+    # Create cursor
+    cursor = con.cursor()
+    if method == 'xmin':
+        query = "SELECT pg_relation_filenode('%s.%s'), count(*), COALESCE(max(t.xmin::text::bigint),0) FROM %s.%s AS t;"%(schema,table,schema,table)
+        cursor.execute(query)
+        filenode, count, xmin = cursor.fetchone()
+        cursor.close()
+        return "%s:%s:%s"%(filenode,count,xmin)
+    row = "ROW(%s)"%", ".join(["t.%s"%x for x in columns]) if columns else "t"
+    query = "SELECT count(*), COALESCE(sum(('x'||substr(md5(%s::text),1,15))::bit(60)::bigint::numeric),0) FROM %s.%s AS t;"%(row,schema,table)
+    cursor.execute(query)
+    count, hash_sum = cursor.fetchone()
+    cursor.close()
+    return "%s:%s"%(count,hash_sum)
+
+
+def prepare_overlay(con, schema, table, geomcolumn='geom', class_columns=None, max_vertices=256, overwrite=False):
+    """Function to create a prepared version of an overlay layer, to be used by the functions computing statistics by cadastral parcel (e.g. 'prop_coverage').
+    The geometries are dissolved for each distinct value of the 'class_columns', so that overlapping polygons of the same class are not counted twice, 
+    and then subdivided with ST_Subdivide in polygons of at most 'max_vertices' vertices, which bounds the cost of each intersection. This replaces the
+    use of the function 'split_multipolygon_to_singlepolygon' for multipolygon layers.
+    The result is stored in a table '<table>_prepared' with a GiST index. The table is cached: a fingerprint of the source table and the parameters used are 
+    stored in the comment of the prepared table, and the table is rebuilt only if the source table or the parameters changed.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion".
+        schema (str): Name of the schema where the overlay table is stored. The prepared table is created in the same schema.
+        table (str): Name of the overlay table.
+        geomcolumn (str): Name of the geometry column. Default value is 'geom'. The geometry column of the prepared table is always named 'geom'.
+        class_columns (list of str): Name of the columns for which the geometries should be dissolved separately, e.g. the 'class_column' of 'prop_coverage'.
+        Default value is None and all geometries are dissolved together.
+        max_vertices (int): Maximum number of vertices of the subdivided polygons. Default value is 256.
+        overwrite (bool): Either the prepared table should be rebuilt even if it is up to date. Default value is False.
+
+    Returns:
+        str: The name of the prepared table.
+    """
+    try:
+        ## Saving current time for processing time management
+        begintime_copy=time.time()
+        prepared_table = '%s_prepared'%table
+        if not class_columns:
+            class_columns = []
+        # Description of the source and parameters stored as comment of the prepared table
+        description = "Prepared from {schema}.{table} by ({cols}) with max_vertices={vertices}, fingerprint={fingerprint}"
+        description = description.format(schema=schema, table=table, cols=','.join(class_columns), vertices=int(max_vertices),
+                                         fingerprint=table_fingerprint(con, schema, table))
+        # Create cursor
+        cursor = con.cursor()
+        # Check if the prepared table is up to date
+        cursor.execute("SELECT obj_description(to_regclass('%s.%s'), 'pg_class');"%(schema,prepared_table))
+        if cursor.fetchone()[0] == description and not overwrite:
+            print("Table '%s.%s' is up to date\n"%(schema,prepared_table))
+            cursor.close()
+            return prepared_table
+        # Dissolve by class and subdivide
+        select_columns = "".join(["%s, "%x for x in class_columns])
+        query="DROP TABLE IF EXISTS {schema}.{prepared};"
+        query+="CREATE TABLE {schema}.{prepared} AS (SELECT row_number() OVER () AS gid, {cols}geom FROM "
+        query+="(SELECT {cols}ST_Subdivide(ST_Union({geom}), {vertices}) AS geom FROM {schema}.{table} {groupby}) AS a);"
+        query+="CREATE INDEX {prepared}_geom_idx ON {schema}.{prepared} USING gist (geom);"
+        query+="COMMENT ON TABLE {schema}.{prepared} IS %s;"
+        query+="ANALYZE {schema}.{prepared};"
+        query = query.format(schema=schema, table=table, prepared=prepared_table, cols=select_columns, geom=geomcolumn,
+                             vertices=int(max_vertices), groupby="GROUP BY %s"%','.join(class_columns) if class_columns else "")
+        # Print the query
+        print(query)
+        # Execute the CREATE TABLE query
+        cursor.execute(query, (description,))
+        # Make the changes to the database persistent
+        con.commit()
+        # Close connection with database
+        cursor.close()
+        ## Compute processing time and print it
+        print(print_processing_time(begintime_copy, "Process achieved in "))
+        return prepared_table
+
+    except (Exception, psycopg2.DatabaseError) as error:
+        sys.exit(error)
+
+
+def build_pair_cache(con, basemap_schema, basemap_name, basemap_id, overlay_schema, overlay_table, overlay_id='gid', with_area=False, overwrite=False, **kwargs):
+    """Function to create a persistent table with the candidate pairs of a reference units layer (e.g. cadastral parcels) and an overlay layer, 
+    i.e. the ids of each pair of geometries intersecting each other, and optionally the area of their intersection. The functions computing statistics 
+    by cadastral parcel (e.g. 'prop_coverage', 'count_points') can use this table instead of computing the spatial join again at each run.
+    The table '<basemap_name>_pairs_<overlay_table>' is created in the schema of the overlay with the columns 'base_id', 'overlay_id' and 'area' (if 'with_area').
+    The table is cached: a fingerprint of both source tables is stored in the comment of the table, and the table is rebuilt only if one of the source 
+    tables changed (or if the area is needed and was not computed).
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion".
+        basemap_schema (str): Name of the schema where the table with reference units is located.
+        basemap_name (str): Name of the table with reference units.
+        basemap_id (str): Name of column with unique id in the table with reference units.
+        overlay_schema (str): Name of the schema where the overlay table is stored. The pair table is created in the same schema.
+        overlay_table (str): Name of the overlay table.
+        overlay_id (str): Name of column with unique id in the overlay table. Default value is 'gid'.
+        with_area (bool): Either the area of the intersection of each pair should be computed. Default value is False.
+        overwrite (bool): Either the pair table should be rebuilt even if it is up to date. Default value is False.
+        **kwargs: 
+            'njobs' (int): Number of parallel jobs used to build the table (see function 'create_table_by_partitions'). 'connexion_param_dict' should be provided too.
+            'connexion_param_dict' (dict): A dictionnary containing informations for connection to the database, used by each parallel job (see function "create_pg_connexion").
+
+    Returns:
+        str: The name of the pair table.
+    """
+    try:
+        ## Saving current time for processing time management
+        begintime = time.time()
+        pair_table = '%s_pairs_%s'%(basemap_name,overlay_table)
+        # Description of the sources stored as comment of the pair table
+        description = "Pairs of {b_schema}.{b_name} ({id_}, fingerprint={b_fingerprint}) and {o_schema}.{o_name} ({o_id}, fingerprint={o_fingerprint}) with_area={area}"
+        description = description.format(b_schema=basemap_schema, b_name=basemap_name, id_=basemap_id, b_fingerprint=table_fingerprint(con, basemap_schema, basemap_name),
+                                         o_schema=overlay_schema, o_name=overlay_table, o_id=overlay_id, o_fingerprint=table_fingerprint(con, overlay_schema, overlay_table), 
+                                         area='%s')
+        # Create cursor
+        cursor = con.cursor()
+        # Check if the pair table is up to date (a table with the area can be used when the area is not needed)
+        cursor.execute("SELECT obj_description(to_regclass('%s.%s'), 'pg_class');"%(overlay_schema,pair_table))
+        current = cursor.fetchone()[0]
+        if not overwrite and current in (description%True, description%with_area):
+            print("Table '%s.%s' is up to date\n"%(overlay_schema,pair_table))
+            cursor.close()
+            return pair_table
+        # Spatial join
+        subquery = "SELECT base.{id_} AS base_id, overlay.{o_id} AS overlay_id{area} FROM {b_schema}.{b_name} AS base "
+        subquery += "JOIN {o_schema}.{o_name} AS overlay ON st_intersects(base.geom,overlay.geom) {{where}}"
+        subquery = subquery.format(id_=basemap_id, o_id=overlay_id, b_schema=basemap_schema, b_name=basemap_name, o_schema=overlay_schema, o_name=overlay_table,
+                                   area=", st_area(st_Intersection(base.geom,overlay.geom)) AS area" if with_area else "")
+        njobs = int(kwargs.get('njobs', 1))
+        if njobs > 1:
+            conditions = get_key_ranges(con, basemap_schema, basemap_name, basemap_id, njobs, column_expression='base.%s'%basemap_id)
+        else:
+            conditions = ["TRUE"]
+        create_table_by_partitions(con, kwargs.get('connexion_param_dict'), overlay_schema, pair_table, subquery, conditions, njobs)
+        # Indexes and description
+        query = "CREATE INDEX {pairs}_base_idx ON {schema}.{pairs} (base_id);"
+        query += "CREATE INDEX {pairs}_overlay_idx ON {schema}.{pairs} (overlay_id);"
+        query += "COMMENT ON TABLE {schema}.{pairs} IS %s;"
+        query += "ANALYZE {schema}.{pairs};"
+        query = query.format(schema=overlay_schema, pairs=pair_table)
+        print(query + "\n")
+        cursor.execute(query, (description%with_area,))
+        # Make the changes to the database persistent
+        con.commit()
+        # Close connection with database
+        cursor.close()
+        ## Compute processing time and print it
+        print(print_processing_time(begintime, "Creation of pair table achieved in "))
+        return pair_table
+    except (Exception, psycopg2.DatabaseError) as error:
+        sys.exit(error)
+
+
+def build_adjacency(con, schema, table, id_column='capakey', geomcolumn='geom', overwrite=False, **kwargs):
+    """Function to create a persistent table with the adjacency graph of the polygons of a table (e.g. cadastral parcels), i.e. the ids of each 
+    pair of polygons touching each other (ST_Touches) and the length of their shared boundary (0 if they only share points). Each pair is stored 
+    in both directions so that the neighbours of a polygon are found with an equality join on 'base_id'.
+    The table '<table>_adjacency' is created in the same schema with the columns 'base_id', 'neighbour_id' and 'shared_length'. 
+    The table is cached: a fingerprint of the ids and geometries of the source table is stored in the comment of the table, and the table 
+    is rebuilt only if they changed (the other columns, e.g. the classification results, can change).
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion".
+        schema (str): Name of the schema where the table is stored. The adjacency table is created in the same schema.
+        table (str): Name of the table with the polygons.
+        id_column (str): Name of column with unique id. Default value is 'capakey'.
+        geomcolumn (str): Name of the geometry column. Default value is 'geom'.
+        overwrite (bool): Either the adjacency table should be rebuilt even if it is up to date. Default value is False.
+        **kwargs: 
+            'njobs' (int): Number of parallel jobs used to build the table, each on a range of ids (see function 'create_table_by_partitions'). 'connexion_param_dict' should be provided too.
+            'npartitions' (int): Number of ranges of ids. Default value is 'njobs'.
+            'connexion_param_dict' (dict): A dictionnary containing informations for connection to the database, used by each parallel job (see function "create_pg_connexion").
+
+    Returns:
+        str: The name of the adjacency table.
+    """
+    try:
+        ## Saving current time for processing time management
+        begintime = time.time()
+        adjacency_table = '%s_adjacency'%table
+        # Description of the source stored as comment of the adjacency table
+        description = "Adjacency of {schema}.{table} ({id_}, {geom}, fingerprint={fingerprint})"
+        description = description.format(schema=schema, table=table, id_=id_column, geom=geomcolumn, 
+                                         fingerprint=table_fingerprint(con, schema, table, columns=[id_column, geomcolumn], method='md5'))
+        # Create cursor
+        cursor = con.cursor()
+        # Check if the adjacency table is up to date
+        cursor.execute("SELECT obj_description(to_regclass('%s.%s'), 'pg_class');"%(schema,adjacency_table))
+        if not overwrite and cursor.fetchone()[0] == description:
+            print("Table '%s.%s' is up to date\n"%(schema,adjacency_table))
+            cursor.close()
+            return adjacency_table
+        # Each pair is computed once (a.id < b.id) and written in both directions
+        subquery = "SELECT base_id, neighbour_id, shared_length FROM (SELECT a.{id_} AS a_id, b.{id_} AS b_id, "
+        subquery += "ST_Length(ST_Intersection(a.{geom}, b.{geom})) AS shared_length FROM {schema}.{table} AS a "
+        subquery += "JOIN {schema}.{table} AS b ON a.{id_} < b.{id_} AND ST_Touches(a.{geom}, b.{geom}) {{where}}) AS pairs, "
+        subquery += "LATERAL (VALUES (a_id, b_id), (b_id, a_id)) AS edge(base_id, neighbour_id)"
+        subquery = subquery.format(id_=id_column, geom=geomcolumn, schema=schema, table=table)
+        njobs = int(kwargs.get('njobs', 1))
+        if njobs > 1:
+            conditions = get_key_ranges(con, schema, table, id_column, kwargs.get('npartitions', njobs), column_expression='a.%s'%id_column)
+        else:
+            conditions = ["TRUE"]
+        create_table_by_partitions(con, kwargs.get('connexion_param_dict'), schema, adjacency_table, subquery, conditions, njobs)
+        # Indexes and description
+        query = "ALTER TABLE {schema}.{adjacency} ADD PRIMARY KEY (base_id, neighbour_id);"
+        query += "CREATE INDEX {adjacency}_neighbour_idx ON {schema}.{adjacency} (neighbour_id);"
+        query += "COMMENT ON TABLE {schema}.{adjacency} IS %s;"
+        query += "ANALYZE {schema}.{adjacency};"
+        query = query.format(schema=schema, adjacency=adjacency_table)
+        print(query + "\n")
+        cursor.execute(query, (description,))
+        # Make the changes to the database persistent
+        con.commit()
+        # Close connection with database
+        cursor.close()
+        ## Compute processing time and print it
+        print(print_processing_time(begintime, "Creation of adjacency table achieved in "))
+        return adjacency_table
+    except (Exception, psycopg2.DatabaseError) as error:
+        sys.exit(error)
@@ -27,13 +27,11 @@ see <http://www.gnu.org/licenses/>.
 
 import os
 import sys
-from io import StringIO
+import codecs
 import subprocess
 import psycopg2
-import tempfile
 import time
 from processing_time import print_processing_time
-import platform
 
 def shp2pgsql(data_tuple, schema, connection_dict, from_srid='31370', to_srid='31370', create_opt='-d', 
               psql_stdout=None, quiet=True):
@@ -153,9 +151,60 @@ def ogr2ogr_import(path_to_file, connection_dict, schema=None, table=None, to_sr
     except:
         sys.exit("ERROR: The exportation failed. Please check.")
 
-def import_csv(con, csv, column_definition, schema, table, delimiter=";", null="", add_serial_primary_key=False, overwrite=False):
+def detect_encoding(csv, blocksize=65536):
+    '''Function to guess the encoding of a text file from its first block only: a file starting with a byte order mark is 'utf-8-sig', 
+    a first block which can be decoded as UTF-8 is 'utf-8' and any other file is considered as 'iso-8859-1'.
+    
+    Args:
+        csv (str): The path to the file.
+        blocksize (int): Number of bytes read at the beginning of the file. Default value is 65536.
+    
+    Returns:
+        str: The name of the encoding.
+    '''
+    with open(csv, 'rb') as f:
+        block = f.read(blocksize)
+    if block.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        # The block can end in the middle of a multi-byte character
+        codecs.getincrementaldecoder('utf-8')().decode(block, final=len(block) < blocksize)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'iso-8859-1'
+
+
+class CsvCopyReader(object):
+    '''File-like object used to stream a text file into the COPY command: the carriage returns are removed from each block read, so that 
+    the end of lines are only newline returns (\\n) and a stray carriage return inside a field does not break the row. The errors of decoding 
+    of the file are kept to be reported (COPY only reports that the read failed).
+    
+    Args:
+        f (file object): The file, opened in text mode with newline=''.
+    '''
+    def __init__(self, f):
+        self.f = f
+        self.error = None
+        
+    def read(self, size=-1):
+        try:
+            block = self.f.read(size)
+            # A block made only of carriage returns should not be taken as the end of the file
+            while block and block.replace('\r', '') == '':
+                block = self.f.read(size)
+        except UnicodeDecodeError as error:
+            self.error = error
+            raise
+        return block.replace('\r', '')
+
+
+def import_csv(con, csv, column_definition, schema, table, delimiter=";", null="", add_serial_primary_key=False, overwrite=False, 
+               encoding=None, buffer_size=65536):
     '''Function that import a CSV file into PostgreSQL.
-    The tricks found here https://stackoverflow.com/a/50034387.
+    The file is streamed into the COPY command through a buffer of fixed size, whatever the size of the file: it is decoded 
+    on the fly, the carriage returns are removed (see 'CsvCopyReader') and the serial primary key, if any, is filled by PostgreSQL.
+    If a later block of the file can not be decoded with the encoding guessed from the first block, the import is stopped with an 
+    error asking for the 'encoding' argument.
     
     Args:
         con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
@@ -168,14 +217,14 @@ def import_csv(con, csv, column_definition, schema, table, delimiter=";", null="
         add_serial_primary_key (bool): Either to add (True) a serial primary key to the table during importation or not (False). Default value is False.
         If set to False and duplicates exists on the first column
         overwrite (bool): Either an existing table with the same name should be overwritten (True) or not (False). Default value is False.
+        encoding (str): The encoding of the csv file. Default value is None and the encoding is guessed from the first block of the file (see function 'detect_encoding').
+        buffer_size (int): Size of the buffer used to send the file to PostgreSQL. Default value is 65536.
     
     Returns:
         This function has no return value. 
 
     To do:
-        - Use the PostgreSQL command 'ALTER TABLE xxxxx ADD COLUMN ID SERIAL PRIMARY KEY;' for adding auto-incremental primary key.
         - Add check if table already exists and sys.exit() in case if overwrite parameter is set to False.
-        - Potential improvement: auto check for encoding compatibility with posgresql standards https://docs.postgresql.fr/8.3/multibyte.html.
 
     Example: 
         import_csv(con=create_PG_connexion(config_parameters), csv='path/to/csv/file.csv', 
@@ -186,27 +235,12 @@ def import_csv(con, csv, column_definition, schema, table, delimiter=";", null="
         ## Saving current time for processing time management
         begintime_copy=time.time()
         
-        ## Determine automatically the encoding of the file - ONLY FOR LINUX
-        if platform.uname()[0] == 'Linux': 
-            cmd = ['file', '-b', '--mime-encoding', csv]
-            p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='utf8')
-            stdout, stderr=p.communicate()
-            csv_encoding = stdout.split("\n")[0]
-
-            # If decoding and encoding to UTF-8 is needed
-            if csv_encoding.lower() != 'utf-8':
-                print('The csv file is encoded in %s. A utf-8 copy will be used for copy in Postgresql.'%csv_encoding.lower())
-                # Create a new file that is coded as UTF8 since the original .csv is coded as 'iso-8859-1' which is not 
-                # compatible with PostgreSQL
-                path,ext = os.path.splitext(csv)
-                csv_tmp = os.path.join(tempfile.gettempdir(),'%s_utf8%s'%(os.path.split(path)[-1],ext))
-                fin = open(csv_tmp, 'w')
-                with open(csv, 'r', encoding=csv_encoding) as f:
-                    for row in f:
-                        # Write row decode from user specified encoding and encoded to 'utf8'
-                        fin.write(row)
-                fin.close()
-                csv = csv_tmp      
+        ## Determine automatically the encoding of the file
+        guessed = not encoding
+        if guessed:
+            encoding = detect_encoding(csv)
+        if encoding.lower() not in ('utf-8', 'utf8'):
+            print('The csv file is encoded in %s. It will be converted to utf-8 during the copy in Postgresql.'%encoding.lower())
         
         ##
         ## TODO: add management of overwrite option
@@ -215,8 +249,9 @@ def import_csv(con, csv, column_definition, schema, table, delimiter=";", null="
         # Print
         print("Creating new table copy csv file in the postgresql table")
         # Add serial primary key if needed
+        columns = [column_name for column_name, column_type in column_definition]
         if add_serial_primary_key:
-            column_definition.insert(0,('id', 'serial primary key'))
+            column_definition = [('id', 'serial primary key')] + list(column_definition)
         # Create cursor
         cursor = con.cursor()
         # Create table query
@@ -234,23 +269,28 @@ def import_csv(con, csv, column_definition, schema, table, delimiter=";", null="
         
         # Print
         print("Start copy csv file in the postgresql table")  
-        # Psycopg2 COPY FROM function 
-        with open(csv, 'r') as f:
-            next(f)  # Skip the header row.
-            #Clean the content of the file - Ensure there is only one newline return (\n) and no carriage return (\r) 
-            content = [line.split("\n")[0].replace("\r","") for line in f]
-            if add_serial_primary_key:
-                content = ['%s,%s'%(i,x) for i,x in enumerate(content,1)]
-            content = StringIO('\n'.join(content)) 
-            cursor.copy_from(content, '%s.%s'%(schema,table), sep=delimiter, null=null)
+        # Psycopg2 COPY FROM function, reading the decoded file by blocks. The lines are only split on newline returns (\n) and 
+        # the carriage returns (\r) are removed by the reader. The serial primary key is not in the copied columns.
+        query = "COPY %s.%s (%s) FROM STDIN WITH (FORMAT text, DELIMITER %%s, NULL %%s)"%(schema,table,", ".join(columns))
+        query = cursor.mogrify(query, (delimiter, null)).decode()
+        print(query + "\n")
+        with open(csv, 'r', encoding=encoding, newline='') as f:
+            # Skip the header row
+            while f.read(1) not in ('\n', ''):
+                pass
+            reader = CsvCopyReader(f)
+            try:
+                cursor.copy_expert(query, reader, size=buffer_size)
+            except (Exception, psycopg2.Error) as error:
+                if reader.error is None:
+                    raise
+                con.rollback()
+                sys.exit("ERROR: the file '%s' can not be decoded as %s (%s).%s"%(csv, encoding, reader.error, "" if not guessed else 
+                         " The encoding is guessed from the first block of the file only, please provide the 'encoding' argument (e.g. 'iso-8859-1')."))
         # Make the changes to the database persistent
         con.commit()    
         # Close connection with database
         cursor.close()
-        # Remove temporary file if needed (if linux)
-        if platform.uname()[0] == 'Linux': 
-            if csv_encoding.lower() != 'utf-8':
-                os.remove(csv)
         ## Compute processing time and print it
         print(print_processing_time(begintime_copy, "\n\nProcess achieved in "))
         
@@ -0,0 +1,605 @@
+#!/usr/bin/env python
+"""
+WALOUS_UTS - Copyright (C) <2020> <Service Public de Wallonie (SWP), Belgique,
+					          		Institut Scientifique de Service Public (ISSeP), Belgique,
+									Université catholique de Louvain (UCLouvain), Belgique,
+									Université Libre de Bruxelles (ULB), Belgique>
+						 							
+	
+List of the contributors to the development of WALOUS_UTS: see LICENSE file.
+Description and complete License: see LICENSE file.
+	
+This program (WALOUS_UTS) is free software:
+you can redistribute it and/or modify it under the terms of the
+GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option)
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program (see COPYING file).  If not,
+see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+import sys
+import time
+import hashlib
+import multiprocessing
+import psycopg2
+from processing_time import print_processing_time
+
+
+def get_key_ranges(con, schema_name, table_name, key_column, nparts, column_expression=None):
+    """Function to split a table into contiguous ranges of values of a key column, e.g. the 'capakey' of the cadastral parcels.
+    The ranges are computed with the window function 'ntile' so that each range contains approximately the same number of rows.
+    The ranges are returned as SQL conditions which can be added to the WHERE clause of a query. Every row of the table,
+    including those with a NULL key, matches exactly one of the conditions.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        schema_name (str): Name of the schema where the table is located.
+        table_name (str): Name of the table to be splitted.
+        key_column (str): Name of the column used to define the ranges.
+        nparts (int): Number of ranges to be created. Less ranges could be returned if the key column has not enough distinct values.
+        column_expression (str): Expression used for the key column in the conditions returned, e.g. 'base.capakey' if the table is aliased in the query.
+        Default value is None and the name of the key column is used.
+
+    Returns:
+        list of str: List of SQL conditions, one for each range.
+    """
+    if not column_expression:
+        column_expression = key_column
+    # Create cursor
+    cursor = con.cursor()
+    # Get the upper bound of each range
+    query = "SELECT max(k) FROM (SELECT {key} AS k, ntile({n}) OVER (ORDER BY {key}) AS part "
+    query += "FROM {schema}.{table} WHERE {key} IS NOT NULL) AS a GROUP BY part ORDER BY part;"
+    query = query.format(key=key_column, n=max(int(nparts),1), schema=schema_name, table=table_name)
+    print(query + "\n")
+    cursor.execute(query)
+    bounds = []
+    [bounds.append(x[0]) for x in cursor.fetchall()[:-1] if x[0] not in bounds]
+    # Quote the bounds as SQL literals
+    bounds = [cursor.mogrify("%s", (x,)).decode() for x in bounds]
+    cursor.close()
+    # Build the conditions
+    if not bounds:
+        return ["TRUE"]
+    conditions = ["{col} <= {upper}".format(col=column_expression, upper=bounds[0])]
+    for lower, upper in zip(bounds[:-1], bounds[1:]):
+        conditions.append("({col} > {lower} AND {col} <= {upper})".format(col=column_expression, lower=lower, upper=upper))
+    conditions.append("({col} > {lower} OR {col} IS NULL)".format(col=column_expression, lower=bounds[-1]))
+    return conditions
+
+
+def run_query(args):
+    """Function executed by the workers of 'execute_parallel_queries'. It opens its own connexion to the database,
+    executes the query and commits the changes.
+    The connexion is created using psycopg2.connect() directly instead of the custom function "create_PG_connexion"
+    because a worker should raise errors to the main process instead of exiting.
+
+    Args:
+        args (tuple): Tuple containing the index of the query (int), the dictionnary with connexion parameters (dict) and the query (str).
+
+    Returns:
+        tuple: The index of the query and the time spent (in seconds) to execute it.
+    """
+    index, connexion_param_dict, query = args
+    begintime = time.time()
+    con = psycopg2.connect(dbname=connexion_param_dict['pg_dbname'], user=connexion_param_dict['pg_user'], password=connexion_param_dict['pg_password'], host=connexion_param_dict['pg_host'])
+    try:
+        cursor = con.cursor()
+        cursor.execute(query)
+        con.commit()
+        cursor.close()
+    finally:
+        con.close()
+    return index, time.time() - begintime
+
+
+def execute_parallel_queries(connexion_param_dict, list_of_queries, njobs):
+    """Function to execute a list of independent queries concurrently, each query on its own connexion to the database.
+    The queries are distributed on a pool of 'njobs' processes and each one is committed as soon as it is achieved.
+
+    Args:
+        connexion_param_dict (dict): A dictionnary containing informations for connection to the database. The dictionnary should have the following elements:
+        'pg_host' with the server host, 'pg_port' with the server connexion port, 'pg_user' with the name of the user, 'pg_password' with the password of user, 'pg_dbname' with the name of the database.
+        list_of_queries (list of str): List of the queries to be executed. The queries should not depend on each other.
+        njobs (int): Number of queries to be executed at the same time.
+
+    Returns:
+        This function has no return value.
+    """
+    ## Saving current time for processing time management
+    begintime = time.time()
+    args = [(i, connexion_param_dict, query) for i, query in enumerate(list_of_queries, 1)]
+    pool = multiprocessing.Pool(processes=max(1, min(int(njobs), len(args))))
+    try:
+        for i, elapsed in pool.imap_unordered(run_query, args):
+            print("Partition %s/%s achieved in %s seconds"%(i, len(args), round(elapsed, 1)))
+    finally:
+        pool.close()
+        pool.join()
+    print(print_processing_time(begintime, "Execution of %s queries with %s jobs achieved in "%(len(args), njobs)))
+
+
+def create_table_by_partitions(con, connexion_param_dict, schema_name, table_name, subquery, conditions, njobs):
+    """Function to create a table from a query executed separately for each partition of the data, e.g. ranges of cadastral parcels 
+    returned by the function 'get_key_ranges'. Each partition is written in a partial table by a parallel job and the partial tables are 
+    then merged in the final table. The table is replaced if it already exists.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        connexion_param_dict (dict): A dictionnary containing informations for connection to the database, used by each parallel job (see function "create_pg_connexion").
+        schema_name (str): Name of the schema where the table should be created.
+        table_name (str): Name of the table to be created.
+        subquery (str): The SELECT query to be used. It should contain a '{where}' placeholder which is replaced by the condition of each partition.
+        conditions (list of str): List of SQL conditions defining the partitions. If it contains only one condition, the query is executed directly on 'con'.
+        njobs (int): Number of partitions to be processed at the same time.
+
+    Returns:
+        This function has no return value.
+    """
+    # Create cursor
+    cursor = con.cursor()
+    query = "DROP TABLE IF EXISTS {schema}.{table};".format(schema=schema_name, table=table_name)
+    print(query + "\n")
+    cursor.execute(query)
+    if len(conditions) == 1:
+        query = "CREATE TABLE {schema}.{table} AS ({subquery});"
+        query = query.format(schema=schema_name, table=table_name, subquery=subquery.format(where="WHERE %s "%conditions[0]))
+        print(query + "\n")
+        cursor.execute(query)
+    else:
+        # Compute each partition in a partial table on its own connexion
+        partial_tables = ['%s_part%s'%(table_name,i) for i,x in enumerate(conditions,1)]
+        list_of_queries = []
+        for partial_table, condition in zip(partial_tables, conditions):
+            query = "DROP TABLE IF EXISTS {schema}.{table}; CREATE TABLE {schema}.{table} AS ({subquery});"
+            query = query.format(schema=schema_name, table=partial_table, subquery=subquery.format(where="WHERE %s "%condition))
+            list_of_queries.append(query)
+        print(list_of_queries[0] + "\n")
+        execute_parallel_queries(connexion_param_dict, list_of_queries, njobs)
+        # Merge partial tables
+        query = "CREATE TABLE {schema}.{table} AS ({subquery});"
+        query = query.format(schema=schema_name, table=table_name, 
+                             subquery=" UNION ALL ".join(["SELECT * FROM %s.%s"%(schema_name,x) for x in partial_tables]))
+        print(query + "\n")
+        cursor.execute(query)
+        query = "DROP TABLE {tables};".format(tables=", ".join(["%s.%s"%(schema_name,x) for x in partial_tables]))
+        print(query + "\n")
+        cursor.execute(query)
+    # Make the changes to the database persistent
+    con.commit()
+    cursor.close()
+
+
+## Connexion to the database of the current worker process (see function 'init_update_worker')
+worker_state = {}
+
+
+def get_block_ranges(con, schema_name, table_name, nparts):
+    """Function to split a table into ranges of physical blocks, used when the table has no suitable key column. The ranges are returned 
+    as SQL conditions on the 'ctid' system column. The last range has no upper bound so that it includes the rows written after the split.
+    The conditions are only efficient from PostgreSQL 14 (TID range scans): with an older server, each condition reads the whole table.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        schema_name (str): Name of the schema where the table is located.
+        table_name (str): Name of the table to be splitted.
+        nparts (int): Number of ranges to be created. Less ranges could be returned if the table has not enough blocks.
+
+    Returns:
+        list of str: List of SQL conditions, one for each range.
+    """
+    cursor = con.cursor()
+    query = "SELECT (pg_relation_size('{schema}.{table}') / current_setting('block_size')::integer)::integer;"
+    cursor.execute(query.format(schema=schema_name, table=table_name))
+    nblocks = cursor.fetchone()[0]
+    cursor.close()
+    nparts = max(1, min(int(nparts), nblocks))
+    if nparts == 1:
+        return ["TRUE"]
+    bounds = sorted(set([int(nblocks * i / nparts) for i in range(1, nparts)]))
+    conditions = ["ctid < '(%s,0)'::tid"%bounds[0]]
+    for lower, upper in zip(bounds[:-1], bounds[1:]):
+        conditions.append("(ctid >= '(%s,0)'::tid AND ctid < '(%s,0)'::tid)"%(lower, upper))
+    conditions.append("ctid >= '(%s,0)'::tid"%bounds[-1])
+    return conditions
+
+
+def init_update_worker(connexion_param_dict):
+    """Function to initialize a worker process of 'parallel_update': a connexion to the database is opened once by process.
+
+    Args:
+        connexion_param_dict (dict): A dictionnary containing informations for connection to the database (see function "create_pg_connexion").
+
+    Returns:
+        This function has no return value.
+    """
+    worker_state['connexion_param_dict'] = connexion_param_dict
+    worker_state['con'] = None
+
+
+def run_update_chunk(args):
+    """Function executed by the workers of 'parallel_update'. It executes the UPDATE query of a chunk on the connexion of the process and 
+    commits it. If the query fails (e.g. deadlock or lost connexion), the transaction is rolled back and the query is retried.
+
+    Args:
+        args (tuple): Tuple containing the index of the chunk (int), the query (str) and the number of retries (int).
+
+    Returns:
+        tuple: The index of the chunk, the time spent (in seconds), the number of rows updated and the error message (None if the chunk succeeded).
+    """
+    index, query, retries = args
+    begintime = time.time()
+    error = None
+    for attempt in range(int(retries) + 1):
+        try:
+            if worker_state['con'] is None or worker_state['con'].closed:
+                param = worker_state['connexion_param_dict']
+                worker_state['con'] = psycopg2.connect(dbname=param['pg_dbname'], user=param['pg_user'], password=param['pg_password'], host=param['pg_host'])
+            con = worker_state['con']
+            cursor = con.cursor()
+            cursor.execute(query)
+            rowcount = cursor.rowcount
+            con.commit()
+            cursor.close()
+            return index, time.time() - begintime, rowcount, None
+        except psycopg2.Error as e:
+            error = str(e).strip()
+            try:
+                worker_state['con'].rollback()
+            except Exception:
+                worker_state['con'] = None
+            time.sleep(min(2 ** attempt, 30))
+    return index, time.time() - begintime, 0, error
+
+
+def parallel_update(con, connexion_param_dict, schema_name, table_name, set_clause, where_clause=None, key_column='capakey', nparts=None, njobs=6, retries=2):
+    """Function to execute an UPDATE on a whole table in parallel. The table is splitted in ranges of a key column (see function 'get_key_ranges') 
+    or, if no key column is provided, in ranges of physical blocks (see function 'get_block_ranges'), which requires PostgreSQL 14 or later 
+    (before PostgreSQL 14, each range of blocks would read the whole table). The UPDATE of each range is executed 
+    and committed on its own connexion by a pool of 'njobs' processes. The chunks which fail are retried 'retries' times, and an error is 
+    raised at the end if some chunks still failed (the other chunks are committed). The current transaction of 'con' is committed first so that 
+    the workers are not blocked by its locks.
+    With ranges of blocks, a row updated by a chunk could be moved in the range of another chunk which is not started yet and be updated twice: 
+    the SET clause should then give the same result when applied twice (which is the case of the updates of this project). The key column 
+    should not be modified by the UPDATE.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        connexion_param_dict (dict): A dictionnary containing informations for connection to the database, used by each parallel job (see function "create_pg_connexion").
+        schema_name (str): Name of the schema where the table is located.
+        table_name (str): Name of the table to be updated.
+        set_clause (str): The SET clause of the UPDATE, without the keyword SET, e.g. "walousmaj_l1 = LEFT(walousmaj,1)".
+        where_clause (str): The WHERE clause of the UPDATE, without the keyword WHERE. Default value is None and all rows are updated.
+        key_column (str): Name of the column used to define the ranges. Default value is 'capakey'. If None, ranges of blocks are used (PostgreSQL 14 or later).
+        nparts (int): Number of chunks. Default value is None and four chunks by job are created, to balance the load between the jobs.
+        njobs (int): Number of chunks to be updated at the same time. Default value is 6.
+        retries (int): Number of times a failed chunk is retried. Default value is 2.
+
+    Returns:
+        int: The number of rows updated.
+    """
+    ## Saving current time for processing time management
+    begintime = time.time()
+    con.commit()
+    if not nparts:
+        nparts = 4 * int(njobs)
+    if key_column:
+        conditions = get_key_ranges(con, schema_name, table_name, key_column, nparts)
+    else:
+        check_server_version(con, 140000, "A parallel update without 'key_column' (ranges of blocks)")
+        conditions = get_block_ranges(con, schema_name, table_name, nparts)
+    con.commit()
+    query = "UPDATE {schema}.{table} SET {set_clause} WHERE {where}{condition};"
+    list_of_queries = [query.format(schema=schema_name, table=table_name, set_clause=set_clause, 
+                                    where="(%s) AND "%where_clause if where_clause else "", condition=x) for x in conditions]
+    print(list_of_queries[0] + "\n")
+    args = [(i, x, retries) for i, x in enumerate(list_of_queries, 1)]
+    pool = multiprocessing.Pool(processes=max(1, min(int(njobs), len(args))), initializer=init_update_worker, initargs=(connexion_param_dict,))
+    nrows = 0
+    ndone = 0
+    errors = []
+    try:
+        for i, elapsed, rowcount, error in pool.imap_unordered(run_update_chunk, args):
+            ndone += 1
+            nrows += rowcount
+            if error:
+                errors.append((i, error))
+                print("Chunk %s failed after %s attempts: %s"%(i, int(retries) + 1, error))
+            else:
+                print("Chunk %s achieved in %s seconds (%s/%s chunks, %s rows updated)"%(i, round(elapsed, 1), ndone, len(args), nrows))
+    finally:
+        pool.close()
+        pool.join()
+    if errors:
+        raise psycopg2.DatabaseError("%s chunks of the update of %s.%s failed: %s"%(len(errors), schema_name, table_name, 
+                                                                                   "; ".join(["chunk %s: %s"%x for x in errors])))
+    print(print_processing_time(begintime, "Update of %s rows in %s chunks with %s jobs achieved in "%(nrows, len(args), njobs)))
+    return nrows
+
+
+def update_table(con, schema_name, table_name, set_clause, where_clause=None, parallel=False, **kwargs):
+    """Function to execute an UPDATE on a table, either in one statement on 'con' or in parallel (see function 'parallel_update'). 
+    The changes are committed in both cases.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        schema_name (str): Name of the schema where the table is located.
+        table_name (str): Name of the table to be updated.
+        set_clause (str): The SET clause of the UPDATE, without the keyword SET.
+        where_clause (str): The WHERE clause of the UPDATE, without the keyword WHERE. Default value is None and all rows are updated.
+        parallel (bool): If True, the update is executed with the function 'parallel_update'. Default value is False.
+        **kwargs: Options of the parallel update:
+            'connexion_param_dict' (dict): A dictionnary containing informations for connection to the database (see function "create_pg_connexion"). Required if 'parallel' is True.
+            'njobs' (int): Number of parallel jobs. Default value is 6.
+            'npartitions' (int): Number of ranges of the table. Default value is four times 'njobs'.
+            'key_column' (str): Name of the column used to define the ranges. Default value is 'capakey'. If None, ranges of blocks are used, 
+            which requires PostgreSQL 14 or later.
+            'retries' (int): Number of times a failed range is retried. Default value is 2.
+
+    Returns:
+        This function has no return value.
+    """
+    if parallel:
+        if 'connexion_param_dict' not in kwargs:
+            raise ValueError("'connexion_param_dict' argument should be provided for a parallel update.")
+        parallel_update(con, kwargs['connexion_param_dict'], schema_name, table_name, set_clause, where_clause, key_column=kwargs.get('key_column', 'capakey'), 
+                        nparts=kwargs.get('npartitions'), njobs=kwargs.get('njobs', 6), retries=kwargs.get('retries', 2))
+    else:
+        query = "UPDATE %s.%s SET %s"%(schema_name, table_name, set_clause)
+        if where_clause:
+            query += " WHERE %s"%where_clause
+        query += ";"
+        print(query + "\n")
+        cursor = con.cursor()
+        cursor.execute(query)
+        con.commit()
+        cursor.close()
+
+
+def check_server_version(con, minimum, feature):
+    """Function to check that the version of the PostgreSQL server is recent enough for a feature, e.g. the DEFAULT partitions 
+    (PostgreSQL 11) or the function 'pg_partition_tree' (PostgreSQL 12). The program exits with a message if it is not the case.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        minimum (int): The minimum version, in the format of 'server_version_num', e.g. 110000 for PostgreSQL 11.
+        feature (str): Description of the feature, used in the message.
+
+    Returns:
+        int: The version of the server, in the format of 'server_version_num'.
+    """
+    cursor = con.cursor()
+    cursor.execute("SELECT current_setting('server_version_num')::integer, current_setting('server_version');")
+    version, version_name = cursor.fetchone()
+    cursor.close()
+    if version < minimum:
+        sys.exit("ERROR: %s requires PostgreSQL %s or later (the version of the server is %s)."%(feature, minimum // 10000, version_name))
+    return version
+
+
+def partition_name(table_name, value):
+    """Function to get the name of the partition of a table for a value of the partition key, e.g. 'cusw2018_62063'. The characters other 
+    than lower case letters and digits are replaced by '_': the name is then suffixed by a hash of the value, so that different values can 
+    not give the same name (e.g. '1-1' and '1_1').
+
+    Args:
+        table_name (str): Name of the partitioned table.
+        value: Value of the partition key.
+
+    Returns:
+        str: The name of the partition.
+    """
+    name = re.sub('[^0-9a-z]', '_', str(value).lower())
+    if name != str(value):
+        name += '_%s'%hashlib.md5(str(value).encode()).hexdigest()[:6]
+    return "%s_%s"%(table_name, name)
+
+
+def create_partitioned_table(con, connexion_param_dict, schema_name, table_name, subquery, conditions, njobs, 
+                             partition_expression="LEFT(capakey,5)", subpartition_expression=None, key_table=None):
+    """Function to create a table partitioned by list of values of an expression (e.g. the cadastral division, the first five characters 
+    of the 'capakey') from a query, optionally sub-partitioned by list of values of a second expression (e.g. the level 1 of the classification). 
+    A partition is created for each value of the expression returned by the query (or found in 'key_table'), and a DEFAULT partition receives 
+    the rows with a NULL value or a new value inserted later. The rows are inserted through the partitioned table, in parallel for each condition (e.g. ranges of 'capakey' 
+    returned by the function 'get_key_ranges'). The table is replaced if it already exists (the table is not dropped if other objects, e.g. views, 
+    depend on it). With only one condition, the table is created and filled in one transaction. Otherwise the empty table is committed so that 
+    the parallel jobs can see it, and it is dropped if one of the jobs fails. DEFAULT partitions require PostgreSQL 11 or later.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        connexion_param_dict (dict): A dictionnary containing informations for connection to the database, used by each parallel job (see function "create_pg_connexion").
+        Required if 'njobs' is greater than 1.
+        schema_name (str): Name of the schema where the table should be created.
+        table_name (str): Name of the table to be created.
+        subquery (str): The SELECT query to be used. It should contain a '{where}' placeholder which is replaced by the condition of each job.
+        conditions (list of str): List of SQL conditions splitting the rows between the jobs. If it contains only one condition, the rows are inserted directly on 'con'.
+        njobs (int): Number of inserts to be executed at the same time.
+        partition_expression (str): Expression on the columns of the query defining the partitions. Default value is 'LEFT(capakey,5)' (cadastral division).
+        subpartition_expression (str): Expression defining the sub-partitions of each partition, e.g. 'walousmaj_l1' (the level 1 of the classification, 
+        also stored as an identifier of the dictionary if the table is encoded). Default value is None (no sub-partitions).
+        key_table (str): Name of the table ('schema.table') on which the values of the partition keys are read, e.g. the table read by the query if 
+        the columns used by the expressions are copied unchanged. Default value is None and the values are read on the result of the query, 
+        which is then executed one more time.
+
+    Returns:
+        list of str: The names of the partitions (without the sub-partitions).
+    """
+    if njobs > 1 and not connexion_param_dict:
+        sys.exit("ERROR: 'connexion_param_dict' argument should be provided if 'njobs' is greater than 1.")
+    check_server_version(con, 110000, "The DEFAULT partitions of a partitioned table")
+    ## Saving current time for processing time management
+    begintime = time.time()
+    cursor = con.cursor()
+    # Values of the partition keys
+    query = "SELECT DISTINCT ({p}), {s} FROM {source} AS a WHERE ({p}) IS NOT NULL ORDER BY 1, 2;"
+    query = query.format(p=partition_expression, s="(%s)"%(subpartition_expression or "NULL"), 
+                         source=key_table if key_table else "(%s)"%subquery.format(where=""))
+    print(query + "\n")
+    cursor.execute(query)
+    values = {}
+    [values.setdefault(x[0], []).append(x[1]) for x in cursor.fetchall()]
+    # Check that the names of the partitions are distinct (names longer than 63 characters are truncated by PostgreSQL)
+    names = [partition_name(table_name, x) for x in values] + ['%s_default'%table_name]
+    names += [partition_name(partition_name(table_name, x), y) for x in values for y in values[x] if y is not None and subpartition_expression]
+    names += ['%s_default'%partition_name(table_name, x) for x in values if subpartition_expression]
+    if len(set([x[:63] for x in names])) < len(names):
+        raise ValueError("The names of the partitions of '%s.%s' are not distinct, please use a shorter table name."%(schema_name, table_name))
+    # Partitioned table with the columns of the query
+    query = "DROP TABLE IF EXISTS {schema}.{table};"
+    query += "CREATE TEMPORARY TABLE tmp_partition_template AS ({subquery}) WITH NO DATA;"
+    query += "CREATE TABLE {schema}.{table} (LIKE tmp_partition_template) PARTITION BY LIST (({p}));"
+    query += "DROP TABLE tmp_partition_template;"
+    query = query.format(schema=schema_name, table=table_name, subquery=subquery.format(where="WHERE FALSE"), p=partition_expression)
+    print(query + "\n")
+    cursor.execute(query)
+    # Partitions (and sub-partitions)
+    partitions = []
+    for value in values:
+        partition = partition_name(table_name, value)
+        partitions.append(partition)
+        query = "CREATE TABLE {schema}.{partition} PARTITION OF {schema}.{table} FOR VALUES IN ({value}){sub};"
+        query = query.format(schema=schema_name, partition=partition, table=table_name, value=cursor.mogrify("%s", (value,)).decode(),
+                             sub=" PARTITION BY LIST ((%s))"%subpartition_expression if subpartition_expression else "")
+        if subpartition_expression:
+            for subvalue in values[value]:
+                if subvalue is not None:
+                    query += "CREATE TABLE {schema}.{sub} PARTITION OF {schema}.{partition} FOR VALUES IN ({value});".format(
+                        schema=schema_name, sub=partition_name(partition, subvalue), partition=partition, value=cursor.mogrify("%s", (subvalue,)).decode())
+            query += "CREATE TABLE {schema}.{partition}_default PARTITION OF {schema}.{partition} DEFAULT;".format(schema=schema_name, partition=partition)
+        cursor.execute(query)
+    query = "CREATE TABLE {schema}.{table}_default PARTITION OF {schema}.{table} DEFAULT;".format(schema=schema_name, table=table_name)
+    print(query + "\n")
+    cursor.execute(query)
+    partitions.append('%s_default'%table_name)
+    print("%s partitions created\n"%len(partitions))
+    # Insert the rows
+    list_of_queries = ["INSERT INTO {schema}.{table} {subquery};".format(schema=schema_name, table=table_name, subquery=subquery.format(where="WHERE %s "%x)) 
+                       for x in conditions]
+    if len(list_of_queries) == 1:
+        print(list_of_queries[0] + "\n")
+        cursor.execute(list_of_queries[0])
+    else:
+        # The jobs use their own connexion: the empty table is committed first and dropped if a job fails
+        con.commit()
+        print(list_of_queries[0] + "\n")
+        try:
+            execute_parallel_queries(connexion_param_dict, list_of_queries, njobs)
+        except Exception:
+            con.rollback()
+            cursor.execute("DROP TABLE IF EXISTS {schema}.{table};".format(schema=schema_name, table=table_name))
+            con.commit()
+            raise
+    con.commit()
+    cursor.close()
+    print(print_processing_time(begintime, "Creation of partitioned table %s.%s achieved in "%(schema_name, table_name)))
+    return partitions
+
+
+def create_partition_indexes(con, connexion_param_dict, schema_name, table_name, index_columns, njobs):
+    """Function to create indexes on a partitioned table: the indexes of the leaf partitions are created in parallel, then the index of the 
+    partitioned table is created, which only attaches the existing indexes of the partitions. The geometry columns get a GIST index. 
+    The partitions are listed with the function 'pg_partition_tree', which requires PostgreSQL 12 or later.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        connexion_param_dict (dict): A dictionnary containing informations for connection to the database, used by each parallel job (see function "create_pg_connexion").
+        Required if 'njobs' is greater than 1.
+        schema_name (str): Name of the schema where the table is located.
+        table_name (str): Name of the partitioned table.
+        index_columns (list of str): Names of the columns to be indexed, e.g. ['capakey', 'walousmaj', 'geom'].
+        njobs (int): Number of indexes to be created at the same time.
+
+    Returns:
+        This function has no return value.
+    """
+    if njobs > 1 and not connexion_param_dict:
+        sys.exit("ERROR: 'connexion_param_dict' argument should be provided if 'njobs' is greater than 1.")
+    check_server_version(con, 120000, "The function 'pg_partition_tree'")
+    ## Saving current time for processing time management
+    begintime = time.time()
+    cursor = con.cursor()
+    query = "SELECT column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s AND udt_name = 'geometry';"
+    cursor.execute(query, (schema_name, table_name))
+    geometry_columns = [x[0] for x in cursor.fetchall()]
+    query = "SELECT c.relname FROM pg_partition_tree('%s.%s') AS t JOIN pg_class AS c ON c.oid = t.relid WHERE t.isleaf;"%(schema_name, table_name)
+    cursor.execute(query)
+    leaves = [x[0] for x in cursor.fetchall()]
+    index = "CREATE INDEX IF NOT EXISTS {table}_{col}_idx ON {schema}.{table}{using} ({col});"
+    list_of_queries = [index.format(schema=schema_name, table=leaf, col=col, using=" USING gist" if col in geometry_columns else "") 
+                       for leaf in leaves for col in index_columns]
+    if njobs > 1 and len(list_of_queries) > 1:
+        print(list_of_queries[0] + "\n")
+        execute_parallel_queries(connexion_param_dict, list_of_queries, njobs)
+    else:
+        [cursor.execute(x) for x in list_of_queries]
+    # Index of the partitioned table (the indexes of the partitions are attached)
+    for col in index_columns:
+        query = index.format(schema=schema_name, table=table_name, col=col, using=" USING gist" if col in geometry_columns else "")
+        print(query + "\n")
+        cursor.execute(query)
+    con.commit()
+    cursor.close()
+    print(print_processing_time(begintime, "Creation of %s indexes on %s partitions achieved in "%(len(index_columns), len(leaves))))
+
+
+def rebuild_partition(con, schema_name, table_name, subquery, value, partition_expression="LEFT(capakey,5)", 
+                      subpartition_expression=None, condition=None):
+    """Function to rebuild the rows of one partition of a table created with the function 'create_partitioned_table', e.g. after a correction 
+    of the data of one cadastral division, without rebuilding the whole table. The partition is truncated (with its sub-partitions) and the 
+    rows returned by the query for its value are inserted again through the partitioned table, in one transaction: the other partitions stay 
+    readable and the partition is not left half-built on failure. If the partition does not exist yet (new value), its rows are removed from 
+    the DEFAULT partition and the partition is created, with a DEFAULT sub-partition if the table is sub-partitioned. The indexes of the 
+    partitioned table are created on the new partition by PostgreSQL, and the rows with a new value of the sub-partition expression are stored 
+    in the DEFAULT sub-partition.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        schema_name (str): Name of the schema where the table is located.
+        table_name (str): Name of the partitioned table.
+        subquery (str): The SELECT query used to create the table. It should contain a '{where}' placeholder which is replaced by the condition of the partition.
+        value: Value of the partition key of the partition to be rebuilt, e.g. '62063'.
+        partition_expression (str): Expression defining the partitions, as given to the function 'create_partitioned_table'. Default value is 'LEFT(capakey,5)'.
+        subpartition_expression (str): Expression defining the sub-partitions, as given to the function 'create_partitioned_table'. Default value is None.
+        condition (str): SQL condition selecting the rows of the partition in the query. Default value is None and the partition expression is 
+        compared to the value, which requires the columns used by the expression to be read unchanged by the query.
+
+    Returns:
+        str: The name of the partition.
+    """
+    ## Saving current time for processing time management
+    begintime = time.time()
+    cursor = con.cursor()
+    partition = partition_name(table_name, value)
+    literal = cursor.mogrify("%s", (value,)).decode()
+    if not condition:
+        condition = "({p}) = {value}".format(p=partition_expression, value=literal)
+    query = "SELECT count(*) FROM pg_inherits AS i JOIN pg_class AS c ON c.oid = i.inhrelid WHERE i.inhparent = '{schema}.{table}'::regclass AND c.relname = %s;"
+    cursor.execute(query.format(schema=schema_name, table=table_name), (partition[:63],))
+    if cursor.fetchone()[0]:
+        query = "TRUNCATE {schema}.{partition};".format(schema=schema_name, partition=partition)
+    else:
+        query = "DELETE FROM {schema}.{table}_default WHERE ({p}) = {value};"
+        query += "CREATE TABLE {schema}.{partition} PARTITION OF {schema}.{table} FOR VALUES IN ({value}){sub};"
+        if subpartition_expression:
+            query += "CREATE TABLE {schema}.{partition}_default PARTITION OF {schema}.{partition} DEFAULT;"
+        query = query.format(schema=schema_name, table=table_name, partition=partition, p=partition_expression, value=literal,
+                             sub=" PARTITION BY LIST ((%s))"%subpartition_expression if subpartition_expression else "")
+    print(query + "\n")
+    cursor.execute(query)
+    query = "INSERT INTO {schema}.{table} {subquery};".format(schema=schema_name, table=table_name, subquery=subquery.format(where="WHERE %s "%condition))
+    print(query + "\n")
+    cursor.execute(query)
+    nrows = cursor.rowcount
+    con.commit()
+    cursor.close()
+    print(print_processing_time(begintime, "Rebuild of partition %s.%s (%s rows) achieved in "%(schema_name, partition, nrows)))
+    return partition
@@ -29,6 +29,8 @@ import sys
 import psycopg2
 import time
 from processing_time import print_processing_time
+from postgres_parallel import update_table, get_key_ranges, create_partitioned_table, create_partition_indexes
+from hilucs_dictionary import LABEL_COMMENT, label_literals, dictionary_codes, decode_case, label_comment_query, copy_column_comments, encoded_columns, has_encoded_array, hilucs_descendant
   
     
 def add_column_postclass_rulenumber(con, result_table_schema, result_table_name):
@@ -61,8 +63,33 @@ def add_column_postclass_rulenumber(con, result_table_schema, result_table_name)
         sys.exit(error) 
         
         
+def neighbour_join(result_table_schema, result_table_name, colum_label, adjacency_table=None, residential="'5_1'"):
+    '''Function to get the join between the parcels ('a') and their neighbouring parcels classified as residential ('5_1'), 
+    used by the postclassification rules of residential gardens.
+    
+    Args: 
+        result_table_schema (str): Name of the schema where the table is located.
+        result_table_name (str): Name of the table.
+        colum_label (str): The name of the attribute containing the classification results.
+        adjacency_table (str): Name of a table with the adjacency of the parcels ('schema.table'), e.g. created with the function 'build_adjacency'. 
+        Default value is None and the neighbours are computed with ST_Touches.
+        residential (str): The literal of the residential class in the column, i.e. its identifier if the column is encoded (see function 
+        'label_literals'). Default value is "'5_1'".
+        
+    Returns:
+        str: The JOIN clause. 
+    '''
+    if adjacency_table:
+        query="JOIN %s AS adj ON adj.base_id = a.capakey "%adjacency_table
+        query+="JOIN %s.%s AS b ON b.capakey = adj.neighbour_id AND b.%s = %s "%(result_table_schema,result_table_name,colum_label,residential)
+    else:
+        query="JOIN (SELECT geom FROM %s.%s WHERE %s = %s) AS b "%(result_table_schema,result_table_name,colum_label,residential)
+        query+="ON ST_Touches(a.geom, b.geom) "
+    return query
+        
+        
 def postclassif_residentialgardens_1(con, result_table_schema, result_table_name, 
-                                     postclassif_rule=1, colum_label="walousmaj"):
+                                     postclassif_rule=1, colum_label="walousmaj", adjacency_table=None, dictionary=None):
     '''Function to fix systematic misclassification of residential gardens.
     Postclassification of residential gardens is made in two steps. This function is the first step.
     The rule implement is as follows: all cadastral parcels in urban areas smaller than 2500 sq.m and classified 
@@ -75,6 +102,10 @@ def postclassif_residentialgardens_1(con, result_table_schema, result_table_name
         result_table_name (str): Name of the table on which the column should be created.
         postclassif_rule (int): The number of the rule in the postclassification process.
         colum_label (str): The name of the attribute containing the classification results. Default value is "walousmaj".
+        adjacency_table (str): Name of a table with the adjacency of the parcels ('schema.table'), e.g. created with the function 'build_adjacency'. 
+        If provided, the neighbours are found in this table instead of computing ST_Touches. Default value is None.
+        dictionary (str): Name of the dictionary table ('schema.table') if the columns with codes are encoded (see function 'encode_table'). 
+        If the table has the encoded columns of 'all_hilucs' (see function 'encode_all_hilucs'), they are used. Default value is None (codes stored as text).
         
     Returns:
         This function has no return value. 
@@ -85,14 +116,19 @@ def postclassif_residentialgardens_1(con, result_table_schema, result_table_name
         # Create cursor
         cursor = con.cursor()
         # Update table
+        # Codes (or their identifiers if the columns are encoded)
+        literals = label_literals(con, dictionary, ['5_1','1_1','1_1_1'])
         query="UPDATE %s.%s "%(result_table_schema,result_table_name)
-        query+="SET %s = '5_1', postclas_rule = %s "%(colum_label,postclassif_rule)
+        query+="SET %s = %s, postclas_rule = %s "%(colum_label,literals['5_1'],postclassif_rule)
         query+="WHERE capakey IN (SELECT DISTINCT a.capakey FROM %s.%s AS a "%(result_table_schema,result_table_name)
-        query+="JOIN (SELECT geom FROM %s.%s WHERE %s = '5_1') AS b "%(result_table_schema,result_table_name,colum_label)
-        query+="ON ST_Touches(a.geom, b.geom) "
-        query+="WHERE a.%s IN ('1_1','1_1_1') "%colum_label
+        query+=neighbour_join(result_table_schema, result_table_name, colum_label, adjacency_table, literals['5_1'])
+        query+="WHERE a.%s IN (%s,%s) "%(colum_label,literals['1_1'],literals['1_1_1'])
         query+="AND ST_Area(a.geom) < 2500 AND a.rnpp_200m_mode >= 2 "
-        query+="AND NOT EXISTS (SELECT 1 FROM unnest(a.all_hilucs) AS c WHERE c LIKE '1_1_1_%'))"
+        if dictionary and has_encoded_array(con, result_table_schema, result_table_name):
+            # Indexed test of the codes more detailed than '1_1_1' (see function 'encode_all_hilucs')
+            query+="AND (%s) IS NOT TRUE)"%hilucs_descendant(con, dictionary, '1_1_1', 'a.all_hilucs')
+        else:
+            query+="AND NOT EXISTS (SELECT 1 FROM unnest(a.all_hilucs) AS c WHERE c LIKE '1_1_1_%'))"
         print(query + ';\n')
         cursor.execute(query)
         con.commit()
@@ -105,7 +141,7 @@ def postclassif_residentialgardens_1(con, result_table_schema, result_table_name
         
         
 def postclassif_residentialgardens_2(con, result_table_schema, result_table_name, 
-                                     postclassif_rule=2, colum_label="walousmaj"):
+                                     postclassif_rule=2, colum_label="walousmaj", adjacency_table=None, dictionary=None):
     '''Function to fix systematic misclassification of residential gardens.
     Postclassification of residential gardens is made in two steps. This function is the second and last step.
     The rule implement is as follows: all cadastral parcels in urban areas, classified as '1_1' and having only
@@ -119,6 +155,10 @@ def postclassif_residentialgardens_2(con, result_table_schema, result_table_name
         result_table_name (str): Name of the table on which the column should be created.
         postclassif_rule (int): The number of the rule in the postclassification process.
         colum_label (str): The name of the attribute containing the classification results. Default value is "walousmaj".
+        adjacency_table (str): Name of a table with the adjacency of the parcels ('schema.table'), e.g. created with the function 'build_adjacency'. 
+        If provided, the neighbours are found in this table instead of computing ST_Touches. Default value is None.
+        dictionary (str): Name of the dictionary table ('schema.table') if the columns with codes are encoded (see function 'encode_table'). 
+        Default value is None (codes stored as text).
         
     Returns:
         This function has no return value. 
@@ -129,13 +169,14 @@ def postclassif_residentialgardens_2(con, result_table_schema, result_table_name
         # Create cursor
         cursor = con.cursor()
         # Update table
+        # Codes (or their identifiers if the columns are encoded)
+        literals = label_literals(con, dictionary, ['5_1','1_1'])
         query="UPDATE %s.%s "%(result_table_schema,result_table_name)
-        query+="SET %s = '5_1', postclas_rule = %s "%(colum_label,postclassif_rule)
+        query+="SET %s = %s, postclas_rule = %s "%(colum_label,literals['5_1'],postclassif_rule)
         query+="WHERE capakey IN (SELECT DISTINCT a.capakey FROM %s.%s AS a "%(result_table_schema,result_table_name)
-        query+="JOIN (SELECT geom FROM %s.%s WHERE %s = '5_1') AS b "%(result_table_schema,result_table_name,colum_label)
-        query+="ON ST_Touches(a.geom, b.geom) "
+        query+=neighbour_join(result_table_schema, result_table_name, colum_label, adjacency_table, literals['5_1'])
         query+="WHERE Cardinality(a.all_hilucs) = 1 "
-        query+="AND a.nat_lu_maj = '1_1' AND a.%s = '1_1' "%colum_label
+        query+="AND a.nat_lu_maj = %s AND a.%s = %s "%(literals['1_1'],colum_label,literals['1_1'])
         query+="AND a.rnpp_200m_mode >= 2)"
         print(query + ';\n')
         cursor.execute(query)
@@ -147,7 +188,203 @@ def postclassif_residentialgardens_2(con, result_table_schema, result_table_name
     except (Exception, psycopg2.DatabaseError) as error:
         sys.exit(error)    
         
-def subdivide_residential_density(con, result_table_schema, result_table_name, colum_label="walousmaj"):
+def residential_density_case(colum_label="walousmaj", density_thresholds=None, literals=None):
+    '''Function to get the CASE expression subdividing the residential classes '5_1' and '5_2' according to the 
+    population density in their neighbourhood ('rnpp_200m_mode'), used by the function 'subdivide_residential_density'.
+    
+    Args: 
+        colum_label (str): The column (or expression) containing the classification results. Default value is "walousmaj".
+        density_thresholds (list of tuple of str): Conditions on 'rnpp_200m_mode' and the corresponding suffix of the class, in the order 
+        they are tested. Default value is None and [('<= 1','D'), ('= 2','C'), ('= 3','B'), ('= 4','A')] is used.
+        literals (dict): The literals of the classes if the column is encoded (see function 'residential_density_literals'). 
+        Default value is None (codes stored as text).
+        
+    Returns:
+        str: The CASE expression. 
+    '''
+    if not density_thresholds:
+        density_thresholds = [('<= 1','D'), ('= 2','C'), ('= 3','B'), ('= 4','A')]
+    literals = literals if literals else residential_density_literals(None, None, density_thresholds)
+    case_query = "CASE "
+    for cl in ('5_1','5_2'):
+        case_query += "WHEN %s = %s THEN CASE "%(colum_label,literals[cl])
+        for condition, suffix in density_thresholds:
+            case_query += "WHEN rnpp_200m_mode %s THEN %s "%(condition,literals['%s_%s'%(cl,suffix)])
+        case_query += "ELSE %s END "%literals[cl]
+    case_query += "ELSE %s END"%colum_label 
+    return case_query
+
+
+def residential_density_literals(con, dictionary=None, density_thresholds=None):
+    '''Function to get the literals of the residential classes and of their subdivisions, used by the function 'residential_density_case'.
+    
+    Args: 
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or 
+        using the custom function "create_PG_connexion" with database connexion parameters.
+        dictionary (str): Name of the dictionary table ('schema.table') if the column is encoded (see function 'encode_table'). 
+        Default value is None (codes stored as text).
+        density_thresholds (list of tuple of str): Thresholds of population density (see function 'residential_density_case'). Default value is None.
+        
+    Returns:
+        dict: The literal of each class (see function 'label_literals'). 
+    '''
+    if not density_thresholds:
+        density_thresholds = [('<= 1','D'), ('= 2','C'), ('= 3','B'), ('= 4','A')]
+    codes = ['5_1','5_2'] + ['%s_%s'%(cl,suffix) for cl in ('5_1','5_2') for condition, suffix in density_thresholds]
+    return label_literals(con, dictionary, codes)
+
+
+def level_expressions(con, label, dictionary=None):
+    '''Function to get the expressions giving the code of each level (from level 1 to level 4) of a code, and the conditions for 
+    the levels to exist (the code is long enough), used by the functions 'create_walousmaj_levels' and 'derive_postclassification'. 
+    If the column is encoded, the expressions convert the identifiers of the codes of the dictionary to the identifiers of their 
+    levels, without decoding each row.
+    
+    Args: 
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or 
+        using the custom function "create_PG_connexion" with database connexion parameters.
+        label (str): The column (or expression) containing the code.
+        dictionary (str): Name of the dictionary table ('schema.table') if the column is encoded (see function 'encode_table'). 
+        Default value is None (codes stored as text).
+        
+    Returns:
+        dict: The expression ('l1' to 'l4') and the condition ('w1' to 'w4') of each level. 
+    '''
+    expressions = {}
+    codes = dictionary_codes(con, dictionary) if dictionary else []
+    for i, length in ((1,1),(2,3),(3,5),(4,7)):
+        if not dictionary:
+            expressions['l%s'%i] = "LEFT(%s,%s)"%(label,length)
+            expressions['w%s'%i] = "LENGTH(%s) >= %s"%(label,length)
+            continue
+        mapping = [(x, x[:length]) for x in codes if len(x) >= length]
+        literals = label_literals(con, dictionary, sorted(set([x[0] for x in mapping] + [x[1] for x in mapping])))
+        if mapping:
+            expressions['l%s'%i] = "CASE %s "%label + "".join(["WHEN %s THEN %s "%(literals[x],literals[y]) for x, y in mapping]) + "END"
+            expressions['w%s'%i] = "%s IN (%s)"%(label,",".join([literals[x] for x, y in mapping]))
+        else:
+            expressions['l%s'%i] = "NULL::smallint"
+            expressions['w%s'%i] = "FALSE"
+    return expressions
+
+
+def hilucs_code_case(value, cl_truncate, cl_lookup, literals=None):
+    '''Function to get the CASE expression converting a code of the actual legend scheme to the INSPIRE HILUCS scheme, 
+    used by the functions 'create_hilucs_landuse_1' and 'create_hilucs_landuse_2'.
+    
+    Args: 
+        value (str): The column (or expression) containing the code.
+        cl_truncate (list of str): Codes that should be truncated of one level, e.g. class 1_1_1_A -> 1_1_1.
+        cl_lookup (list of tuple of str): Correspondance between codes of the actual legend scheme and their code in the INSPIRE HILUCS scheme.
+        literals (dict): The literals of the codes if the column is encoded (see function 'label_literals'). Default value is None (codes stored as text).
+        
+    Returns:
+        str: The CASE expression. 
+    '''
+    literal = lambda code: literals[code] if literals else "'%s'"%code
+    case_query = "CASE "
+    if cl_truncate:
+        for cl in cl_truncate: # Classes that need to be cuted from one level of detail off, e.g. class 1_1_1_A -> 1_1_1
+            case_query += "WHEN %s = %s THEN %s "%(value,literal(cl),literal('_'.join(cl.split('_')[:-1])))
+    if cl_lookup:
+        for cl_walousmaj, cl_inspire in cl_lookup: # Classes that need to be converted, e.g. 7_1 -> 6_3_1
+            case_query += "WHEN %s = %s THEN %s "%(value,literal(cl_walousmaj),literal(cl_inspire))
+    case_query += "ELSE %s END "%value
+    return case_query
+
+
+def hilucs_code_literals(con, dictionary=None, cl_truncate=None, cl_lookup=None):
+    '''Function to get the literals of the codes used by the function 'hilucs_code_case'.
+    
+    Args: 
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or 
+        using the custom function "create_PG_connexion" with database connexion parameters.
+        dictionary (str): Name of the dictionary table ('schema.table') if the column is encoded (see function 'encode_table'). 
+        Default value is None (codes stored as text).
+        cl_truncate (list of str): Classes that need to be truncated (see function 'hilucs_code_case'). Default value is None.
+        cl_lookup (list of tuple of str): Correspondance between codes (see function 'hilucs_code_case'). Default value is None.
+        
+    Returns:
+        dict: The literal of each code (see function 'label_literals'). 
+    '''
+    codes = []
+    for cl in (cl_truncate or []):
+        codes += [cl, '_'.join(cl.split('_')[:-1])]
+    for cl_walousmaj, cl_inspire in (cl_lookup or []):
+        codes += [cl_walousmaj, cl_inspire]
+    return label_literals(con, dictionary, codes)
+
+
+def hilucs_array_lookup(array_expression, lookup_table, ignore=True):
+    '''Function to get the expression converting an array of codes of the actual legend scheme to an array of distinct codes 
+    of the INSPIRE HILUCS scheme using a lookup table (see function 'create_hilucs_lookup'), in one pass on the array: 
+    the ignored codes are removed, the other codes are converted, the duplicates are removed while preserving the order of the 
+    first occurence of each code, and the codes to be removed are removed if a more detailed sub-level code is present in the array. 
+    As a code is removed only if a more detailed code remains, the result does not depend on the order of the codes to be removed.
+    Used by the function 'create_hilucs_landuse_2'.
+    
+    Args: 
+        array_expression (str): The column (or expression) containing the array of codes.
+        lookup_table (str): Name of the lookup table ('schema.table').
+        ignore (bool): Either the ignored codes (and NULL values) should be removed. Default value is True.
+        
+    Returns:
+        str: The ARRAY expression. 
+    '''
+    query = "ARRAY (WITH m AS (SELECT COALESCE(l.hilucs, t.v) AS code, min(t.ord) AS ord "
+    query += "FROM unnest(%s) WITH ORDINALITY t(v,ord) LEFT JOIN %s AS l ON l.code = t.v "%(array_expression,lookup_table)
+    if ignore:
+        query += "WHERE t.v IS NOT NULL AND l.ignored IS NOT TRUE "
+    query += "GROUP BY 1) SELECT m.code FROM m "
+    query += "WHERE (EXISTS (SELECT 1 FROM %s AS r WHERE r.code = m.code AND r.remove) "%lookup_table
+    query += "AND EXISTS (SELECT 1 FROM m AS c WHERE c.code LIKE m.code || '_%')) IS NOT TRUE ORDER BY m.ord)"
+    return query
+
+
+def create_hilucs_lookup(con, schema, cl_ignore, cl_truncate, cl_lookup, cl_remove, lookup_table='hilucs_lookup'):
+    '''Function to create the lookup table used to convert codes of the actual legend scheme to the INSPIRE HILUCS scheme 
+    (see function 'hilucs_array_lookup'). The table has one row by code with the converted code ('hilucs'), either the code 
+    should be ignored ('ignored') and either the code should be removed if a more detailed sub-level code is present ('remove'). 
+    As in the CASE expression of the function 'hilucs_code_case', the truncation has priority over the lookup. The table should be 
+    dropped once used.
+    
+    Args: 
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or 
+        using the custom function "create_PG_connexion" with database connexion parameters.
+        schema (str): Name of the schema where the lookup table should be created.
+        cl_ignore (list of str): Codes that should be ignored.
+        cl_truncate (list of str): Codes that should be truncated of one level.
+        cl_lookup (list of tuple of str): Correspondance between codes of the actual legend scheme and their code in the INSPIRE HILUCS scheme.
+        cl_remove (list of str): Codes that should be removed if a more detailed sub-level code is present.
+        lookup_table (str): Name of the lookup table. Default value is 'hilucs_lookup'.
+        
+    Returns:
+        str: The name of the lookup table ('schema.table'). 
+    '''
+    cursor = con.cursor()
+    query = "DROP TABLE IF EXISTS {s}.{t}; CREATE TABLE {s}.{t} (code text PRIMARY KEY, hilucs text, "
+    query += "ignored boolean DEFAULT False, remove boolean DEFAULT False);"
+    query = query.format(s=schema, t=lookup_table)
+    print(query + "\n")
+    cursor.execute(query)
+    insert = "INSERT INTO {s}.{t} (code, hilucs) VALUES (%s, %s) ON CONFLICT DO NOTHING;".format(s=schema, t=lookup_table)
+    if cl_truncate:
+        cursor.executemany(insert, [(cl,'_'.join(cl.split('_')[:-1])) for cl in cl_truncate])
+    if cl_lookup:
+        cursor.executemany(insert, list(cl_lookup))
+    flag = "INSERT INTO {s}.{t} (code, hilucs, {f}) VALUES (%s, %s, True) ON CONFLICT (code) DO UPDATE SET {f} = True;"
+    if cl_ignore:
+        cursor.executemany(flag.format(s=schema, t=lookup_table, f='ignored'), [(cl,cl) for cl in cl_ignore])
+    if cl_remove:
+        cursor.executemany(flag.format(s=schema, t=lookup_table, f='remove'), [(cl,cl) for cl in cl_remove])
+    cursor.execute("ANALYZE {s}.{t};".format(s=schema, t=lookup_table))
+    con.commit()
+    cursor.close()
+    return '%s.%s'%(schema, lookup_table)
+
+
+def subdivide_residential_density(con, result_table_schema, result_table_name, colum_label="walousmaj", density_thresholds=None, parallel=False, 
+                                  dictionary=None, **kwargs):
     '''Function to refine residential classes, by updating the classes '5_1' and '5_2' according to the 
     population density in their neighbourhood. 
     
@@ -157,6 +394,12 @@ def subdivide_residential_density(con, result_table_schema, result_table_name, c
         result_table_schema (str): Name of the schema where the table is located.
         result_table_name (str): Name of the table on which the column should be created.
         colum_label (str): The name of the attribute containing the classification results. Default value is "walousmaj".
+        density_thresholds (list of tuple of str): Conditions on 'rnpp_200m_mode' and the corresponding suffix of the class 
+        (see function 'residential_density_case'). Default value is None and the default thresholds are used.
+        parallel (bool): If True, the update is executed in parallel on ranges of the table (see function 'parallel_update'). Default value is False.
+        dictionary (str): Name of the dictionary table ('schema.table') if the columns with codes are encoded (see function 'encode_table'). 
+        Default value is None (codes stored as text).
+        **kwargs: Options of the parallel update ('connexion_param_dict', 'njobs', 'npartitions', 'key_column', 'retries'), see function 'update_table'.
         
     Returns:
         This function has no return value. 
@@ -167,26 +410,11 @@ def subdivide_residential_density(con, result_table_schema, result_table_name, c
         # Create cursor
         cursor = con.cursor()
         # Case when then else end query
-        case_query = "CASE WHEN %s = '5_1' THEN CASE "%colum_label
-        case_query += "WHEN rnpp_200m_mode <= 1 THEN '5_1_D' "
-        case_query += "WHEN rnpp_200m_mode = 2 THEN '5_1_C' "
-        case_query += "WHEN rnpp_200m_mode = 3 THEN '5_1_B' "
-        case_query += "WHEN rnpp_200m_mode = 4 THEN '5_1_A' "
-        case_query += "ELSE '5_1' END "
-        case_query += "WHEN %s = '5_2' THEN CASE "%colum_label
-        case_query += "WHEN rnpp_200m_mode <= 1 THEN '5_2_D' "
-        case_query += "WHEN rnpp_200m_mode = 2 THEN '5_2_C' "
-        case_query += "WHEN rnpp_200m_mode = 3 THEN '5_2_B' "
-        case_query += "WHEN rnpp_200m_mode = 4 THEN '5_2_A' "
-        case_query += "ELSE '5_2' END "
-        case_query += "ELSE %s END"%colum_label 
+        literals = residential_density_literals(con, dictionary, density_thresholds)
+        case_query = residential_density_case(colum_label, density_thresholds, literals)
 
         # Update table - Land use class attribute
-        query="UPDATE %s.%s "%(result_table_schema,result_table_name)
-        query+="SET %s = (%s)"%(colum_label,case_query)
-        print(query+";\n")
-        cursor.execute(query)
-        con.commit()
+        update_table(con, result_table_schema, result_table_name, "%s = (%s)"%(colum_label,case_query), parallel=parallel, **kwargs)
         
         # Close connection with database
         cursor.close()
@@ -195,7 +423,7 @@ def subdivide_residential_density(con, result_table_schema, result_table_name, c
     except (Exception, psycopg2.DatabaseError) as error:
         sys.exit(error)
     
-def create_cusw_table(con, schema, input_table_name, cusw_table_name):
+def create_cusw_table(con, schema, input_table_name, cusw_table_name, partitioned=False, **kwargs):
     '''Function to create table "cusw" that will be the one shared with end users. 
     
     Args: 
@@ -204,6 +432,16 @@ def create_cusw_table(con, schema, input_table_name, cusw_table_name):
         schema (str): Name of the schema where the table with classification results is located.
         input_table_name (str): Name of the table with classification results.
         cusw_table_name (str): The name of the table to be created and dedicated to be shared with end-users.
+        partitioned (bool): If True, the table is created as a table partitioned by cadastral division (see function 'create_partitioned_table'), 
+        so that the queries on a part of the region only scan the corresponding partitions. Default value is False.
+        **kwargs: Options of the partitioned table:
+            'partition_expression' (str): Expression defining the partitions. Default value is 'LEFT(capakey,5)' (cadastral division).
+            'subpartition_expression' (str): Expression defining the sub-partitions, e.g. 'walousmaj_l1' (level 1 of the classification). Default value is None.
+            'index_columns' (list of str): Columns to be indexed on each partition (see function 'create_partition_indexes'). Default value is None.
+            'njobs' (int): Number of parallel jobs used to fill the table and create the indexes. 'connexion_param_dict' should be provided too.
+            'connexion_param_dict' (dict): A dictionnary containing informations for connection to the database, used by each parallel job (see function "create_pg_connexion").
+        The column 'walousmaj_l1' (level 1 of 'walousmaj', converted through the dictionary if 'walousmaj' is encoded) is created with the table, 
+        so that it can be used to sub-partition the table. 
         
     Returns:
         This function has no return value. 
@@ -224,6 +462,32 @@ def create_cusw_table(con, schema, input_table_name, cusw_table_name):
         selectcolumns = ['geom', 'capakey', 'lc_mode','lc_prop_1','lc_prop_2', 'lc_prop_3', 'lc_prop_4', 
                          'lc_prop_5', 'lc_prop_6', 'lc_prop_7', 'lc_prop_8', 'lc_prop_9', 'lc_prop_80', 
                          'lc_prop_90', 'all_hilucs', 'walousmaj', 'rulebased_leaf', 'postclas_rule']
+        # Level 1 of the classification results, converted through the dictionary if the column is encoded (see function 'encode_table')
+        query = "SELECT col_description(attrelid, attnum) FROM pg_attribute WHERE attrelid = '{0}.{1}'::regclass AND attname = 'walousmaj'"
+        cursor = con.cursor()
+        cursor.execute(query.format(schema,input_table_name))
+        comment = (cursor.fetchone() or [None])[0] or ''
+        cursor.close()
+        dictionary = comment[len(LABEL_COMMENT%''):] if comment.startswith(LABEL_COMMENT%'') else None
+        selectcolumns.append('(%s) AS walousmaj_l1'%level_expressions(con, 'walousmaj', dictionary)['l1'])
+        if partitioned:
+            njobs = int(kwargs.get('njobs', 1))
+            conditions = get_key_ranges(con, schema, input_table_name, 'capakey', njobs) if njobs > 1 else ["TRUE"]
+            subquery = 'SELECT %s FROM %s.%s {where}'%(','.join(selectcolumns),schema,input_table_name)
+            # The values of the keys are read on the input table, unless the sub-partitions use 'walousmaj_l1' which is computed by the query
+            create_partitioned_table(con, kwargs.get('connexion_param_dict'), schema, cusw_table_name, subquery, conditions, njobs, 
+                                     kwargs.get('partition_expression', "LEFT(capakey,5)"), kwargs.get('subpartition_expression'), 
+                                     key_table=None if kwargs.get('subpartition_expression') else '%s.%s'%(schema,input_table_name))
+            if kwargs.get('index_columns'):
+                create_partition_indexes(con, kwargs.get('connexion_param_dict'), schema, cusw_table_name, kwargs['index_columns'], njobs)
+            copy_column_comments(con, schema, input_table_name, schema, cusw_table_name)
+            if dictionary:
+                cursor = con.cursor()
+                cursor.execute(label_comment_query(schema,cusw_table_name,'walousmaj_l1',dictionary))
+                con.commit()
+                cursor.close()
+            print(print_processing_time(begintime, "Creation of table '%s' achieved in "%cusw_table_name))
+            return
         # Create table
         query = 'CREATE TABLE %s.%s AS(SELECT %s FROM %s.%s);'%(schema,cusw_table_name,
                                                                 ','.join(selectcolumns),
@@ -233,13 +497,20 @@ def create_cusw_table(con, schema, input_table_name, cusw_table_name):
         cursor.execute(query)
         con.commit()
         cursor.close()
+        # Comments of the columns, used to decode the encoded columns
+        copy_column_comments(con, schema, input_table_name, schema, cusw_table_name)
+        if dictionary:
+            cursor = con.cursor()
+            cursor.execute(label_comment_query(schema,cusw_table_name,'walousmaj_l1',dictionary))
+            con.commit()
+            cursor.close()
         ## Print processing time
         print(print_processing_time(begintime, "Creation of table '%s' achieved in "%cusw_table_name))
     except (Exception, psycopg2.DatabaseError) as error:
         sys.exit(error)
         
         
-def create_walousmaj_levels(con, result_table_schema, result_table_name, colum_label="walousmaj"):
+def create_walousmaj_levels(con, result_table_schema, result_table_name, colum_label="walousmaj", parallel=False, dictionary=None, **kwargs):
     '''Function to add new attribute columns with the classifiation results code at each level (from 
     level 1 to level 4). 
     
@@ -249,6 +520,10 @@ def create_walousmaj_levels(con, result_table_schema, result_table_name, colum_l
         result_table_schema (str): Name of the schema where the table is located.
         result_table_name (str): Name of the table on which the column should be created.
         colum_label (str): The name of the attribute containing the classification results. Default value is "walousmaj".
+        parallel (bool): If True, the four columns are updated together in parallel on ranges of the table (see function 'parallel_update'). Default value is False.
+        dictionary (str): Name of the dictionary table ('schema.table') if the columns with codes are encoded (see function 'encode_table'). 
+        Default value is None (codes stored as text).
+        **kwargs: Options of the parallel update ('connexion_param_dict', 'njobs', 'npartitions', 'key_column', 'retries'), see function 'update_table'.
         
     Returns:
         This function has no return value. 
@@ -259,33 +534,48 @@ def create_walousmaj_levels(con, result_table_schema, result_table_name, colum_l
         # Create cursor
         cursor = con.cursor()
         # Add columns
+        datatype = 'smallint' if dictionary else 'character varying'
         queries = []
-        queries.append("ALTER TABLE %s.%s ADD COLUMN IF NOT EXISTS %s_l1 character varying"%(result_table_schema,result_table_name,colum_label))
-        queries.append("ALTER TABLE %s.%s ADD COLUMN IF NOT EXISTS %s_l2 character varying"%(result_table_schema,result_table_name,colum_label))
-        queries.append("ALTER TABLE %s.%s ADD COLUMN IF NOT EXISTS %s_l3 character varying"%(result_table_schema,result_table_name,colum_label))
-        queries.append("ALTER TABLE %s.%s ADD COLUMN IF NOT EXISTS %s_l4 character varying"%(result_table_schema,result_table_name,colum_label))
+        queries.append("ALTER TABLE %s.%s ADD COLUMN IF NOT EXISTS %s_l1 %s"%(result_table_schema,result_table_name,colum_label,datatype))
+        queries.append("ALTER TABLE %s.%s ADD COLUMN IF NOT EXISTS %s_l2 %s"%(result_table_schema,result_table_name,colum_label,datatype))
+        queries.append("ALTER TABLE %s.%s ADD COLUMN IF NOT EXISTS %s_l3 %s"%(result_table_schema,result_table_name,colum_label,datatype))
+        queries.append("ALTER TABLE %s.%s ADD COLUMN IF NOT EXISTS %s_l4 %s"%(result_table_schema,result_table_name,colum_label,datatype))
+        if dictionary:
+            queries += [label_comment_query(result_table_schema,result_table_name,'%s_l%s'%(colum_label,x),dictionary) for x in range(1,5)]
         print(';\n'.join(queries)+';\n')
         cursor.execute(';\n'.join(queries))
         con.commit()
 
+        # Code of the classification results and its value at each level
+        levels = level_expressions(con, colum_label, dictionary)
+        if parallel:
+            # Update the four columns in one parallel update
+            set_clause = "{c}_l1 = ({l1}), "
+            set_clause += "{c}_l2 = (CASE WHEN {w2} THEN {l2} ELSE {c}_l2 END), "
+            set_clause += "{c}_l3 = (CASE WHEN {w3} THEN {l3} ELSE {c}_l3 END), "
+            set_clause += "{c}_l4 = (CASE WHEN {w4} THEN {l4} ELSE {c}_l4 END)"
+            update_table(con, result_table_schema, result_table_name, set_clause.format(c=colum_label, **levels), parallel=True, **kwargs)
+            cursor.close()
+            print(print_processing_time(begintime, "Creation of columns for 'walousmaj' for different levels achieved in "))
+            return
         # Update table
-        update = "UPDATE {s}.{t} SET {p}_l1 = LEFT({p},1);"
-        query = update.format(s=result_table_schema,t=result_table_name,p=colum_label)
+        update = "UPDATE {s}.{t} SET {c}_l1 = ({l1});"
+        query = update.format(s=result_table_schema,t=result_table_name,c=colum_label,**levels)
         print(query)
         cursor.execute(query)
         con.commit()
-        update = "UPDATE {s}.{t} SET {p}_l2 = LEFT({p},3) WHERE LENGTH({p}) >= 3;"
-        query = update.format(s=result_table_schema,t=result_table_name,p=colum_label)
+        update = "UPDATE {s}.{t} SET {c}_l2 = ({l2}) WHERE {w2};"
+        query = update.format(s=result_table_schema,t=result_table_name,c=colum_label,**levels)
         print(query)
         cursor.execute(query)
         con.commit()
-        update = "UPDATE {s}.{t} SET {p}_l3 = LEFT({p},5) WHERE LENGTH({p}) >= 5;"
-        query = update.format(s=result_table_schema,t=result_table_name,p=colum_label)
+        update = "UPDATE {s}.{t} SET {c}_l3 = ({l3}) WHERE {w3};"
+        query = update.format(s=result_table_schema,t=result_table_name,c=colum_label,**levels)
         print(query)
         cursor.execute(query)
         con.commit()
-        update = "UPDATE {s}.{t} SET {p}_l4 = LEFT({p},7) WHERE LENGTH({p}) >= 7;"
-        query = update.format(s=result_table_schema,t=result_table_name,p=colum_label)
+        update = "UPDATE {s}.{t} SET {c}_l4 = ({l4}) WHERE {w4};"
+        query = update.format(s=result_table_schema,t=result_table_name,c=colum_label,**levels)
         print(query)
         cursor.execute(query)
         con.commit()
@@ -299,7 +589,7 @@ def create_walousmaj_levels(con, result_table_schema, result_table_name, colum_l
 
         
 def create_hilucs_landuse_1(con, result_table_schema, result_table_name, 
-                            cl_truncate, cl_lookup, colum_label="hilucslanduse_1"):
+                            cl_truncate, cl_lookup, colum_label="hilucslanduse_1", parallel=False, dictionary=None, **kwargs):
     '''Function to add a new attribute column with the classification compliant with scenario 1 of
     INSPIRE HILUCS data specification. This function takes as input some lists in parameters that allow ensuring the
     newly created attribute is compliant with INSPIRE HILUCS scheme.
@@ -314,6 +604,10 @@ def create_hilucs_landuse_1(con, result_table_schema, result_table_name,
         cl_lookup (list of tuple of str): Correspondance between codes of the actual legend scheme and their 
         corresponding code in the INSPIRE HILUCS scheme.
         colum_label (str): The name of the attribute to be created. Default value is "hilucslanduse_1".
+        parallel (bool): If True, the update is executed in parallel on ranges of the table (see function 'parallel_update'). Default value is False.
+        dictionary (str): Name of the dictionary table ('schema.table') if the columns with codes are encoded (see function 'encode_table'). 
+        Default value is None (codes stored as text).
+        **kwargs: Options of the parallel update ('connexion_param_dict', 'njobs', 'npartitions', 'key_column', 'retries'), see function 'update_table'.
         
     Returns:
         This function has no return value. 
@@ -331,25 +625,17 @@ def create_hilucs_landuse_1(con, result_table_schema, result_table_name,
         query = 'ALTER TABLE %s.%s DROP COLUMN IF EXISTS %s'%(result_table_schema,result_table_name,colum_label)
         print(query+";\n")
         cursor.execute(query)
-        query = 'ALTER TABLE %s.%s ADD COLUMN IF NOT EXISTS %s text'%(result_table_schema,result_table_name,colum_label)
+        query = 'ALTER TABLE %s.%s ADD COLUMN IF NOT EXISTS %s %s'%(result_table_schema,result_table_name,colum_label,'smallint' if dictionary else 'text')
+        if dictionary:
+            query += ';\n' + label_comment_query(result_table_schema,result_table_name,colum_label,dictionary)
         print(query+";\n")
         cursor.execute(query)
         con.commit()
         # Case when then else end query
-        case_query = "CASE "
-        if cl_truncate:
-            for cl in cl_truncate: # Classes that need to be cuted from one level of detail off, e.g. class 1_1_1_A -> 1_1_1
-                case_query += "WHEN walousmaj = '%s' THEN '%s' "%(cl,'_'.join(cl.split('_')[:-1]))
-        if cl_lookup:
-            for cl_walousmaj, cl_inspire in cl_lookup: # Classes that need to be converted, e.g. 7_1 -> 6_3_1
-                case_query += "WHEN walousmaj = '%s' THEN '%s' "%(cl_walousmaj,cl_inspire)
-        case_query += "ELSE walousmaj END "
+        literals = hilucs_code_literals(con, dictionary, cl_truncate, cl_lookup)
+        case_query = hilucs_code_case('walousmaj', cl_truncate, cl_lookup, literals)
         # Update HilucsLandUse with only classes that exist in the Hilucs legend
-        query = "UPDATE %s.%s "%(result_table_schema,result_table_name)
-        query += "SET %s = (%s) "%(colum_label,case_query)
-        print(query+";\n")
-        cursor.execute(query)
-        con.commit()
+        update_table(con, result_table_schema, result_table_name, "%s = (%s) "%(colum_label,case_query), parallel=parallel, **kwargs)
         # Close connection with database
         cursor.close()
         ## Print processing time
@@ -359,12 +645,13 @@ def create_hilucs_landuse_1(con, result_table_schema, result_table_name,
 
         
 def create_hilucs_landuse_2(con, result_table_schema, result_table_name, cl_ignore, cl_truncate, 
-                            cl_lookup, cl_remove, colum_label="hilucslanduse_2"):
+                            cl_lookup, cl_remove, colum_label="hilucslanduse_2", parallel=False, dictionary=None, **kwargs):
     '''Function to add a new attribute column with the classification compliant with scenario 2 of
     INSPIRE HILUCS data specification. This function takes as input some lists in parameters that allow ensuring the
     newly created attribute is compliant with INSPIRE HILUCS scheme.
     The trick for the distinct value in the array was found here: https://stackoverflow.com/a/57813770/8013239
     The trick for pattern/wildcard searching in array content was found here: https://stackoverflow.com/a/55480601/8013239 
+    The codes are converted with a lookup table '<colum_label>_lookup' created in the schema of the table (see function 'create_hilucs_lookup').
     
     Args: 
         con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or 
@@ -380,6 +667,10 @@ def create_hilucs_landuse_2(con, result_table_schema, result_table_name, cl_igno
         cl_remove (list of str): Codes of the actual legend scheme that should not be present in the newly created
         attribute, if another more detailed sub-level class is present in the all_hilucs attribute.
         colum_label (str): The name of the attribute to be created. Default value is "hilucslanduse_2".
+        parallel (bool): If True, the update is executed in parallel on ranges of the table (see function 'parallel_update'). Default value is False.
+        dictionary (str): Name of the dictionary table ('schema.table') if the columns with codes are encoded (see function 'encode_table'). 
+        Default value is None (codes stored as text).
+        **kwargs: Options of the parallel update ('connexion_param_dict', 'njobs', 'npartitions', 'key_column', 'retries'), see function 'update_table'.
         
     Returns:
         This function has no return value. 
@@ -390,32 +681,17 @@ def create_hilucs_landuse_2(con, result_table_schema, result_table_name, cl_igno
         # Create cursor
         cursor = con.cursor()
         
-        ##### tmp_walousmaj_allhilucs #####
-        ## This column is temporary and used in the creation of the column HilucsLandUse
-        ########################
-        # Add column or replace it if exists
-        query = 'ALTER TABLE %s.%s DROP COLUMN IF EXISTS tmp_walousmaj_allhilucs'%(result_table_schema,result_table_name)
-        print(query+";\n")
-        cursor.execute(query)
-        query = 'ALTER TABLE %s.%s ADD COLUMN IF NOT EXISTS tmp_walousmaj_allhilucs text[]'%(result_table_schema,result_table_name)
-        print(query+";\n")
-        cursor.execute(query)
-        con.commit()
-        # Update column
-        query = "UPDATE %s.%s "%(result_table_schema,result_table_name)
-        query += "SET tmp_walousmaj_allhilucs = (array_prepend(walousmaj::text,all_hilucs))"
-        print(query+";\n")
-        cursor.execute(query)
-        con.commit()
-        
         ##### HilucsLandUse #####
         ## This column will contain only classes that exist in the Hilucs legend, while 
-        # preserving the order of the original array 'tmp_column_walousmaj_allhilucs'
+        # preserving the order of the array made of 'walousmaj' followed by 'all_hilucs'
         ## Classes without any correspondance such as '8_8' will be removed
         ## Classes without an existing higher level hilucs class will be changed, e.g. 5_1_A or 1_1_1_A
         ## Classes only existing in walousmaj but having a correspondance in INSPIRE HILUCS will be converted such as 7_1 -> 6_3_1
         ## In case of coexistence of redundant classes such as '1_1' and '1_1_1', the higher level class will be removed 
+        ## All these changes are done in one pass using a lookup table
         #########################
+        lookup_table = create_hilucs_lookup(con, result_table_schema, cl_ignore, cl_truncate, cl_lookup, cl_remove, 
+                                            lookup_table='%s_lookup'%colum_label)
         # Add column or replace it if exists
         query = 'ALTER TABLE %s.%s DROP COLUMN IF EXISTS %s'%(result_table_schema,result_table_name,colum_label)
         print(query+";\n")
@@ -424,48 +700,202 @@ def create_hilucs_landuse_2(con, result_table_schema, result_table_name, cl_igno
         print(query+";\n")
         cursor.execute(query)
         con.commit()
-        # Case when then else end query
-        case_query = "ARRAY (SELECT CASE "
-        if cl_truncate:
-            for cl in cl_truncate: # Classes that need to be cuted from one level of detail off, e.g. class 1_1_1_A become 1_1_1
-                case_query += "WHEN v = '%s' THEN '%s' "%(cl,'_'.join(cl.split('_')[:-1]))
-        if cl_lookup:
-            for cl_walousmaj, cl_inspire in cl_lookup: # Classes that need to be converted, e.g. 7_1 -> 6_3_1
-                case_query += "WHEN v = '%s' THEN '%s' "%(cl_walousmaj,cl_inspire)
-        case_query += "ELSE v END "
-        case_query += "FROM unnest(tmp_walousmaj_allhilucs) WITH ORDINALITY t(v,ord) "
-        if cl_ignore: 
-            case_query += "WHERE v NOT IN ('%s') "%"','".join(cl_ignore)
-        case_query += "GROUP BY 1 ORDER BY min(ord))"
         # Update HilucsLandUse with array containing only classes that exist in the Hilucs legend
-        query = "UPDATE %s.%s "%(result_table_schema,result_table_name)
-        query += "SET %s = (%s) "%(colum_label,case_query)
-        print(query+";\n")
+        case_query = hilucs_array_lookup('array_prepend((%s)::text,all_hilucs)'%decode_case(con,dictionary,'walousmaj'), lookup_table, ignore=bool(cl_ignore))
+        update_table(con, result_table_schema, result_table_name, "%s = (%s) "%(colum_label,case_query), parallel=parallel, **kwargs)
+        # Drop the lookup table (it can not be temporary, since the parallel update uses other connexions)
+        query = "DROP TABLE %s;"%lookup_table
+        print(query + "\n")
         cursor.execute(query)
         con.commit()
-        # Update HilucsLandUse array to remove classes when sublevels more precise classes exists in the array.
-        subquery = "array_remove({col},'{cl}') WHERE '{cl}' = ANY({col}) AND EXISTS (SELECT 1 FROM unnest({col}) AS a WHERE a LIKE '{cl}_%')"
-        for cl in cl_remove:
-            query = "UPDATE %s.%s "%(result_table_schema,result_table_name)
-            query += "SET %s = %s "%(colum_label,subquery.format(col=colum_label, cl=cl))
-            print(query+";\n")
-            cursor.execute(query)
-        con.commit()
-        ###### tmp_column_walousmaj_allhilucs     
-        # Remove column not needed anymore
-        query = 'ALTER TABLE %s.%s DROP COLUMN IF EXISTS tmp_walousmaj_allhilucs'%(result_table_schema,result_table_name)
-        print(query+";\n")
+        # Close connection with database
+        cursor.close()
+        ## Print processing time
+        print(print_processing_time(begintime, "Creation of INSPIRE compliant 'HilucsLanduse' column achieved in "))
+    except (Exception, psycopg2.DatabaseError) as error:
+        sys.exit(error)
+
+
+def replace_table(con, schema_name, table_name, new_table_name):
+    '''Function to replace a table by a new table with the same columns (and possibly more), e.g. the table created by the function 
+    'derive_postclassification'. The indexes, constraints (primary key included), privileges and comment of the table are created on the new 
+    table, and the views depending on the table (e.g. the decoding view, see function 'create_decoding_view'), with their privileges, are 
+    dropped and created again on the new table. The table is then dropped without CASCADE: if other objects depend on it (e.g. foreign 
+    keys of other tables), the replacement fails. The queries are executed in the current transaction, which should be committed by 
+    the caller, so that the table is replaced completely or not at all. The owner of the new table is the current user.
+    
+    Args: 
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or 
+        using the custom function "create_PG_connexion" with database connexion parameters.
+        schema_name (str): Name of the schema where the tables are located.
+        table_name (str): Name of the table to be replaced.
+        new_table_name (str): Name of the new table, renamed to 'table_name'.
+        
+    Returns:
+        This function has no return value. 
+    '''
+    # Create cursor
+    cursor = con.cursor()
+    relation = '%s.%s'%(schema_name,table_name)
+    # Indexes which are not created by a constraint
+    query = "SELECT pg_get_indexdef(indexrelid) FROM pg_index WHERE indrelid = %s::regclass "
+    query += "AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = indexrelid) ORDER BY indexrelid;"
+    cursor.execute(query, (relation,))
+    queries = [x[0] for x in cursor.fetchall()]
+    # Constraints (NOT NULL constraints are columns properties, lost by CREATE TABLE AS)
+    query = "SELECT format('ALTER TABLE %%s ADD CONSTRAINT %%I %%s', %s, conname, pg_get_constraintdef(oid)) FROM pg_constraint "
+    query += "WHERE conrelid = %s::regclass ORDER BY contype = 'f', oid;"
+    cursor.execute(query, (relation,relation))
+    queries += [x[0] for x in cursor.fetchall()]
+    query = "SELECT format('ALTER TABLE %%s ALTER COLUMN %%I SET NOT NULL', %s, attname) FROM pg_attribute "
+    query += "WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped AND attnotnull ORDER BY attnum;"
+    cursor.execute(query, (relation,relation))
+    queries += [x[0] for x in cursor.fetchall()]
+    # Privileges and comment of the table
+    grant_query = "SELECT format('GRANT %%s ON %%s TO %%s%%s', a.privilege_type, %s, CASE a.grantee WHEN 0 THEN 'PUBLIC' "
+    grant_query += "ELSE quote_ident(pg_get_userbyid(a.grantee)) END, CASE WHEN a.is_grantable THEN ' WITH GRANT OPTION' ELSE '' END) "
+    grant_query += "FROM pg_class AS c, aclexplode(c.relacl) AS a WHERE c.oid = %s::regclass;"
+    cursor.execute(grant_query, (relation,relation))
+    queries += [x[0] for x in cursor.fetchall()]
+    query = "SELECT format('COMMENT ON TABLE %%s IS %%L', %s, obj_description(%s::regclass, 'pg_class')) WHERE obj_description(%s::regclass, 'pg_class') IS NOT NULL;"
+    cursor.execute(query, (relation,relation,relation))
+    queries += [x[0] for x in cursor.fetchall()]
+    # Views depending on the table, and on these views, ordered by depth of dependency
+    query = "WITH RECURSIVE deps(oid, depth) AS ("
+    query += "SELECT r.ev_class, 1 FROM pg_depend AS d JOIN pg_rewrite AS r ON r.oid = d.objid WHERE d.refobjid = %s::regclass AND r.ev_class <> d.refobjid "
+    query += "UNION ALL SELECT r.ev_class, deps.depth + 1 FROM deps JOIN pg_depend AS d ON d.refobjid = deps.oid "
+    query += "JOIN pg_rewrite AS r ON r.oid = d.objid WHERE r.ev_class <> d.refobjid) "
+    query += "SELECT c.oid::regclass::text, c.relkind, pg_get_viewdef(c.oid), obj_description(c.oid, 'pg_class'), max(deps.depth) AS depth "
+    query += "FROM deps JOIN pg_class AS c ON c.oid = deps.oid GROUP BY c.oid ORDER BY depth, c.oid;"
+    cursor.execute(query, (relation,))
+    views = cursor.fetchall()
+    view_queries = []
+    for view, kind, definition, comment, depth in views:
+        view_queries.append("CREATE %s %s AS %s"%('MATERIALIZED VIEW' if kind == 'm' else 'VIEW',view,definition.rstrip().rstrip(';')))
+        if comment is not None:
+            view_queries.append(cursor.mogrify("COMMENT ON %s %s IS %%s"%('MATERIALIZED VIEW' if kind == 'm' else 'VIEW',view), (comment,)).decode())
+        cursor.execute(grant_query, (view,view))
+        view_queries += [x[0] for x in cursor.fetchall()]
+    # Drop the views and the table (without CASCADE), and rename the new table
+    queries = ["DROP %s %s"%('MATERIALIZED VIEW' if kind == 'm' else 'VIEW',view) for view, kind, definition, comment, depth in views[::-1]] + \
+              ["DROP TABLE %s"%relation, "ALTER TABLE %s.%s RENAME TO %s"%(schema_name,new_table_name,table_name)] + queries + view_queries
+    for query in queries:
+        print(query + ";\n")
+        cursor.execute(query)
+    # Close cursor
+    cursor.close()
+    
+
+def derive_postclassification(con, result_table_schema, result_table_name, cl_ignore, cl_truncate, cl_lookup, cl_remove, 
+                              colum_label="walousmaj", colum_hilucs_1="hilucslanduse_1", colum_hilucs_2="hilucslanduse_2", 
+                              subdivide=True, density_thresholds=None, output_table_name=None, dictionary=None):
+    '''Function to compute all the columns derived from the classification results in one rewrite of the table, instead of one or several 
+    updates of the whole table for each function: the subdivision of residential classes (see function 'subdivide_residential_density'), 
+    the columns for each level (see function 'create_walousmaj_levels') and the columns compliant with INSPIRE HILUCS (see functions 
+    'create_hilucs_landuse_1' and 'create_hilucs_landuse_2'). The values are the same as running these functions one after another. 
+    The new table is created with a chain of LATERAL subqueries and replaces the table (see function 'replace_table'), unless 
+    'output_table_name' is provided.
+    
+    Args: 
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or 
+        using the custom function "create_PG_connexion" with database connexion parameters.
+        result_table_schema (str): Name of the schema where the table is located.
+        result_table_name (str): Name of the table with the classification results.
+        cl_ignore (list of str): Codes that should be ignored when creating the column for scenario 2 (see function 'create_hilucs_landuse_2').
+        cl_truncate (list of str): Codes that should be truncated of one level (see function 'create_hilucs_landuse_1').
+        cl_lookup (list of tuple of str): Correspondance between codes of the actual legend scheme and their code in the INSPIRE HILUCS scheme.
+        cl_remove (list of str): Codes that should be removed if a more detailed sub-level code is present (see function 'create_hilucs_landuse_2').
+        colum_label (str): The name of the attribute containing the classification results. Default value is "walousmaj".
+        colum_hilucs_1 (str): The name of the attribute for scenario 1 of INSPIRE HILUCS. Default value is "hilucslanduse_1".
+        colum_hilucs_2 (str): The name of the attribute for scenario 2 of INSPIRE HILUCS. Default value is "hilucslanduse_2".
+        subdivide (bool): Either the residential classes should be subdivided according to the population density (the table should then 
+        contain the column 'rnpp_200m_mode'). Default value is True.
+        density_thresholds (list of tuple of str): Thresholds of population density (see function 'residential_density_case'). Default value is None.
+        output_table_name (str): Name of the table to be created instead of replacing the table. Default value is None.
+        dictionary (str): Name of the dictionary table ('schema.table') if the columns with codes are encoded (see function 'encode_table'). 
+        The new columns with codes are then encoded too. Default value is None (codes stored as text).
+        
+    Returns:
+        This function has no return value. 
+    ''' 
+    try:
+        # Time at starting
+        begintime = time.time() 
+        # Create cursor
+        cursor = con.cursor()
+        # Columns of the table
+        query = "SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute WHERE attrelid = '%s.%s'::regclass "%(result_table_schema,result_table_name)
+        query += "AND attnum > 0 AND NOT attisdropped ORDER BY attnum;"
+        cursor.execute(query)
+        columns = cursor.fetchall()
+        names = [x[0] for x in columns]
+        levels = [('%s_l1'%colum_label, 1), ('%s_l2'%colum_label, 3), ('%s_l3'%colum_label, 5), ('%s_l4'%colum_label, 7)]
+        lookup_table = create_hilucs_lookup(con, result_table_schema, cl_ignore, cl_truncate, cl_lookup, cl_remove, 
+                                            lookup_table='%s_lookup'%colum_hilucs_2)
+        # Chain of derived values. 'OFFSET 0' prevents the subqueries to be merged in the main query, which would copy the 
+        # expression of each value in the expression of the next one
+        # The labels stay encoded (if a dictionary is given) and are compared with the identifiers of the codes
+        lateral = []
+        if subdivide:
+            literals = residential_density_literals(con, dictionary, density_thresholds)
+            lateral.append("LATERAL (SELECT (%s) AS label OFFSET 0) AS d"%residential_density_case('t.%s'%colum_label, density_thresholds, literals))
+        else:
+            lateral.append("LATERAL (SELECT t.%s AS label OFFSET 0) AS d"%colum_label)
+        literals = hilucs_code_literals(con, dictionary, cl_truncate, cl_lookup)
+        lateral.append("LATERAL (SELECT (%s) AS value) AS h1"%hilucs_code_case('d.label', cl_truncate, cl_lookup, literals))
+        lateral.append("LATERAL (SELECT (%s) AS value) AS h2"%hilucs_array_lookup('array_prepend((%s)::text,t.all_hilucs)'%decode_case(con,dictionary,'d.label'), 
+                                                                                  lookup_table, ignore=bool(cl_ignore)))
+        # Level columns: the first level is always updated, the others only if the code is long enough
+        expressions = level_expressions(con, 'd.label', dictionary)
+        level_expression = {}
+        for i, (name, length) in enumerate(levels, 1):
+            if length == 1:
+                level_expression[name] = "(%s)"%expressions['l1']
+            else:
+                level_expression[name] = "(CASE WHEN %s THEN %s ELSE %s END)"%(expressions['w%s'%i],expressions['l%s'%i],
+                                                                              't."%s"'%name if name in names else 'NULL')
+        # Columns of the new table, in the order given by the functions run one after another
+        select = []
+        for name, datatype in columns:
+            if name == colum_label:
+                select.append('CAST(d.label AS %s) AS "%s"'%(datatype,name))
+            elif name in level_expression:
+                select.append('CAST(%s AS %s) AS "%s"'%(level_expression[name],datatype,name))
+            elif name not in (colum_hilucs_1, colum_hilucs_2, 'tmp_walousmaj_allhilucs'):
+                select.append('t."%s"'%name)
+        datatype = 'smallint' if dictionary else 'character varying'
+        select += ['CAST(%s AS %s) AS "%s"'%(level_expression[name],datatype,name) for name, length in levels if name not in names]
+        select.append('CAST(h1.value AS %s) AS "%s"'%('smallint' if dictionary else 'text',colum_hilucs_1))
+        select.append('CAST(h2.value AS text[]) AS "%s"'%colum_hilucs_2)
+        target = output_table_name if output_table_name else '%s_derived'%result_table_name
+        query = "DROP TABLE IF EXISTS %s.%s;"%(result_table_schema,target)
+        print(query + "\n")
         cursor.execute(query)
+        query = "CREATE TABLE %s.%s AS (SELECT %s FROM %s.%s AS t, %s);"%(result_table_schema,target,", ".join(select),
+                                                                        result_table_schema,result_table_name,", ".join(lateral))
+        print(query + "\n")
+        cursor.execute(query)
+        query = "DROP TABLE %s;"%lookup_table
+        print(query + "\n")
+        cursor.execute(query)
+        # Comments of the columns, used to decode the encoded columns
+        copy_column_comments(con, result_table_schema, result_table_name, result_table_schema, target)
+        if dictionary:
+            for name in [x[0] for x in levels] + [colum_label, colum_hilucs_1]:
+                cursor.execute(label_comment_query(result_table_schema,target,name,dictionary))
+        if not output_table_name:
+            # Replace the table, in the same transaction as its creation
+            replace_table(con, result_table_schema, result_table_name, target)
         con.commit()
         # Close connection with database
         cursor.close()
         ## Print processing time
-        print(print_processing_time(begintime, "Creation of INSPIRE compliant 'HilucsLanduse' column achieved in "))
+        print(print_processing_time(begintime, "Derivation of postclassification columns achieved in "))
     except (Exception, psycopg2.DatabaseError) as error:
         sys.exit(error)
     
         
-def create_cuswall_table(con, result_schema, result_table, uncad_schema, uncad_table, output_table='cusw2018_all'):
+def create_cuswall_table(con, result_schema, result_table, uncad_schema, uncad_table, output_table='cusw2018_all', partitioned=False, **kwargs):
     '''Function to create a new table containing cadastred and uncadastred spaces together. 
     
     Args: 
@@ -476,6 +906,17 @@ def create_cuswall_table(con, result_schema, result_table, uncad_schema, uncad_t
         uncad_schema (str): Name of the schema where the table with uncadastred geometries is located.
         uncad_table (str): Name of the table with uncadastred geometries.
         output_table (str): Name of the table with uncadastred geometries. Default value is 'cusw2018_all'.
+        partitioned (bool): If True, the table is created as a table partitioned by cadastral division (see function 'create_partitioned_table'), 
+        so that the queries on a part of the region only scan the corresponding partitions. Default value is False.
+        **kwargs: Options of the partitioned table:
+            'partition_expression' (str): Expression defining the partitions. Default value is 'LEFT(capakey,5)' (cadastral division).
+            'subpartition_expression' (str): Expression defining the sub-partitions, e.g. 'walousmaj_l1' (level 1 of the classification, 
+            see function 'create_walousmaj_levels'). Default value is None.
+            'index_columns' (list of str): Columns to be indexed on each partition (see function 'create_partition_indexes'). Default value is None.
+            'njobs' (int): Number of parallel jobs used to fill the table and create the indexes. 'connexion_param_dict' should be provided too.
+            'connexion_param_dict' (dict): A dictionnary containing informations for connection to the database, used by each parallel job (see function "create_pg_connexion").
+        The uncadastred geometries, without 'capakey', are stored in the DEFAULT partition.
+        If the 'cusw' table is encoded (see function 'encode_table'), the codes and proportions of the uncadastred geometries are converted.
         
     Returns:
         This function has no return value. 
@@ -485,21 +926,37 @@ def create_cuswall_table(con, result_schema, result_table, uncad_schema, uncad_t
         begintime = time.time() 
         # Create cursor
         cursor = con.cursor()
-        # Create new table as a copy of result table
-        queries = []
-        queries.append("DROP TABLE IF EXISTS %s.%s"%(result_schema,output_table))
-        queries.append("CREATE TABLE IF NOT EXISTS %s.%s AS (SELECT * FROM %s.%s)"%(result_schema,output_table,result_schema,result_table))
-        print(';\n'.join(queries)+';\n')
-        cursor.execute(';\n'.join(queries))
-        con.commit()
+        njobs = int(kwargs.get('njobs', 1))
+        if partitioned:
+            # Create new partitioned table as a copy of result table
+            conditions = get_key_ranges(con, result_schema, result_table, 'capakey', njobs) if njobs > 1 else ["TRUE"]
+            subquery = 'SELECT *, NULL::integer AS uncadastr_id FROM %s.%s {where}'%(result_schema,result_table)
+            create_partitioned_table(con, kwargs.get('connexion_param_dict'), result_schema, output_table, subquery, conditions, njobs, 
+                                     kwargs.get('partition_expression', "LEFT(capakey,5)"), kwargs.get('subpartition_expression'), 
+                                     key_table='%s.%s'%(result_schema,result_table))
+        else:
+            # Create new table as a copy of result table
+            queries = []
+            queries.append("DROP TABLE IF EXISTS %s.%s"%(result_schema,output_table))
+            queries.append("CREATE TABLE IF NOT EXISTS %s.%s AS (SELECT * FROM %s.%s)"%(result_schema,output_table,result_schema,result_table))
+            print(';\n'.join(queries)+';\n')
+            cursor.execute(';\n'.join(queries))
+            con.commit()
         # Add column to store uncadastred geometries ID and INSERT query
         queries = []
         queries.append("ALTER TABLE %s.%s ADD COLUMN IF NOT EXISTS uncadastr_id integer"%(result_schema,output_table))
-        queries.append("INSERT INTO %s.%s(geom,lc_mode,lc_prop_1,lc_prop_2,lc_prop_3,lc_prop_4,lc_prop_5,lc_prop_6,lc_prop_7,lc_prop_8,lc_prop_9,lc_prop_80,lc_prop_90,walousmaj,hilucslanduse_1,hilucslanduse_2,walousmaj_l1,walousmaj_l2,walousmaj_l3,walousmaj_l4,uncadastr_id) SELECT ST_Multi(ST_CollectionExtract(geom,3)) \
-        as geom,lc_mode,lc_prop_1,lc_prop_2,lc_prop_3,lc_prop_4,lc_prop_5,lc_prop_6,lc_prop_7,lc_prop_8,lc_prop_9,lc_prop_80,lc_prop_90,walousmaj,hilucslanduse_1,hilucslanduse_2,walousmaj_l1,walousmaj_l2,walousmaj_l3,walousmaj_l4, uncadastr_id FROM %s.%s"%(result_schema,output_table,uncad_schema,uncad_table))
+        # Values of the uncadastred geometries converted to the storage of the columns if the table is encoded (see function 'encode_table')
+        copy_column_comments(con, result_schema, result_table, result_schema, output_table)
+        insert_columns = ['lc_mode','lc_prop_1','lc_prop_2','lc_prop_3','lc_prop_4','lc_prop_5','lc_prop_6','lc_prop_7','lc_prop_8','lc_prop_9','lc_prop_80','lc_prop_90',
+                          'walousmaj','hilucslanduse_1','hilucslanduse_2','walousmaj_l1','walousmaj_l2','walousmaj_l3','walousmaj_l4']
+        queries.append("INSERT INTO %s.%s(geom,%s,uncadastr_id) SELECT ST_Multi(ST_CollectionExtract(geom,3)) \
+        as geom,%s, uncadastr_id FROM %s.%s"%(result_schema,output_table,','.join(insert_columns),
+                                              ','.join(encoded_columns(con, result_schema, output_table, insert_columns, '%s.%s'%(uncad_schema,uncad_table))),uncad_schema,uncad_table))
         print(';\n'.join(queries)+';\n')
         cursor.execute(';\n'.join(queries))
         con.commit()
+        if partitioned and kwargs.get('index_columns'):
+            create_partition_indexes(con, kwargs.get('connexion_param_dict'), result_schema, output_table, kwargs['index_columns'], njobs)
         # Close connection with database
         cursor.close()
         ## Print processing time
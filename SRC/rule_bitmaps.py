@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+"""
+WALOUS_UTS - Copyright (C) <2020> <Service Public de Wallonie (SWP), Belgique,
+					          		Institut Scientifique de Service Public (ISSeP), Belgique,
+									Université catholique de Louvain (UCLouvain), Belgique,
+									Université Libre de Bruxelles (ULB), Belgique>
+						 							
+	
+List of the contributors to the development of WALOUS_UTS: see LICENSE file.
+Description and complete License: see LICENSE file.
+	
+This program (WALOUS_UTS) is free software:
+you can redistribute it and/or modify it under the terms of the
+GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option)
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program (see COPYING file).  If not,
+see <http://www.gnu.org/licenses/>.
+"""
+
+
+import sys
+import json
+import time
+import zlib
+import numpy as np
+import psycopg2
+from processing_time import print_processing_time
+from postgres_geom import table_fingerprint
+from rule_engine import TOKEN_PATTERN, check_rule_parity
+
+## Bitmaps of the statistics tables loaded in memory, by (schema, table, key column)
+bitmap_cache = {}
+
+
+def split_conjunction(expression):
+    """Function to split a condition into the atomic conditions combined with AND at its top level, e.g. "a > 0.5 AND (b = 1 OR c = 2)"
+    gives "a > 0.5" and "(b = 1 OR c = 2)". The parentheses enclosing the whole condition are removed and the AND of a BETWEEN are not used.
+    As AND has precedence over OR, a condition with an OR at its top level (e.g. "a > 1 AND b = 2 OR c = 3") is not split.
+
+    Args:
+        expression (str): The SQL condition.
+
+    Returns:
+        list of str: List of the atomic conditions, as written in the condition.
+    """
+    expression = expression.strip()
+    atoms = []
+    depth = 0
+    between = False
+    start = 0
+    position = 0
+    outer = True
+    disjunction = False
+    while position < len(expression):
+        match = TOKEN_PATTERN.match(expression, position)
+        if not match or match.end() == position:
+            # Unsupported syntax: the condition is used as a whole
+            return [expression]
+        kind = match.lastgroup
+        value = match.group(kind)
+        if value in ('(', '['):
+            depth += 1
+        elif value in (')', ']'):
+            depth -= 1
+            if depth == 0 and match.end() < len(expression.rstrip()):
+                outer = False
+        elif depth == 0 and kind == 'id' and value.upper() == 'OR':
+            disjunction = True
+        elif depth == 0 and kind == 'id' and value.upper() == 'BETWEEN':
+            between = True
+        elif depth == 0 and kind == 'id' and value.upper() == 'AND':
+            if between:
+                between = False
+            else:
+                atoms.append(expression[start:match.start()].strip())
+                start = match.end()
+        if depth == 0 and kind != 'op':
+            outer = False
+        position = match.end()
+    atoms.append(expression[start:].strip())
+    if disjunction:
+        # The condition is used as a whole
+        return [expression]
+    if len(atoms) == 1 and outer and expression.startswith('(') and expression.endswith(')'):
+        return split_conjunction(expression[1:-1])
+    return atoms
+
+
+def pack_bitmap(values):
+    """Function to compress a boolean array into a bitmap.
+
+    Args:
+        values (numpy array): Boolean array.
+
+    Returns:
+        bytes: The bitmap, compressed with zlib.
+    """
+    return zlib.compress(np.packbits(values).tobytes())
+
+
+def unpack_bitmap(data, n):
+    """Function to decompress a bitmap created with 'pack_bitmap'.
+
+    Args:
+        data (bytes): The compressed bitmap.
+        n (int): Number of values in the bitmap.
+
+    Returns:
+        numpy array: Boolean array.
+    """
+    return np.unpackbits(np.frombuffer(zlib.decompress(bytes(data)), dtype=np.uint8))[:n].astype(bool)
+
+
+def then_constant(expression):
+    """Function to get the label of a classification rule if it is a constant, e.g. "'6_2'".
+
+    Args:
+        expression (str): The 'then' part of a classification rule.
+
+    Returns:
+        str: The label, or None if the expression is not a string constant.
+    """
+    expression = expression.strip()
+    match = TOKEN_PATTERN.match(expression)
+    if match and match.lastgroup == 'str' and match.end() == len(expression):
+        return match.group('str')[1:-1].replace("''", "'")
+    return None
+
+
+def load_bitmaps(con, stats_table_schema, stats_table_name, list_rules, key_column='capakey', cache_schema=None, cache_table='rule_bitmaps', 
+                 atoms_per_query=20, refresh=False):
+    """Function to get the bitmaps of the atomic conditions of a list of classification rules (see function 'split_conjunction'), i.e. for each 
+    row of the statistics table ordered by the key column, if the condition is true. The values of the 'then' parts which are not constant 
+    are loaded too. Each distinct atomic condition is evaluated only once: the bitmaps are stored in a cache table with the fingerprint of 
+    the statistics table (see function 'table_fingerprint') and kept in memory (see 'bitmap_cache'). The missing conditions are evaluated 
+    together on the server, 'atoms_per_query' conditions by scan of the table. The fingerprint is computed only once per session (at the 
+    first call for the table, or if 'refresh' is True): the statistics table is supposed not to change between the calls.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        stats_table_schema (str): Name of the schema where to find the table containing all statistics used in the classification rules.
+        stats_table_name (str): Name of the table containing all statistics used in the classification rules.
+        list_rules (list of tupple): List of tuples containing the classification rules (see function 'decision_tree_classification').
+        key_column (str): Name of the column with unique id of the rows. Default value is 'capakey'.
+        cache_schema (str): Name of the schema of the cache table. Default value is None and the schema of the statistics table is used.
+        cache_table (str): Name of the cache table. Default value is 'rule_bitmaps'.
+        atoms_per_query (int): Maximum number of conditions evaluated by scan of the statistics table. Default value is 20.
+        refresh (bool): Either the fingerprint of the statistics table should be computed again, e.g. after changing the table. If it changed, 
+        the bitmaps kept in memory are discarded. Default value is False.
+
+    Returns:
+        dict: The bitmaps of the table, with the list of keys ('key'), the number of rows ('n'), the fingerprint ('fingerprint'), the boolean array
+        of each atomic condition ('atoms') and the values of each 'then' expression ('values').
+    """
+    try:
+        begintime = time.time()
+        if not cache_schema:
+            cache_schema = stats_table_schema
+        table = '%s.%s'%(stats_table_schema, stats_table_name)
+        cache_key = (stats_table_schema, stats_table_name, key_column)
+        # Fingerprint of the table, computed once per session
+        if cache_key not in bitmap_cache or refresh:
+            fingerprint = table_fingerprint(con, stats_table_schema, stats_table_name)
+            if cache_key not in bitmap_cache or bitmap_cache[cache_key]['fingerprint'] != fingerprint:
+                bitmap_cache[cache_key] = {'key': None, 'n': 0, 'fingerprint': fingerprint, 'atoms': {}, 'values': {}}
+        fingerprint = bitmap_cache[cache_key]['fingerprint']
+        cache = bitmap_cache[cache_key]
+        atoms = set()
+        [atoms.update(split_conjunction(when)) for when, then in list_rules]
+        values = set([then.strip() for when, then in list_rules if then_constant(then) is None])
+        cursor = con.cursor()
+        # Create the cache table if needed
+        query = "CREATE TABLE IF NOT EXISTS {schema}.{cache} (stats_table text, fingerprint text, kind text, expression text, nrows integer, "
+        query += "data bytea, created_at timestamp DEFAULT now(), PRIMARY KEY (stats_table, fingerprint, kind, expression));"
+        cursor.execute(query.format(schema=cache_schema, cache=cache_table))
+        # Read the entries of the cache table not yet in memory
+        wanted = [('key', key_column)] if cache['key'] is None else []
+        wanted += [('atom', x) for x in sorted(atoms) if x not in cache['atoms']]
+        wanted += [('value', x) for x in sorted(values) if x not in cache['values']]
+        if wanted:
+            query = "SELECT kind, expression, nrows, data FROM {schema}.{cache} WHERE stats_table = %s AND fingerprint = %s "
+            query += "AND (kind, expression) IN (SELECT * FROM unnest(%s::text[], %s::text[]));"
+            cursor.execute(query.format(schema=cache_schema, cache=cache_table), (table, fingerprint, [x[0] for x in wanted], [x[1] for x in wanted]))
+            for kind, expression, nrows, data in cursor.fetchall():
+                if kind == 'key':
+                    cache['key'] = json.loads(zlib.decompress(bytes(data)).decode())
+                    cache['n'] = nrows
+                elif kind == 'atom':
+                    cache['atoms'][expression] = unpack_bitmap(data, nrows)
+                else:
+                    cache['values'][expression] = json.loads(zlib.decompress(bytes(data)).decode())
+        new_entries = []
+        # Keys of the rows
+        if cache['key'] is None:
+            query = "SELECT array_agg({key}::text ORDER BY {key}) FROM {table};".format(key=key_column, table=table)
+            print(query + "\n")
+            cursor.execute(query)
+            cache['key'] = cursor.fetchone()[0] or []
+            cache['n'] = len(cache['key'])
+            new_entries.append(('key', key_column, cache['n'], zlib.compress(json.dumps(cache['key']).encode())))
+        # Atomic conditions not yet evaluated
+        missing = sorted([x for x in atoms if x not in cache['atoms']])
+        for i in range(0, len(missing), max(int(atoms_per_query),1)):
+            batch = missing[i:i+max(int(atoms_per_query),1)]
+            query = "SELECT %s FROM %s;"%(", ".join(["string_agg(CASE WHEN %s THEN '1' ELSE '0' END, '' ORDER BY %s)"%(x,key_column) for x in batch]), table)
+            print(query + "\n")
+            cursor.execute(query)
+            for atom, bits in zip(batch, cursor.fetchone()):
+                cache['atoms'][atom] = np.frombuffer((bits or '').encode(), dtype=np.uint8) == ord('1')
+                new_entries.append(('atom', atom, cache['n'], pack_bitmap(cache['atoms'][atom])))
+        # 'Then' expressions not yet evaluated
+        missing = sorted([x for x in values if x not in cache['values']])
+        for i in range(0, len(missing), max(int(atoms_per_query),1)):
+            batch = missing[i:i+max(int(atoms_per_query),1)]
+            query = "SELECT %s FROM %s;"%(", ".join(["array_agg((%s)::varchar ORDER BY %s)"%(x,key_column) for x in batch]), table)
+            print(query + "\n")
+            cursor.execute(query)
+            for value, data in zip(batch, cursor.fetchone()):
+                cache['values'][value] = data or []
+                new_entries.append(('value', value, cache['n'], zlib.compress(json.dumps(cache['values'][value]).encode())))
+        # Store the new entries in the cache table
+        if new_entries:
+            query = "DELETE FROM {schema}.{cache} WHERE stats_table = %s AND fingerprint <> %s;"
+            cursor.execute(query.format(schema=cache_schema, cache=cache_table), (table, fingerprint))
+            query = "INSERT INTO {schema}.{cache} (stats_table, fingerprint, kind, expression, nrows, data) VALUES (%s, %s, %s, %s, %s, %s) "
+            query += "ON CONFLICT DO NOTHING;"
+            [cursor.execute(query.format(schema=cache_schema, cache=cache_table), (table, fingerprint) + x[:3] + (psycopg2.Binary(x[3]),)) for x in new_entries]
+        con.commit()
+        cursor.close()
+        print(print_processing_time(begintime, "Bitmaps of %s conditions loaded (%s evaluated) in "%(len(atoms), len([x for x in new_entries if x[0] == 'atom']))))
+        return cache
+    except (Exception, psycopg2.DatabaseError) as error:
+        sys.exit(error)
+
+
+def evaluate_rule_set(bitmaps, list_rules):
+    """Function to classify the rows with a list of classification rules using only the bitmaps returned by the function 'load_bitmaps', 
+    without any access to the database. The result is the same as with the function 'decision_tree_classification'.
+
+    Args:
+        bitmaps (dict): The bitmaps of the statistics table returned by the function 'load_bitmaps' for these rules.
+        list_rules (list of tupple): List of tuples containing the classification rules (see function 'decision_tree_classification').
+
+    Returns:
+        dict: The list of keys ('key') and the arrays of labels ('label') and of the number of the rule classifying each row ('leaf').
+    """
+    n = bitmaps['n']
+    label = np.empty(n, dtype=object)
+    label[:] = '6_6_A'
+    leaf = np.full(n, len(list_rules) + 1, dtype=np.int64)
+    remaining = np.ones(n, dtype=bool)
+    for i, (when, then) in enumerate(list_rules, 1):
+        mask = remaining.copy()
+        for atom in split_conjunction(when):
+            mask &= bitmaps['atoms'][atom]
+        if mask.any():
+            constant = then_constant(then)
+            if constant is not None:
+                label[mask] = constant
+            else:
+                label[mask] = np.array(bitmaps['values'][then.strip()], dtype=object)[mask]
+            leaf[mask] = i
+        remaining &= ~mask
+    return {'key': bitmaps['key'], 'label': label, 'leaf': leaf}
+
+
+def compare_rule_sets(con, stats_table_schema, stats_table_name, list_rules_a, list_rules_b, key_column='capakey', max_examples=10, **kwargs):
+    """Function to compare the classification of the rows with two lists of classification rules, e.g. two versions of the decision tree.
+    Only the atomic conditions which are not already in the cache are evaluated on the database (see function 'load_bitmaps'): the 
+    comparison of rule sets sharing most of their conditions is done in memory. The number of rows for each change of label and 
+    examples of rows changing of label are printed.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        stats_table_schema (str): Name of the schema where to find the table containing all statistics used in the classification rules.
+        stats_table_name (str): Name of the table containing all statistics used in the classification rules.
+        list_rules_a (list of tupple): First list of classification rules (see function 'decision_tree_classification').
+        list_rules_b (list of tupple): Second list of classification rules.
+        key_column (str): Name of the column with unique id of the rows. Default value is 'capakey'.
+        max_examples (int): Maximum number of examples of rows changing of label to be printed. Default value is 10.
+        **kwargs: 'cache_schema', 'cache_table', 'atoms_per_query' and 'refresh' are passed to the function 'load_bitmaps'.
+
+    Returns:
+        dict: The keys of the rows changing of label ('key'), their label with each list of rules ('label_a', 'label_b') and the number of rows
+        for each change of label ('changes', a dictionnary with (label_a, label_b) as keys).
+    """
+    begintime = time.time()
+    bitmaps = load_bitmaps(con, stats_table_schema, stats_table_name, list(list_rules_a) + list(list_rules_b), key_column, **kwargs)
+    result_a = evaluate_rule_set(bitmaps, list_rules_a)
+    result_b = evaluate_rule_set(bitmaps, list_rules_b)
+    changed = np.array([a != b for a, b in zip(result_a['label'], result_b['label'])], dtype=bool)
+    keys = np.array(bitmaps['key'], dtype=object)[changed]
+    label_a = result_a['label'][changed]
+    label_b = result_b['label'][changed]
+    changes = {}
+    for a, b in zip(label_a, label_b):
+        changes[(a, b)] = changes.get((a, b), 0) + 1
+    print("%s rows out of %s change of label"%(len(keys), bitmaps['n']))
+    [print("%12s -> %-12s %s"%(a, b, count)) for (a, b), count in sorted(changes.items(), key=lambda x: -x[1])]
+    [print("Example: %s %s -> %s"%(k, a, b)) for k, a, b in list(zip(keys, label_a, label_b))[:max_examples]]
+    print(print_processing_time(begintime, "Comparison of rule sets achieved in "))
+    return {'key': list(keys), 'label_a': list(label_a), 'label_b': list(label_b), 'changes': changes}
+
+
+def check_bitmap_parity(con, stats_table_schema, stats_table_name, list_rules, key_column='capakey', max_examples=10, **kwargs):
+    """Function to check that the evaluation of the rules with the bitmaps (function 'evaluate_rule_set') gives the same results as PostgreSQL 
+    (function 'decision_tree_classification'), see function 'check_rule_parity'.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        stats_table_schema (str): Name of the schema where to find the table containing all statistics used in the classification rules.
+        stats_table_name (str): Name of the table containing all statistics used in the classification rules.
+        list_rules (list of tupple): List of tuples containing the classification rules.
+        key_column (str): Name of the column with unique id of the rows. Default value is 'capakey'.
+        max_examples (int): Maximum number of rows with differences to be printed. Default value is 10.
+        **kwargs: 'cache_schema', 'cache_table', 'atoms_per_query' and 'refresh' are passed to the function 'load_bitmaps'.
+
+    Returns:
+        int: The number of rows with differences.
+    """
+    bitmaps = load_bitmaps(con, stats_table_schema, stats_table_name, list_rules, key_column, **kwargs)
+    return check_rule_parity(con, stats_table_schema, stats_table_name, list_rules, key_column, results=evaluate_rule_set(bitmaps, list_rules), 
+                             max_examples=max_examples)
@@ -0,0 +1,670 @@
+#!/usr/bin/env python
+"""
+WALOUS_UTS - Copyright (C) <2020> <Service Public de Wallonie (SWP), Belgique,
+					          		Institut Scientifique de Service Public (ISSeP), Belgique,
+									Université catholique de Louvain (UCLouvain), Belgique,
+									Université Libre de Bruxelles (ULB), Belgique>
+						 							
+	
+List of the contributors to the development of WALOUS_UTS: see LICENSE file.
+Description and complete License: see LICENSE file.
+	
+This program (WALOUS_UTS) is free software:
+you can redistribute it and/or modify it under the terms of the
+GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option)
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program (see COPYING file).  If not,
+see <http://www.gnu.org/licenses/>.
+"""
+
+
+import io
+import re
+import sys
+import time
+import numpy as np
+import psycopg2
+from processing_time import print_processing_time
+from postgres_classification import decision_tree_select
+
+## Columns of the statistics tables loaded in memory, by (schema, table, key column)
+column_cache = {}
+
+## Array columns exploded in one value by element (see function 'explode_array'), by id of the data of the column
+exploded_cache = {}
+
+KEYWORDS = ('AND', 'OR', 'NOT', 'IS', 'NULL', 'TRUE', 'FALSE', 'IN', 'LIKE', 'ILIKE', 'ANY', 'ALL', 'SOME')
+TOKEN_PATTERN = re.compile(r"\s*(?:(?P<num>\d+\.\d*|\.\d+|\d+)|(?P<str>'(?:[^']|'')*')|(?P<qid>\"(?:[^\"]|\"\")+\")|(?P<id>[A-Za-z_][A-Za-z0-9_\.]*)|(?P<op><>|!=|<=|>=|::|[=<>+\-*/(),\[\]]))")
+
+
+def tokenize(expression):
+    """Function to split a SQL expression into tokens.
+
+    Args:
+        expression (str): The SQL expression, e.g. "Cardinality(all_hilucs) = 1 AND all_hilucs[1] = '8_8'".
+
+    Returns:
+        list of tuple: List of tokens as tuples (type, value), the type being 'num', 'str', 'id', 'kw' or 'op'.
+    """
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = TOKEN_PATTERN.match(expression, position)
+        if not match or match.end() == position:
+            raise ValueError("Unsupported syntax in rule '%s' at position %s"%(expression, position))
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'str':
+            tokens.append(('str', value[1:-1].replace("''", "'")))
+        elif kind == 'qid':
+            tokens.append(('id', value[1:-1].replace('""', '"')))
+        elif kind == 'id' and value.upper() in KEYWORDS:
+            tokens.append(('kw', value.upper()))
+        elif kind == 'id':
+            # Unquoted identifiers are case insensitive in PostgreSQL
+            tokens.append(('id', value.lower()))
+        else:
+            tokens.append((kind, value))
+    return tokens
+
+
+def parse_expression(expression):
+    """Function to translate a SQL expression of a classification rule into a tree which can be evaluated by the function 'evaluate'.
+    The subset of SQL supported is: comparisons (=, <>, !=, <, <=, >, >=), arithmetic (+, -, *, / with the integer division of PostgreSQL 
+    when both operands are integers), AND, OR, NOT, parentheses, 
+    IS [NOT] NULL, IS [NOT] TRUE/FALSE, [NOT] IN (...), [NOT] LIKE/ILIKE, comparisons with ANY/ALL of an array, Cardinality() and 
+    subscripts of arrays (e.g. all_hilucs[1]), casts (::numeric, ::text...) and other functions of columns (e.g. ST_AREA(geom)), 
+    which are computed by PostgreSQL when the columns are loaded.
+
+    Args:
+        expression (str): The SQL expression.
+
+    Returns:
+        tuple: The tree of the expression.
+    """
+    tokens = tokenize(expression)
+    position = [0]
+
+    def peek(offset=0):
+        if position[0] + offset < len(tokens):
+            return tokens[position[0] + offset]
+        return (None, None)
+
+    def take(kind=None, value=None):
+        token = peek()
+        if (kind and token[0] != kind) or (value and token[1] != value):
+            raise ValueError("Unsupported syntax in rule '%s': expected %s, found %s"%(expression, value or kind, token[1]))
+        position[0] += 1
+        return token
+
+    def parse_or():
+        node = parse_and()
+        while peek() == ('kw', 'OR'):
+            take()
+            node = ('or', node, parse_and())
+        return node
+
+    def parse_and():
+        node = parse_not()
+        while peek() == ('kw', 'AND'):
+            take()
+            node = ('and', node, parse_not())
+        return node
+
+    def parse_not():
+        if peek() == ('kw', 'NOT'):
+            take()
+            return ('not', parse_not())
+        return parse_predicate()
+
+    def parse_predicate():
+        node = parse_additive()
+        token = peek()
+        if token[0] == 'op' and token[1] in ('=', '<>', '!=', '<', '<=', '>', '>='):
+            take()
+            operator = '<>' if token[1] == '!=' else token[1]
+            if peek()[0] == 'kw' and peek()[1] in ('ANY', 'SOME', 'ALL'):
+                quantifier = 'all' if take()[1] == 'ALL' else 'any'
+                take('op', '(')
+                array = parse_or()
+                take('op', ')')
+                return ('quantified', operator, quantifier, node, array)
+            return ('compare', operator, node, parse_additive())
+        if token == ('kw', 'IS'):
+            take()
+            negate = False
+            if peek() == ('kw', 'NOT'):
+                take()
+                negate = True
+            value = take('kw')[1]
+            if value == 'NULL':
+                return ('isnull', node, negate)
+            if value in ('TRUE', 'FALSE'):
+                return ('istrue', node, value == 'TRUE', negate)
+            raise ValueError("Unsupported syntax in rule '%s': IS %s"%(expression, value))
+        negate = False
+        if token == ('kw', 'NOT') and peek(1)[0] == 'kw' and peek(1)[1] in ('IN', 'LIKE', 'ILIKE'):
+            take()
+            negate = True
+            token = peek()
+        if token == ('kw', 'IN'):
+            take()
+            take('op', '(')
+            items = [parse_additive()]
+            while peek() == ('op', ','):
+                take()
+                items.append(parse_additive())
+            take('op', ')')
+            return ('in', node, items, negate)
+        if token[0] == 'kw' and token[1] in ('LIKE', 'ILIKE'):
+            take()
+            pattern = take('str')[1]
+            return ('like', node, pattern, negate, token[1] == 'ILIKE')
+        return node
+
+    def parse_additive():
+        node = parse_term()
+        while peek()[0] == 'op' and peek()[1] in ('+', '-'):
+            node = ('arith', take()[1], node, parse_term())
+        return node
+
+    def parse_term():
+        node = parse_factor()
+        while peek()[0] == 'op' and peek()[1] in ('*', '/'):
+            node = ('arith', take()[1], node, parse_factor())
+        return node
+
+    def parse_factor():
+        token = take()
+        if token == ('op', '-'):
+            node = ('arith', '-', ('literal', 'num', 0), parse_factor())
+        elif token == ('op', '('):
+            node = parse_or()
+            take('op', ')')
+        elif token[0] == 'num':
+            # Literals without decimal point are integers, as in PostgreSQL
+            node = ('literal', 'num', float(token[1]) if '.' in token[1] else int(token[1]))
+        elif token[0] == 'str':
+            node = ('literal', 'text', token[1])
+        elif token[0] == 'kw' and token[1] in ('TRUE', 'FALSE'):
+            node = ('literal', 'bool', token[1] == 'TRUE')
+        elif token == ('kw', 'NULL'):
+            node = ('literal', 'null', None)
+        elif token[0] == 'id' and peek() == ('op', '('):
+            take()
+            arguments = []
+            if peek() != ('op', ')'):
+                arguments.append(parse_or())
+                while peek() == ('op', ','):
+                    take()
+                    arguments.append(parse_or())
+            take('op', ')')
+            if token[1] == 'cardinality':
+                node = ('cardinality', arguments[0])
+            elif all([x[0] == 'column' for x in arguments]):
+                # Other functions of columns are computed by PostgreSQL when the columns are loaded
+                node = ('column', "%s(%s)"%(token[1], ", ".join([x[1] for x in arguments])))
+            else:
+                raise ValueError("Unsupported function in rule '%s': %s"%(expression, token[1]))
+        elif token[0] == 'id':
+            node = ('column', token[1])
+        else:
+            raise ValueError("Unsupported syntax in rule '%s': %s"%(expression, token[1]))
+        # Subscripts and casts
+        while peek() in (('op', '['), ('op', '::')):
+            if take()[1] == '[':
+                index = int(take('num')[1])
+                take('op', ']')
+                node = ('subscript', node, index)
+            else:
+                node = ('cast', node, take('id')[1])
+        return node
+
+    tree = parse_or()
+    if position[0] != len(tokens):
+        raise ValueError("Unsupported syntax in rule '%s' near '%s'"%(expression, peek()[1]))
+    return tree
+
+
+def tree_columns(tree):
+    """Function to get the columns (or expressions computed by PostgreSQL) used in the tree of an expression.
+
+    Args:
+        tree (tuple): The tree of the expression (see function 'parse_expression').
+
+    Returns:
+        set of str: The names of the columns.
+    """
+    if tree[0] == 'column':
+        return set([tree[1]])
+    columns = set()
+    for x in tree[1:]:
+        if isinstance(x, tuple):
+            columns |= tree_columns(x)
+        elif isinstance(x, list):
+            [columns.update(tree_columns(y)) for y in x]
+    return columns
+
+
+def make_value(values):
+    """Function to convert a list of values read from PostgreSQL into the columnar representation used by the function 'evaluate'.
+
+    Args:
+        values (list): List of values (None for NULL).
+
+    Returns:
+        tuple: The value (kind, data, null), where kind is 'num' (integer array for integers, float array otherwise), 'text' (object array), 
+        'bool' (boolean array) or 'array' (object array of lists), and null is the boolean array of NULL values.
+    """
+    null = np.array([x is None for x in values], dtype=bool)
+    sample = next((x for x in values if x is not None), None)
+    if isinstance(sample, bool):
+        return ('bool', np.array([bool(x) for x in values], dtype=bool), null)
+    if isinstance(sample, list):
+        return ('array', np.array(values + [None], dtype=object)[:-1], null)
+    if isinstance(sample, str):
+        return ('text', np.array(values, dtype=object), null)
+    if isinstance(sample, int):
+        return ('num', np.array([0 if x is None else x for x in values], dtype=np.int64), null)
+    return ('num', np.array([np.nan if x is None else float(x) for x in values], dtype=float), null)
+
+
+def constant(kind, value, n):
+    """Function to repeat a literal value for all rows.
+
+    Args:
+        kind (str): Kind of the value ('num', 'text', 'bool' or 'null').
+        value: The literal value.
+        n (int): Number of rows.
+
+    Returns:
+        tuple: The value (kind, data, null).
+    """
+    if kind == 'null':
+        return ('num', np.full(n, np.nan), np.ones(n, dtype=bool))
+    if kind == 'num':
+        return ('num', np.full(n, value, dtype=np.int64 if isinstance(value, int) else float), np.zeros(n, dtype=bool))
+    if kind == 'bool':
+        return ('bool', np.full(n, value, dtype=bool), np.zeros(n, dtype=bool))
+    data = np.empty(n, dtype=object)
+    data[:] = value
+    return ('text', data, np.zeros(n, dtype=bool))
+
+
+def compare_values(operator, left, right):
+    """Function to compare two values with the SQL semantic (NULL if one of the values is NULL).
+
+    Args:
+        operator (str): The comparison operator.
+        left (tuple): The left value (kind, data, null).
+        right (tuple): The right value (kind, data, null).
+
+    Returns:
+        tuple: The boolean value (kind, data, null).
+    """
+    null = left[2] | right[2]
+    if null.all():
+        return ('bool', np.zeros(len(null), dtype=bool), null)
+    a, b = left[1], right[1]
+    if left[0] != right[0]:
+        # Text literals compared with numbers are casted, as PostgreSQL does with unknown literals
+        if left[0] == 'num' and right[0] == 'text':
+            b = np.array([np.nan if x is None else float(x) for x in b], dtype=float)
+        elif left[0] == 'text' and right[0] == 'num':
+            a = np.array([np.nan if x is None else float(x) for x in a], dtype=float)
+        elif 'bool' in (left[0], right[0]) and 'text' in (left[0], right[0]):
+            a, b = [np.array([x if not isinstance(x, str) else x.lower() in ('t', 'true', 'y', 'yes', 'on', '1') for x in y], dtype=object) for y in (a, b)]
+    if a.dtype == object or b.dtype == object:
+        # NULL values are replaced so that the comparison does not fail, the result being NULL anyway
+        a = np.where(left[2], '' if left[0] != 'num' else 0, a) if a.dtype == object else a
+        b = np.where(right[2], '' if right[0] != 'num' else 0, b) if b.dtype == object else b
+    operators = {'=': np.equal, '<>': np.not_equal, '<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal}
+    with np.errstate(invalid='ignore'):
+        data = np.array(operators[operator](a, b), dtype=bool)
+    return ('bool', data & ~null, null)
+
+
+def explode_array(array):
+    """Function to explode an array value in one value by element, so that the elements of all rows are compared at once. The result 
+    is cached (see 'exploded_cache') as long as the column is kept in memory, since the same columns are used by many rules.
+
+    Args:
+        array (tuple): The array value (kind, data, null).
+
+    Returns:
+        tuple: The number of the row of each element (int array) and the value (kind, data, null) of the elements.
+    """
+    cached = exploded_cache.get(id(array[1]))
+    if cached is not None and cached[0] is array[1]:
+        return cached[1], cached[2]
+    lengths = np.array([0 if x is None else len(x) for x in array[1]], dtype=np.int64)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    elements = [y for x in array[1] if x is not None for y in x]
+    value = make_value(elements) if elements else ('text', np.empty(0, dtype=object), np.empty(0, dtype=bool))
+    exploded_cache[id(array[1])] = (array[1], rows, value)
+    return rows, value
+
+
+def to_bool(value):
+    """Function to check that a value is boolean.
+
+    Args:
+        value (tuple): The value (kind, data, null).
+
+    Returns:
+        tuple: The boolean value (kind, data, null).
+    """
+    if value[0] == 'bool':
+        return value
+    if value[0] == 'num' and value[2].all():
+        return ('bool', np.zeros(len(value[2]), dtype=bool), value[2])
+    raise ValueError("A boolean expression is expected")
+
+
+def evaluate(tree, data, n):
+    """Function to evaluate the tree of an expression for all rows, with the three-valued logic of SQL.
+
+    Args:
+        tree (tuple): The tree of the expression (see function 'parse_expression').
+        data (dict): Dictionnary with the value (kind, data, null) of each column.
+        n (int): Number of rows.
+
+    Returns:
+        tuple: The value (kind, data, null) of the expression.
+    """
+    node = tree[0]
+    if node == 'literal':
+        return constant(tree[1], tree[2], n)
+    if node == 'column':
+        return data[tree[1]]
+    if node in ('and', 'or'):
+        a, b = to_bool(evaluate(tree[1], data, n)), to_bool(evaluate(tree[2], data, n))
+        a_true, a_false = a[1] & ~a[2], ~a[1] & ~a[2]
+        b_true, b_false = b[1] & ~b[2], ~b[1] & ~b[2]
+        if node == 'and':
+            true, false = a_true & b_true, a_false | b_false
+        else:
+            true, false = a_true | b_true, a_false & b_false
+        return ('bool', true, ~(true | false))
+    if node == 'not':
+        a = to_bool(evaluate(tree[1], data, n))
+        return ('bool', ~a[1] & ~a[2], a[2])
+    if node == 'compare':
+        return compare_values(tree[1], evaluate(tree[2], data, n), evaluate(tree[3], data, n))
+    if node == 'isnull':
+        a = evaluate(tree[1], data, n)
+        return ('bool', ~a[2] if tree[2] else a[2].copy(), np.zeros(n, dtype=bool))
+    if node == 'istrue':
+        a = to_bool(evaluate(tree[1], data, n))
+        result = ~a[2] & (a[1] == tree[2])
+        return ('bool', ~result if tree[3] else result, np.zeros(n, dtype=bool))
+    if node == 'arith':
+        a, b = evaluate(tree[2], data, n), evaluate(tree[3], data, n)
+        if a[0] != 'num' or b[0] != 'num':
+            raise ValueError("Arithmetic is only supported on numbers")
+        null = a[2] | b[2]
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            if tree[1] == '+':
+                result = a[1] + b[1]
+            elif tree[1] == '-':
+                result = a[1] - b[1]
+            elif tree[1] == '*':
+                result = a[1] * b[1]
+            else:
+                # PostgreSQL raises an error on a division by zero, and truncates the division of two integers
+                if ((b[1] == 0) & ~null).any():
+                    raise ZeroDivisionError("division by zero")
+                divisor = np.where(null, 1, b[1])
+                if a[1].dtype.kind == 'i' and b[1].dtype.kind == 'i':
+                    result = np.sign(a[1]) * np.sign(divisor) * (np.abs(a[1]) // np.abs(divisor))
+                else:
+                    result = a[1] / divisor
+        if result.dtype.kind == 'i':
+            return ('num', result, null)
+        # Rounding removes the floating point noise of decimal values (e.g. 0.3 + 0.2)
+        return ('num', np.round(result, 10), null)
+    if node == 'cardinality':
+        a = evaluate(tree[1], data, n)
+        return ('num', np.array([0 if x is None else len(x) for x in a[1]], dtype=np.int64), a[2].copy())
+    if node == 'subscript':
+        a = evaluate(tree[1], data, n)
+        index = tree[2]
+        values = [x[index - 1] if x is not None and 1 <= index <= len(x) else None for x in a[1]]
+        return make_value(values) if any([x is not None for x in values]) else constant('null', None, n)
+    if node == 'cast':
+        a = evaluate(tree[1], data, n)
+        if tree[2] in ('numeric', 'integer', 'int', 'bigint', 'smallint', 'real', 'float', 'double', 'decimal'):
+            values = a[1].astype(float) if a[0] == 'num' else np.array([np.nan if x is None else float(x) for x in np.where(a[2], None, a[1])], dtype=float)
+            if tree[2] in ('integer', 'int', 'bigint', 'smallint'):
+                # Casts to integer round half away from zero, as PostgreSQL does
+                values = np.where(a[2], 0, np.sign(values) * np.floor(np.abs(values) + 0.5)).astype(np.int64)
+            return ('num', values, a[2])
+        if tree[2] in ('text', 'varchar'):
+            return ('text', np.array([None if null else str(x) for x, null in zip(a[1], a[2])], dtype=object), a[2])
+        raise ValueError("Unsupported cast: %s"%tree[2])
+    if node == 'quantified':
+        operator, quantifier = tree[1], tree[2]
+        a, array = evaluate(tree[3], data, n), evaluate(tree[4], data, n)
+        if array[0] != 'array' and not array[2].all():
+            raise ValueError("ANY/ALL is only supported on array columns")
+        if array[0] != 'array':
+            return ('bool', np.zeros(n, dtype=bool), np.ones(n, dtype=bool))
+        # Comparison of all elements at once, then counts of the elements true, false and NULL by row
+        rows, elements = explode_array(array)
+        if len(rows) == 0:
+            # ANY of an empty array is false and ALL of an empty array is true
+            true, null = np.full(n, quantifier == 'all'), np.zeros(n, dtype=bool)
+        else:
+            b = compare_values(operator, (a[0], a[1][rows], a[2][rows]), elements)
+            has_true = np.bincount(rows[b[1]], minlength=n) > 0
+            has_null = np.bincount(rows[b[2]], minlength=n) > 0
+            has_false = np.bincount(rows[~b[1] & ~b[2]], minlength=n) > 0
+            # Rows without elements (empty arrays) are false with ANY and true with ALL
+            if quantifier == 'any':
+                true, null = has_true, ~has_true & has_null
+            else:
+                true, null = ~has_false & ~has_null, ~has_false & has_null
+        # NULL arrays give NULL
+        true, null = true & ~array[2], null | array[2]
+        return ('bool', true, null)
+    if node == 'in':
+        a = evaluate(tree[1], data, n)
+        true = np.zeros(n, dtype=bool)
+        null = np.zeros(n, dtype=bool)
+        for item in tree[2]:
+            b = compare_values('=', a, evaluate(item, data, n))
+            true |= b[1]
+            null |= b[2]
+        null = null & ~true
+        if tree[3]:
+            return ('bool', ~true & ~null, null)
+        return ('bool', true, null)
+    if node == 'like':
+        a = evaluate(tree[1], data, n)
+        # A backslash escapes the next character of the pattern (default escape character of PostgreSQL)
+        pattern = "".join(['.*' if x == '%' else '.' if x == '_' else re.escape(x[-1]) 
+                           for x in re.findall(r'\\.|.', tree[2], re.DOTALL)])
+        regex = re.compile(pattern + r'\Z', re.IGNORECASE | re.DOTALL if tree[4] else re.DOTALL)
+        # The pattern is matched once by distinct value
+        result = np.zeros(n, dtype=bool)
+        if not a[2].all():
+            distinct, inverse = np.unique(np.array([str(x) for x in a[1][~a[2]]], dtype=object), return_inverse=True)
+            result[~a[2]] = np.array([regex.match(x) is not None for x in distinct], dtype=bool)[inverse.ravel()]
+        return ('bool', ~result & ~a[2] if tree[3] else result, a[2].copy())
+    raise ValueError("Unsupported expression: %s"%node)
+
+
+def load_rule_columns(con, stats_table_schema, stats_table_name, columns, key_column='capakey', reload=False):
+    """Function to load columns of a statistics table in memory. The columns are cached (see 'column_cache'), ordered by the key column, 
+    and only the columns not yet loaded are read from the database.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        stats_table_schema (str): Name of the schema where to find the table containing all statistics used in the classification rules.
+        stats_table_name (str): Name of the table containing all statistics used in the classification rules.
+        columns (list of str): List of the columns (or expressions, e.g. 'st_area(geom)') to be loaded.
+        key_column (str): Name of the column with unique id of the rows. Default value is 'capakey'.
+        reload (bool): If True, the cache of the table is emptied and all columns are read again. Default value is False.
+
+    Returns:
+        dict: The cache of the table, with the list of keys ('key') and the value (kind, data, null) of each column ('columns').
+    """
+    cache_key = (stats_table_schema, stats_table_name, key_column)
+    if reload or cache_key not in column_cache:
+        column_cache[cache_key] = {'key': None, 'columns': {}}
+    cache = column_cache[cache_key]
+    missing = sorted([x for x in columns if x not in cache['columns']])
+    if cache['key'] is None or missing:
+        begintime = time.time()
+        query = "SELECT {key}{columns} FROM {schema}.{table} ORDER BY {key};"
+        query = query.format(key=key_column, columns="".join([", %s"%x for x in missing]), schema=stats_table_schema, table=stats_table_name)
+        print(query + "\n")
+        cursor = con.cursor()
+        cursor.execute(query)
+        rows = cursor.fetchall()
+        cursor.close()
+        keys = [x[0] for x in rows]
+        if cache['key'] is not None and keys != cache['key']:
+            # The table changed since the first load: all columns are loaded again
+            return load_rule_columns(con, stats_table_schema, stats_table_name, list(set(columns) | set(cache['columns'])), key_column, reload=True)
+        cache['key'] = keys
+        for i, column in enumerate(missing, 1):
+            cache['columns'][column] = make_value([x[i] for x in rows])
+        print(print_processing_time(begintime, "%s columns loaded in "%len(missing)))
+    return cache
+
+
+def evaluate_rules(con, stats_table_schema, stats_table_name, list_rules, key_column='capakey', reload=False):
+    """Function to evaluate the rules of a rule-based decision-tree classification in memory, with numpy arrays, instead of PostgreSQL 
+    (see function 'decision_tree_classification'). The columns used by the rules are loaded once and cached between calls, so that the rules 
+    can be tuned quickly. Each rule is evaluated as a boolean mask on the rows not yet classified (first rule matching), with the three-valued 
+    logic of SQL. The results can be written in the database with the function 'write_rule_results'.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        stats_table_schema (str): Name of the schema where to find the table containing all statistics used in the classification rules.
+        stats_table_name (str): Name of the table containing all statistics used in the classification rules.
+        list_rules (list of tupple): List of tuples containing the classification rules (see function 'decision_tree_classification'). 
+        The SQL supported is described in the function 'parse_expression'.
+        key_column (str): Name of the column with unique id of the rows. Default value is 'capakey'.
+        reload (bool): If True, all columns are read again from the database. Default value is False.
+
+    Returns:
+        dict: Dictionnary with the list of keys ('key'), the array of labels ('label') and the array of rule numbers ('leaf').
+    """
+    try:
+        begintime = time.time()
+        # Translation of the rules
+        trees = [(parse_expression(when), parse_expression(then)) for when, then in list_rules]
+        columns = set()
+        [columns.update(tree_columns(when) | tree_columns(then)) for when, then in trees]
+        cache = load_rule_columns(con, stats_table_schema, stats_table_name, columns, key_column, reload)
+        data = cache['columns']
+        n = len(cache['key'])
+        # First rule matching each row
+        label = np.empty(n, dtype=object)
+        label[:] = '6_6_A'
+        leaf = np.full(n, len(list_rules) + 1, dtype=np.int64)
+        remaining = np.ones(n, dtype=bool)
+        for i, (when, then) in enumerate(trees, 1):
+            condition = to_bool(evaluate(when, data, n))
+            mask = remaining & condition[1] & ~condition[2]
+            if mask.any():
+                value = evaluate(then, data, n)
+                if value[0] == 'num':
+                    labels = [None if null else ('%d'%x if x == int(x) else repr(x)) for x, null in zip(value[1][mask], value[2][mask])]
+                else:
+                    labels = [None if null else str(x) for x, null in zip(value[1][mask], value[2][mask])]
+                label[mask] = labels
+                leaf[mask] = i
+            remaining &= ~mask
+        print(print_processing_time(begintime, "Evaluation of %s rules on %s rows achieved in "%(len(list_rules), n)))
+        return {'key': cache['key'], 'label': label, 'leaf': leaf}
+    except (Exception, psycopg2.DatabaseError) as error:
+        sys.exit(error)
+
+
+def write_rule_results(con, result_table_schema, result_table_name, results, colum_label="walousmaj", colum_leaf="rulebased_leaf", 
+                       key_column='capakey', stats_table_schema=None, stats_table_name=None):
+    """Function to write the results of the function 'evaluate_rules' in the database with one COPY. If the statistics table is provided, 
+    the result table is then created with all columns of the statistics table followed by the label and the rule number, as the table created 
+    by the function 'decision_tree_classification'. Otherwise the result table contains only the key, the label and the rule number.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        result_table_schema (str): Name of the schema on which the new table with classification results will be created.
+        result_table_name (str): Name of the table with classification results to be created.
+        results (dict): The results of the function 'evaluate_rules'.
+        colum_label (str): Name of the column that will contain the label. Default value is 'walousmaj'. 
+        colum_leaf (str): Name of the column that will contain the number of the rule. Default value is 'rulebased_leaf'.
+        key_column (str): Name of the column with unique id of the rows. Default value is 'capakey'.
+        stats_table_schema (str): Name of the schema where to find the table containing all statistics. Default value is None.
+        stats_table_name (str): Name of the table containing all statistics. Default value is None.
+
+    Returns:
+        This function has no return value. 
+    """
+    try:
+        begintime = time.time()
+        cursor = con.cursor()
+        copy_table = '%s_labels'%result_table_name if stats_table_name else result_table_name
+        query = "DROP TABLE IF EXISTS {schema}.{table}; CREATE TABLE {schema}.{table} ({key} varchar, {label} varchar, {leaf} integer);"
+        query = query.format(schema=result_table_schema, table=copy_table, key=key_column, label=colum_label, leaf=colum_leaf)
+        print(query + "\n")
+        cursor.execute(query)
+        escape = lambda x: "\\N" if x is None else str(x).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+        lines = "".join(["%s\t%s\t%s\n"%(escape(k), escape(l), f) for k, l, f in zip(results['key'], results['label'], results['leaf'])])
+        cursor.copy_expert("COPY {schema}.{table} FROM STDIN".format(schema=result_table_schema, table=copy_table), io.StringIO(lines))
+        if stats_table_name:
+            # Result table with the same columns as the table of 'decision_tree_classification'
+            query = "DROP TABLE IF EXISTS {schema}.{table}; CREATE TABLE {schema}.{table} AS (SELECT s.*, l.{label}, l.{leaf} "
+            query += "FROM {s_schema}.{s_table} AS s LEFT JOIN {schema}.{labels} AS l ON s.{key}::varchar = l.{key}); DROP TABLE {schema}.{labels};"
+            query = query.format(schema=result_table_schema, table=result_table_name, label=colum_label, leaf=colum_leaf, s_schema=stats_table_schema, 
+                                 s_table=stats_table_name, labels=copy_table, key=key_column)
+            print(query + "\n")
+            cursor.execute(query)
+        con.commit()
+        cursor.close()
+        print(print_processing_time(begintime, "Results written in "))
+    except (Exception, psycopg2.DatabaseError) as error:
+        sys.exit(error)
+
+
+def check_rule_parity(con, stats_table_schema, stats_table_name, list_rules, key_column='capakey', results=None, max_examples=10):
+    """Function to check that the in-memory evaluation of the rules (function 'evaluate_rules') gives the same results as PostgreSQL 
+    (function 'decision_tree_classification'). The rows with a different label or rule number are counted and some of them are printed.
+
+    Args:
+        con (psycopg2 connection object): Psycopg connection object generated using psycopg2.connect() or using the custom function "create_PG_connexion" with database connexion parameter.
+        stats_table_schema (str): Name of the schema where to find the table containing all statistics used in the classification rules.
+        stats_table_name (str): Name of the table containing all statistics used in the classification rules.
+        list_rules (list of tupple): List of tuples containing the classification rules.
+        key_column (str): Name of the column with unique id of the rows. Default value is 'capakey'.
+        results (dict): The results of the function 'evaluate_rules'. Default value is None and the rules are evaluated.
+        max_examples (int): Maximum number of rows with differences to be printed. Default value is 10.
+
+    Returns:
+        int: The number of rows with differences.
+    """
+    if results is None:
+        results = evaluate_rules(con, stats_table_schema, stats_table_name, list_rules, key_column)
+    query = decision_tree_select([key_column], stats_table_schema, stats_table_name, list_rules, 'label', 'leaf') + " ORDER BY 1;"
+    cursor = con.cursor()
+    cursor.execute(query)
+    expected = dict([(x[0], (x[1], x[2])) for x in cursor.fetchall()])
+    cursor.close()
+    differences = [(k, expected.get(k), (l, int(f))) for k, l, f in zip(results['key'], results['label'], results['leaf']) if expected.get(k) != (l, int(f))]
+    print("Parity check of %s rules on %s rows: %s rows with differences"%(len(list_rules), len(results['key']), len(differences)))
+    for key, sql, engine in differences[:max_examples]:
+        print("  %s: PostgreSQL %s, in-memory %s"%(key, sql, engine))
+    return len(differences)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+WALOUS_UTS - Copyright (C) <2020> <Service Public de Wallonie (SWP), Belgique,
+					          		Institut Scientifique de Service Public (ISSeP), Belgique,
+									Université catholique de Louvain (UCLouvain), Belgique,
+									Université Libre de Bruxelles (ULB), Belgique>
+						 							
+	
+List of the contributors to the development of WALOUS_UTS: see LICENSE file.
+Description and complete License: see LICENSE file.
+	
+This program (WALOUS_UTS) is free software:
+you can redistribute it and/or modify it under the terms of the
+GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option)
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program (see COPYING file).  If not,
+see <http://www.gnu.org/licenses/>.
+"""
+
+
+import os
+import sys
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SRC'))
+from rule_engine import tokenize, parse_expression, evaluate, make_value
+
+
+def run(expression, columns):
+    """Function to evaluate an expression on columns given as lists of values (None for NULL).
+
+    Args:
+        expression (str): The SQL expression.
+        columns (dict): Dictionnary with the list of values of each column.
+
+    Returns:
+        list: The value of each row (None for NULL).
+    """
+    n = len(next(iter(columns.values())))
+    data = dict([(k, make_value(v)) for k, v in columns.items()])
+    kind, values, null = evaluate(parse_expression(expression), data, n)
+    return [None if y else (bool(x) if kind == 'bool' else x) for x, y in zip(values, null)]
+
+
+def test_tokenize():
+    assert tokenize("Cardinality(all_hilucs) >= 2 AND \"Dbris_Maj\" <> 'it''s'") == [
+        ('id', 'cardinality'), ('op', '('), ('id', 'all_hilucs'), ('op', ')'), ('op', '>='), ('num', '2'), ('kw', 'AND'), 
+        ('id', 'Dbris_Maj'), ('op', '<>'), ('str', "it's")]
+    with pytest.raises(ValueError):
+        tokenize("a = 1;")
+
+
+def test_parse_expression():
+    assert parse_expression("a::integer[1]") == ('subscript', ('cast', ('column', 'a'), 'integer'), 1)
+    assert parse_expression("st_area(geom) > 1.5") == ('compare', '>', ('column', 'st_area(geom)'), ('literal', 'num', 1.5))
+    with pytest.raises(ValueError):
+        parse_expression("a = ")
+    with pytest.raises(ValueError):
+        parse_expression("lower(a || b) = 'x'")
+
+
+def test_null_logic():
+    columns = {'a': [True, True, True, False, False, False, None, None, None], 
+               'b': [True, False, None, True, False, None, True, False, None]}
+    assert run("a AND b", columns) == [True, False, None, False, False, False, None, False, None]
+    assert run("a OR b", columns) == [True, True, True, True, False, None, True, None, None]
+    assert run("NOT a", columns) == [False, False, False, True, True, True, None, None, None]
+    assert run("a IS NOT TRUE", columns) == [False, False, False, True, True, True, True, True, True]
+    assert run("a = NULL", columns) == [None] * 9
+
+
+def test_quantified_empty_and_null_arrays():
+    columns = {'all_hilucs': [['5_1', '8_8'], [], None, ['5_1', None], ['5_1']]}
+    assert run("'5_1' = ANY(all_hilucs)", columns) == [True, False, None, True, True]
+    assert run("'5_1' = ALL(all_hilucs)", columns) == [False, True, None, None, True]
+    assert run("'8_8' <> ALL(all_hilucs)", columns) == [False, True, None, None, True]
+    assert run("'5_1' = ANY(all_hilucs)", {'all_hilucs': [[], None]}) == [False, None]
+    assert run("'5_1' = ALL(all_hilucs)", {'all_hilucs': [[], None]}) == [True, None]
+
+
+def test_like():
+    columns = {'dbris_maj': ['2_1', '2A1', '2_11', '21', None, '3_1']}
+    assert run("dbris_maj LIKE '2_1'", columns) == [True, True, False, False, None, False]
+    assert run("dbris_maj LIKE '2%'", columns) == [True, True, True, True, None, False]
+    assert run("dbris_maj NOT LIKE '_1'", columns) == [True, True, True, False, None, True]
+    assert run("dbris_maj ILIKE '2a%'", columns) == [False, True, False, False, None, False]
+    assert run("dbris_maj LIKE '2\\_%'", columns) == [True, False, True, False, None, False]
+    assert run("dbris_maj LIKE '%\\\\'", {'dbris_maj': ['2\\', '2_']}) == [True, False]
+
+
+def test_casts_and_rounding():
+    columns = {'x': [0.5, 1.5, -0.5, -2.5, 2.4, None], 't': ['3', '25', '-1', '0', '7', None]}
+    assert run("x::integer", columns) == [1, 2, -1, -3, 2, None]
+    assert run("t::numeric * 2", columns) == [6.0, 50.0, -2.0, 0.0, 14.0, None]
+    assert run("t::integer::text", columns) == ['3', '25', '-1', '0', '7', None]
+    assert run("x + 0.1 = 0.6", columns) == [True, False, False, False, False, None]
+
+
+def test_division():
+    columns = {'i': [7, -7, 7, None], 'x': [7.0, -7.0, 1.0, 2.0]}
+    assert run("i / 2", columns) == [3, -3, 3, None]
+    assert run("i / 2.0", columns) == [3.5, -3.5, 3.5, None]
+    assert run("x / 2", columns) == [3.5, -3.5, 0.5, 1.0]
+    assert run("i::numeric / 2", columns) == [3.5, -3.5, 3.5, None]
+    assert run("i / 0", {'i': [None, None]}) == [None, None]
+    with pytest.raises(ZeroDivisionError):
+        run("i / 0", columns)
+    with pytest.raises(ZeroDivisionError):
+        run("x / (i - 7)", columns)